@@ -6,25 +6,11 @@
 #    import auxil
 
 import numpy as np  
-import math, ctypes  
-from numpy.ctypeslib import ndpointer
+import math, functools  
 from scipy.special import betainc  
-from numpy.fft import fft2, ifft2, fftshift 
+from scipy import fft as sfft
 import scipy.ndimage.interpolation as ndii 
 
-# wrap the provisional means dll
-lib = ctypes.cdll.LoadLibrary('libprov_means.so')    
-provmeans = lib.provmeans 
-provmeans.restype = None   
-c_double_p = ctypes.POINTER(ctypes.c_double) 
-provmeans.argtypes = [ndpointer(np.float64), 
-                      ndpointer(np.float64),
-                      ctypes.c_int,
-                      ctypes.c_int,
-                      c_double_p,
-                      ndpointer(np.float64),
-                      ndpointer(np.float64)]  
-
 # color table
 ctable = [ 0,0,0,       255,0,0,    0,255,0,     0,0,255, \
            255,255,0,   0,255,255,  255,0,255,   176,48,96, \
@@ -97,28 +83,53 @@ def gaussfilter(sigma,n,m):
 # -----------------
 
 class Cpm(object):
-    '''Provisional means algorithm'''
-    def __init__(self,N):
+    '''Provisional means algorithm, blocked and mergeable
+
+       The weighted mean and scatter matrix of each block of observations
+       are formed with a rank-k (BLAS) update and combined with the running
+       values by the pairwise formulae of Chan et al. (1979), so accumulators
+       filled by separate workers can be merged'''
+    def __init__(self,N,block=65536):
         self.mn = np.zeros(N)
         self.cov = np.zeros((N,N))
-        self.sw = 0.0000001
+        self.sw = 0.0
+        self.block = block
+        
+    def _combine(self,sw,mn,cov):
+        '''merge the weight sum, mean and scatter matrix of another sample'''
+        total = self.sw + sw
+        if total <= 0:
+            return
+        d = mn - self.mn
+        self.mn = self.mn + d*(sw/total)
+        self.cov += cov + np.outer(d,d)*(self.sw*sw/total)
+        self.sw = total
          
     def update(self,Xs,Ws=None):
         n,N = np.shape(Xs)       
-        if Ws is None:
-            Ws = np.ones(n)
-        sw = ctypes.c_double(self.sw)        
-        mn = self.mn
-        cov = self.cov
-        provmeans(Xs,Ws,N,n,ctypes.byref(sw),mn,cov)
-        self.sw = sw.value
-        self.mn = mn
-        self.cov = cov
+        for i in range(0,n,self.block):
+            X = np.asarray(Xs[i:i+self.block],dtype=np.float64)
+            if Ws is None:
+                sw = float(X.shape[0])
+                mn = np.sum(X,axis=0)/sw
+                D = X - mn
+                cov = np.dot(D.T,D)
+            else:
+                W = np.asarray(Ws[i:i+self.block],dtype=np.float64)
+                sw = np.sum(W)
+                if sw <= 0:
+                    continue
+                mn = np.dot(W,X)/sw
+                D = X - mn
+                cov = np.dot(D.T*W,D)
+            self._combine(sw,mn,cov)
+            
+    def merge(self,other):
+        '''add the observations accumulated by another Cpm instance'''
+        self._combine(other.sw,other.mn,other.cov)
           
     def covariance(self):
-        c = np.mat(self.cov/(self.sw-1.0))
-        d = np.diag(np.diag(c))
-        return c + c.T - d
+        return np.asmatrix(self.cov/(self.sw-1.0))
     
     def means(self):
         return self.mn                     
@@ -180,71 +191,157 @@ def geneiv(A,B):
     lambdas,V = np.linalg.eig(C)
     return lambdas, Li.transpose()*V     
 
-def similarity(bn0, bn1):
+@functools.lru_cache(maxsize=8)
+def highpass(shape):
+    """Return highpass filter to be multiplied with fourier transform
+(cached by shape, read only)."""
+    x = np.outer(
+                    np.cos(np.linspace(-math.pi/2., math.pi/2., shape[0])),
+                    np.cos(np.linspace(-math.pi/2., math.pi/2., shape[1])))
+    h = (1.0 - x) * (2.0 - x)    
+    h.setflags(write=False)
+    return h
+
+@functools.lru_cache(maxsize=8)
+def logpolar_grid(shape, angles, radii):
+    """Return log-polar sampling coordinates and log base (cached, read only)."""
+    center = shape[0] / 2, shape[1] / 2
+    theta = np.empty((angles, radii), dtype=np.float64)
+    theta.T[:] = -np.linspace(0, np.pi, angles, endpoint=False)
+#  d = radii
+    d = np.hypot(shape[0]-center[0], shape[1]-center[1])
+    log_base = 10.0 ** (math.log10(d) / (radii))
+    radius = np.empty_like(theta)
+    radius[:] = np.power(log_base, np.arange(radii,
+                                               dtype=np.float64)) - 1.0
+    coords = np.array([radius * np.sin(theta) + center[0],
+                       radius * np.cos(theta) + center[1]])
+    coords.setflags(write=False)
+    return coords, log_base
+
+def logpolar(image, angles=None, radii=None):
+    """Return log-polar transformed image and log base."""
+    shape = image.shape
+    if angles is None:
+        angles = shape[0]
+        if radii is None:
+            radii = shape[1]
+    coords, log_base = logpolar_grid(shape, angles, radii)
+    output = np.empty(coords.shape[1:])
+    ndii.map_coordinates(image, coords, output=output)
+    return output, log_base
+
+def magnitude(band):
+    """Return fftshift(abs(fft2(band))) for a real band, via the real FFT."""
+    m, n = band.shape
+    r = np.abs(sfft.rfft2(band, workers=-1))
+    f = np.empty((m, n))
+    f[:, :n//2+1] = r
+#  |F(k,l)| = |F(-k,-l)|    
+    l = np.arange(n//2+1, n)
+    f[:, l] = r[(-np.arange(m)) % m][:, n-l]
+    return sfft.fftshift(f)
+
+def decimate(band, levels):
+    """Return band reduced by 2x2 block averaging levels times."""
+    for _ in range(levels):
+        m, n = band.shape[0]//2, band.shape[1]//2
+        band = band[:2*m, :2*n].reshape(m, 2, n, 2).mean(axis=(1, 3))
+    return band
+
+def similarity_reference(bn0, pyramid=0):
+    """Return the spectra of reference band bn0 used by similarity(),
+so that they are computed only once when registering several bands to bn0.
+With pyramid > 0 the spectrum of bn0 decimated pyramid times is included
+for a coarse estimate of scale and angle."""
+    ref = {'shape':bn0.shape, 'pyramid':pyramid}
+    for key, band in (('', bn0), ('coarse_', decimate(bn0, pyramid) if pyramid > 0 else None)):
+        if band is None:
+            continue
+        f0 = magnitude(band)
+        f0 *= highpass(f0.shape)
+#      keep the angular resolution of the full band
+        f0, log_base = logpolar(f0, sfft.next_fast_len(bn0.shape[0], real=True), 
+                                    sfft.next_fast_len(f0.shape[1], real=True))
+        ref[key+'logpolar'] = sfft.rfft2(f0, workers=-1)
+        ref[key+'log_base'] = log_base
+#  translation spectrum, zero padded to a fast size
+    fshape = tuple(sfft.next_fast_len(i, real=True) for i in bn0.shape)
+    ref['fft'] = sfft.rfft2(bn0, fshape, workers=-1)
+    return ref
+
+def scale_angle(f0, f1, lpshape, log_base, near=None, width=(0, 0)):
+    """Return (scale, angle) from the phase correlation of the log-polar 
+spectra f0, f1 of shape lpshape. If near = (scale, angle) is given, the 
+peak is searched within width = (angle bins, scale bins) of it."""
+    r0 = abs(f0) * abs(f1)
+    best = None
+    for sign in (1, -1):
+        if sign == 1:
+            ir = abs(sfft.irfft2((f0 * f1.conjugate()) / r0, lpshape, workers=-1))
+        else:
+            ir = abs(sfft.irfft2((f1 * f0.conjugate()) / r0, lpshape, workers=-1))
+        if near is not None:
+            a0 = int(round(sign * near[1] * lpshape[0] / 180.0))
+            s0 = int(round(sign * math.log(near[0]) / math.log(log_base)))
+            rows = np.arange(a0 - width[0], a0 + width[0] + 1) % lpshape[0]
+            cols = np.arange(max(s0 - width[1], 0), max(min(s0 + width[1] + 1, lpshape[1]), 0))
+            if cols.size == 0:
+                continue
+            window = ir[np.ix_(rows, cols)]
+            j0, j1 = np.unravel_index(np.argmax(window), window.shape)
+            i0, i1, peak = rows[j0], cols[j1], window[j0, j1]
+        else:
+            i0, i1 = np.unravel_index(np.argmax(ir), ir.shape)
+            peak = ir[i0, i1]
+        angle = sign * 180.0 * i0 / lpshape[0]
+        scale = log_base ** (sign * i1)
+        if near is None:
+            if sign == 1 and scale <= 1.8:
+                return scale, angle
+            if sign == -1:
+                return scale, angle
+        elif best is None or peak > best[0]:
+            best = (peak, scale, angle)
+    return best[1], best[2]
+
+def similarity(bn0, bn1, ref=None, pyramid=0):
     """Register bn1 to bn0 ,  M. Canty 2012
 bn0, bn1 and returned result are image bands      
+ref (optional) is similarity_reference(bn0,pyramid), bn0 is then not used
+pyramid (optional) estimate scale and angle on bands decimated pyramid times
+and refine them at full resolution within the uncertainty of that estimate
 Modified from Imreg.py, see http://www.lfd.uci.edu/~gohlke/:
  Copyright (c) 2011-2012, Christoph Gohlke
  Copyright (c) 2011-2012, The Regents of the University of California
  Produced at the Laboratory for Fluorescence Dynamics
  All rights reserved.    
     """
- 
-    def highpass(shape):
-        """Return highpass filter to be multiplied with fourier transform."""
-        x = np.outer(
-                        np.cos(np.linspace(-math.pi/2., math.pi/2., shape[0])),
-                        np.cos(np.linspace(-math.pi/2., math.pi/2., shape[1])))
-        return (1.0 - x) * (2.0 - x)    
-
-    def logpolar(image, angles=None, radii=None):
-        """Return log-polar transformed image and log base."""
-        shape = image.shape
-        center = shape[0] / 2, shape[1] / 2
-        if angles is None:
-            angles = shape[0]
-            if radii is None:
-                radii = shape[1]
-        theta = np.empty((angles, radii), dtype=np.float64)
-        theta.T[:] = -np.linspace(0, np.pi, angles, endpoint=False)
-#      d = radii
-        d = np.hypot(shape[0]-center[0], shape[1]-center[1])
-        log_base = 10.0 ** (math.log10(d) / (radii))
-        radius = np.empty_like(theta)
-        radius[:] = np.power(log_base, np.arange(radii,
-                                                   dtype=np.float64)) - 1.0
-        x = radius * np.sin(theta) + center[0]
-        y = radius * np.cos(theta) + center[1]
-        output = np.empty_like(x)
-        ndii.map_coordinates(image, [x, y], output=output)
-        return output, log_base
-             
-    lines0,samples0 = bn0.shape
+    if ref is None:
+        ref = similarity_reference(bn0, pyramid)
+    lines0,samples0 = ref['shape']
+    pyramid = ref['pyramid']
 #  make reference and warp bands same shape    
     bn1 = bn1[0:lines0,0:samples0]   
-#  get scale, angle      
-    f0 = fftshift(abs(fft2(bn0)))
-    f1 = fftshift(abs(fft2(bn1)))
-    h = highpass(f0.shape)
-    f0 *= h
-    f1 *= h
-    del h
-    f0, log_base = logpolar(f0)
-    f1, log_base = logpolar(f1)
-    f0 = fft2(f0)
-    f1 = fft2(f1)
-    r0 = abs(f0) * abs(f1)
-    ir = abs(ifft2((f0 * f1.conjugate()) / r0))
-    i0, i1 = np.unravel_index(np.argmax(ir), ir.shape)
-    angle = 180.0 * i0 / ir.shape[0]
-    scale = log_base ** i1 
+#  get scale, angle, coarse to fine
+    near = None
+    width = (0, 0)
+    for key, band in (('coarse_', decimate(bn1, pyramid) if pyramid > 0 else None), ('', bn1)):
+        if band is None:
+            continue
+        f1 = magnitude(band)
+        f1 *= highpass(f1.shape)
+        f1, log_base = logpolar(f1, sfft.next_fast_len(lines0, real=True), 
+                                    sfft.next_fast_len(f1.shape[1], real=True))
+        lpshape = f1.shape
+        f1 = sfft.rfft2(f1, workers=-1)
+        scale, angle = scale_angle(ref[key+'logpolar'], f1, lpshape, log_base, near, width)
+        if key:
+#          search the full resolution peak within two coarse bins          
+            near = (scale, angle)
+            width = (2 * 2**pyramid, int(math.ceil(2 * math.log(log_base) / math.log(ref['log_base']))))
     if scale > 1.8:
-        ir = abs(ifft2((f1 * f0.conjugate()) / r0))
-        i0, i1 = np.unravel_index(np.argmax(ir), ir.shape)
-        angle = -180.0 * i0 / ir.shape[0]
-        scale = 1.0 / (log_base ** i1)
-        if scale > 1.8:
-            raise ValueError("Images are not compatible. Scale change > 1.8")
+        raise ValueError("Images are not compatible. Scale change > 1.8")
     if angle < -90.0:
         angle += 180.0
     elif angle > 90.0:
@@ -252,20 +349,21 @@ Modified from Imreg.py, see http://www.lfd.uci.edu/~gohlke/:
 #  re-scale and rotate and then get shift                   
     bn2 = ndii.zoom(bn1, 1.0/scale)
     bn2 = ndii.rotate(bn2, angle)
-    if bn2.shape < bn0.shape:
-        t = np.zeros_like(bn0)
+    if bn2.shape < (lines0,samples0):
+        t = np.zeros((lines0,samples0),dtype=bn2.dtype)
         t[:bn2.shape[0], :bn2.shape[1]] = bn2
         bn2 = t
-    elif bn2.shape > bn0.shape:
-        bn2 = bn2[:bn0.shape[0], :bn0.shape[1]] 
-    f0 = fft2(bn0)
-    f1 = fft2(bn2)
-    ir = abs(ifft2((f0 * f1.conjugate()) / (abs(f0) * abs(f1))))
+    elif bn2.shape > (lines0,samples0):
+        bn2 = bn2[:lines0, :samples0] 
+    f0 = ref['fft']
+    fshape = tuple(sfft.next_fast_len(i, real=True) for i in (lines0,samples0))
+    f1 = sfft.rfft2(bn2, fshape, workers=-1)
+    ir = abs(sfft.irfft2((f0 * f1.conjugate()) / (abs(f0) * abs(f1)), fshape, workers=-1))
     t0, t1 = np.unravel_index(np.argmax(ir), ir.shape)
-    if t0 > f0.shape[0] // 2:
-        t0 -= f0.shape[0]
-    if t1 > f0.shape[1] // 2:
-        t1 -= f0.shape[1]                                               
+    if t0 > fshape[0] // 2:
+        t0 -= fshape[0]
+    if t1 > fshape[1] // 2:
+        t1 -= fshape[1]                                               
 #  return result   
     return (scale,angle,[t0,t1])                 
 
@@ -465,18 +563,25 @@ def linstr(x,rng=None):
 # linear stretch
     return bytestr(x,rng)
     
-def histeqstr(x):
-    x = bytestr(x)
+def bytehist(x,hist=None):
+#  histogram of the byte stretched array x, or the precomputed one hist
+#  (e.g. from auxil.stats.raster_stats with byte=True)
+    if hist is None:
+        hist,bin_edges = np.histogram(x,256,(0,256))
+    return np.asarray(hist), np.arange(257.0)
+    
+def histeqstr(x,rng=None,hist=None):
+    x = bytestr(x,rng)
 #  histogram equalization stretch
-    hist,bin_edges = np.histogram(x,256,(0,256))
+    hist,bin_edges = bytehist(x,hist)
     cdf = hist.cumsum()
     lut = 255*cdf/float(cdf[-1])
     return np.interp(x,bin_edges[:-1],lut)
 
-def lin2pcstr(x):
+def lin2pcstr(x,rng=None,hist=None):
 #  2% linear stretch
-    x = bytestr(x)
-    hist,bin_edges = np.histogram(x,256,(0,256))
+    x = bytestr(x,rng)
+    hist,bin_edges = bytehist(x,hist)
     cdf = hist.cumsum()
     lower = 0
     i = 0
@@ -493,10 +598,10 @@ def lin2pcstr(x):
     fp = np.where(bin_edges>=upper,255,fp)
     return np.interp(x,bin_edges,fp)     
 
-def lin1pcstr(x):
+def lin1pcstr(x,rng=None,hist=None):
 #  1% linear stretch
-    x = bytestr(x)
-    hist,bin_edges = np.histogram(x,256,(0,256))
+    x = bytestr(x,rng)
+    hist,bin_edges = bytehist(x,hist)
     cdf = hist.cumsum()
     lower = 0
     i = 0
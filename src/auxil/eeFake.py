@@ -0,0 +1,860 @@
+'''
+Created on 17.10.2020
+
+Offline stand-in for the Earth Engine python API (ee) for testing and
+profiling the eeWishart and eeSar_seq modules without credentials.
+
+Expressions are built lazily as in the real API. The serialized graph is
+deduplicated structurally, and getInfo() evaluates the graph locally with
+NumPy on synthetic assets. Every server round trip (getInfo, getMapId,
+task start) is counted, and so are the serialized graph size and the
+number of evaluated calls, so handlers can be compared offline.
+
+Only the subset of Image, ImageCollection, List, Dictionary, Number,
+Geometry, Filter, Reducer and batch operations used by those modules is
+implemented.
+
+usage:
+    import sys
+    from auxil import eeFake
+    sys.modules['ee'] = eeFake
+    eeFake.synthetic_s1()
+    from auxil import eeSar_seq
+    record = eeFake.profile(eeSar_seq.on_collect_button_clicked,None)
+
+@author: mort
+'''
+
+import json, math, time, datetime, itertools
+import numpy as np
+from scipy import ndimage, special
+
+# counters of the current profile
+counters = {'getInfo':0,'getMapId':0,'tasks':0,'graph_nodes':0,'graph_bytes':0,'evaluations':0}
+# one dictionary of counters per profiled handler
+records = []
+# assets: image id -> _Img, collection id -> list of _Img
+assets = {}
+# started export tasks
+tasks = []
+_task_ids = itertools.count()
+
+def reset():
+    for key in counters:
+        counters[key] = 0
+
+def profile(handler,*args):
+    '''call handler(*args) and return (and record) its counters'''
+    reset()
+    start = time.time()
+    handler(*args)
+    record = dict(counters,handler=getattr(handler,'__name__',str(handler)),seconds=time.time()-start)
+    records.append(record)
+    return record
+
+def Initialize(*args,**kwargs):
+    pass
+
+class EEException(Exception):
+    pass
+
+# ------------
+# graph nodes
+# ------------
+
+class _Node(object):
+    '''literal, call, variable or function node of an expression graph'''
+    def __init__(self,kind,name=None,args=None,value=None,params=None,body=None):
+        self.kind = kind
+        self.name = name
+        self.args = args
+        self.value = value
+        self.params = params
+        self.body = body
+        if kind == 'var':
+            self.fv = frozenset([name])
+        elif kind == 'func':
+            self.fv = body.fv - frozenset(params)
+        elif kind == 'call':
+            self.fv = frozenset().union(*[_fv(a) for a in args])
+        else:
+            self.fv = _fv(value)
+        self.cache = _unset
+
+_unset = object()
+
+def _fv(v):
+    if isinstance(v,_Node):
+        return v.fv
+    elif isinstance(v,ComputedObject):
+        return v._node.fv
+    elif isinstance(v,(list,tuple)):
+        return frozenset().union(*[_fv(a) for a in v])
+    elif isinstance(v,dict):
+        return frozenset().union(*[_fv(a) for a in v.values()])
+    return frozenset()
+
+def _node(v):
+    if isinstance(v,ComputedObject):
+        return v._node
+    if isinstance(v,_Node):
+        return v
+    return _Node('lit',value=v)
+
+def _wrap(cls,node):
+    '''a cls object for node, bypassing the client constructor'''
+    obj = cls.__new__(cls)
+    obj._node = node
+    return obj
+
+def _call(cls,name,*args,**kwargs):
+    '''wrap a call of name with arguments (this, args..., kwargs) as a cls object'''
+    return _wrap(cls,_Node('call',name,[_node(a) for a in args]+[_node(kwargs)]))
+
+_counter = [0]
+
+def _function(fn,nargs,types):
+    '''trace a python callable into a function node with nargs arguments'''
+    _counter[0] += 1
+    params = ['_MAPPING_VAR_%i_%i'%(_counter[0],i) for i in range(nargs)]
+    body = fn(*[_wrap(t,_Node('var',p)) for t,p in zip(types,params)])
+    return _Node('func',params=params,body=_node(body))
+
+# -------------
+# serialization
+# -------------
+
+class serializer(object):
+    @staticmethod
+    def toJSON(obj,opt_pretty=False):
+        '''compound serialization, structurally equal subgraphs are stored once'''
+        values = {}
+        keys = {}
+        refs = {}
+        def encode(v):
+            if isinstance(v,(ComputedObject,_Node)):
+                n = _node(v)
+                if n.kind == 'lit':
+                    return encode(n.value)
+                if n.kind == 'var':
+                    return {'argumentReference':n.name}
+                if id(n) in refs:
+                    return refs[id(n)]
+                if n.kind == 'func':
+                    enc = {'functionDefinitionValue':{'argumentNames':n.params,'body':encode(n.body)}}
+                else:
+                    enc = {'functionInvocationValue':{'functionName':n.name,
+                           'arguments':{str(i):encode(a) for i,a in enumerate(n.args)}}}
+                s = json.dumps(enc,sort_keys=True)
+                if s not in keys:
+                    keys[s] = str(len(keys))
+                    values[keys[s]] = enc
+                refs[id(n)] = {'valueReference':keys[s]}
+                return refs[id(n)]
+            if isinstance(v,(list,tuple)):
+                return {'arrayValue':{'values':[encode(a) for a in v]}}
+            if isinstance(v,dict):
+                return {'dictionaryValue':{'values':{str(k):encode(a) for k,a in v.items()}}}
+            if isinstance(v,np.generic):
+                v = v.item()
+            return {'constantValue':v}
+        result = encode(obj)
+        return json.dumps({'result':result,'values':values},indent=2 if opt_pretty else None)
+
+def _graph_nodes(obj):
+    return len(json.loads(serializer.toJSON(obj))['values'])
+
+# ----------
+# evaluation
+# ----------
+
+class _Func(object):
+    '''a traced function with its closure environment'''
+    def __init__(self,node,env):
+        self.node = node
+        self.env = env
+    def __call__(self,*args):
+        env = dict(self.env)
+        env.update(zip(self.node.params,args))
+        return _eval(self.node.body,env,{})
+
+def evaluate(v,env=None,memo=None):
+    return _eval(v,env or {},{} if memo is None else memo)
+
+def _eval(v,env,memo):
+    if isinstance(v,ComputedObject):
+        v = v._node
+    if isinstance(v,_Node):
+        if not v.fv and v.cache is not _unset:
+            return v.cache
+        if v.fv and id(v) in memo:
+            return memo[id(v)]
+        if v.kind == 'lit':
+            result = _eval(v.value,env,memo)
+        elif v.kind == 'var':
+            result = env[v.name]
+        elif v.kind == 'func':
+            result = _Func(v,env)
+        elif v.name in _lazy:
+            counters['evaluations'] += 1
+            result = _lazy[v.name](v.args,env,memo)
+        else:
+            counters['evaluations'] += 1
+            args = [_eval(a,env,memo) for a in v.args]
+            with np.errstate(all='ignore'):
+                result = _impl[v.name](*args[:-1],**args[-1])
+        if v.fv:
+            memo[id(v)] = result
+        else:
+            v.cache = result
+        return result
+    if isinstance(v,list):
+        return [_eval(a,env,memo) for a in v]
+    if isinstance(v,tuple):
+        return tuple(_eval(a,env,memo) for a in v)
+    if isinstance(v,dict):
+        return {k:_eval(a,env,memo) for k,a in v.items()}
+    return v
+
+def _info(v):
+    if isinstance(v,_Img):
+        return {'type':'Image','bands':[{'id':b} for b in v.names],'properties':_info(v.props)}
+    if isinstance(v,_Proj):
+        return {'type':'Projection','crs':v.crs,'scale':v.scale}
+    if isinstance(v,np.ndarray):
+        return v.tolist()
+    if isinstance(v,np.generic):
+        return v.item()
+    if isinstance(v,(list,tuple)):
+        return [_info(a) for a in v]
+    if isinstance(v,dict):
+        return {k:_info(a) for k,a in v.items()}
+    return v
+
+# ------------
+# client types
+# ------------
+
+class ComputedObject(object):
+    _methods = {}
+    def __init__(self,node):
+        self._node = _node(node)
+
+    def __getattr__(self,name):
+        for cls in type(self).__mro__:
+            methods = cls.__dict__.get('_methods',{})
+            if name in methods:
+                result = methods[name]
+                qualified = '%s.%s'%(cls.__name__,name)
+                def method(*args,**kwargs):
+                    return _call(_types[result],qualified,self,*args,**kwargs)
+                return method
+        raise AttributeError('%s.%s is not supported offline'%(type(self).__name__,name))
+
+    def getInfo(self):
+        counters['getInfo'] += 1
+        s = serializer.toJSON(self)
+        counters['graph_bytes'] += len(s)
+        counters['graph_nodes'] += len(json.loads(s)['values'])
+        return _info(evaluate(self))
+
+    def serialize(self):
+        return serializer.toJSON(self)
+
+def _cast(cls,arg):
+    '''cast a computed object to cls without a server call, 
+       None if arg is not a computed object'''
+    if isinstance(arg,ComputedObject):
+        return _wrap(cls,arg._node)
+    return None
+
+class Element(ComputedObject):
+    _methods = {'get':'ComputedObject','set':'Element','propertyNames':'List'}
+
+class Number(ComputedObject):
+    _methods = {m:'Number' for m in ('add','subtract','multiply','divide','pow','sqrt','log','exp',
+                                     'mod','abs','round','floor','int','eq','neq','lt','lte','gt','gte',
+                                     'And','Or','Not','min','max')}
+    def __init__(self,arg):
+        c = _cast(Number,arg)
+        super().__init__(c._node if c else _Node('lit',value=arg))
+
+class String(ComputedObject):
+    _methods = {'cat':'String'}
+    def __init__(self,arg):
+        c = _cast(String,arg)
+        super().__init__(c._node if c else _Node('lit',value=arg))
+
+class List(ComputedObject):
+    _methods = {'get':'ComputedObject','slice':'List','add':'List','length':'Number','cat':'List',
+                'reverse':'List','distinct':'List','size':'Number','flatten':'List','sort':'List','contains':'Number'}
+    def __init__(self,arg):
+        c = _cast(List,arg)
+        super().__init__(c._node if c else _Node('lit',value=list(arg)))
+
+    @staticmethod
+    def sequence(start,end=None,step=1,count=None):
+        return _call(List,'List.sequence',start,end,step)
+
+    @staticmethod
+    def repeat(value,count):
+        return _call(List,'List.repeat',value,count)
+
+    def iterate(self,algorithm,first):
+        f = _function(algorithm,2,(ComputedObject,ComputedObject))
+        return _call(ComputedObject,'List.iterate',self,f,first)
+
+    def map(self,algorithm):
+        f = _function(algorithm,1,(ComputedObject,))
+        return _call(List,'List.map',self,f)
+
+class Dictionary(ComputedObject):
+    _methods = {'get':'ComputedObject','set':'Dictionary','values':'List','keys':'List',
+                'combine':'Dictionary','contains':'Number','size':'Number'}
+    def __init__(self,arg=None):
+        c = _cast(Dictionary,arg)
+        super().__init__(c._node if c else _Node('lit',value=dict(arg or {})))
+
+class Date(ComputedObject):
+    _methods = {'millis':'Number'}
+    def __init__(self,arg):
+        c = _cast(Date,arg)
+        super().__init__(c._node if c else _call(Date,'Date',arg)._node)
+
+class Geometry(ComputedObject):
+    _methods = {'coordinates':'List','centroid':'Geometry','bounds':'Geometry','area':'Number',
+                'difference':'Geometry','union':'Geometry','intersection':'Geometry','buffer':'Geometry'}
+    def __init__(self,arg):
+        c = _cast(Geometry,arg)
+        super().__init__(c._node if c else _Node('lit',value=arg))
+
+    @staticmethod
+    def Point(coords,proj=None):
+        return _call(Geometry,'Geometry.Point',coords)
+
+    @staticmethod
+    def Polygon(coords,proj=None):
+        return _call(Geometry,'Geometry.Polygon',coords)
+
+    @staticmethod
+    def MultiPolygon(coords,proj=None):
+        return _call(Geometry,'Geometry.MultiPolygon',coords)
+
+    @staticmethod
+    def Rectangle(coords,proj=None):
+        return _call(Geometry,'Geometry.Rectangle',coords)
+
+class Projection(ComputedObject):
+    _methods = {'nominalScale':'Number','crs':'String'}
+
+class Image(Element):
+    _methods = {m:'Image' for m in ('select','rename','add','subtract','multiply','divide','pow','sqrt',
+                                    'log','log10','exp','abs','eq','neq','lt','lte','gt','gte','And','Or',
+                                    'Not','byte','float','double','toFloat','gammainc','expression',
+                                    'focal_median','focal_mean','where','addBands','clip','updateMask',
+                                    'mask','visualize','reproject','unmask','set','max','min')}
+    _methods.update({'bandNames':'List','reduceRegion':'Dictionary','projection':'Projection',
+                     'geometry':'Geometry'})
+    def __init__(self,arg=None):
+        c = _cast(Image,arg)
+        super().__init__(c._node if c else _call(Image,'Image.load',arg)._node)
+
+    @staticmethod
+    def constant(value):
+        return _call(Image,'Image.constant',value)
+
+    @staticmethod
+    def cat(*images):
+        return _call(Image,'Image.cat',list(images))
+
+    def getMapId(self,vis_params=None):
+        counters['getMapId'] += 1
+        counters['graph_bytes'] += len(serializer.toJSON(self))
+        evaluate(self)
+        return {'mapid':'fake','token':'','tile_fetcher':_TileFetcher()}
+
+class _TileFetcher(object):
+    url_format = 'http://localhost/fake-ee/{z}/{x}/{y}'
+
+class ImageCollection(ComputedObject):
+    _methods = {'filterBounds':'ImageCollection','filterDate':'ImageCollection','filter':'ImageCollection',
+                'sort':'ImageCollection','limit':'ImageCollection','aggregate_array':'List',
+                'first':'Element','toList':'List','mean':'Image','median':'Image','sum':'Image',
+                'reduce':'Image','size':'Number','mosaic':'Image'}
+    def __init__(self,arg):
+        c = _cast(ImageCollection,arg)
+        super().__init__(c._node if c else _call(ImageCollection,'ImageCollection.load',arg)._node)
+
+    def map(self,algorithm):
+        f = _function(algorithm,1,(Image,))
+        return _call(ImageCollection,'ImageCollection.map',self,f)
+
+class Feature(Element):
+    def __init__(self,geometry,properties=None):
+        super().__init__(_call(Feature,'Feature',geometry,properties or {})._node)
+
+class FeatureCollection(ComputedObject):
+    _methods = {'size':'Number','aggregate_array':'List'}
+    def __init__(self,arg):
+        c = _cast(FeatureCollection,arg)
+        super().__init__(c._node if c else _call(FeatureCollection,'FeatureCollection',arg)._node)
+
+class Filter(ComputedObject):
+    @staticmethod
+    def eq(name,value):
+        return _call(Filter,'Filter.eq',name,value)
+
+    @staticmethod
+    def neq(name,value):
+        return _call(Filter,'Filter.neq',name,value)
+
+class Reducer(ComputedObject):
+    @staticmethod
+    def mean():
+        return _call(Reducer,'Reducer.mean')
+
+    @staticmethod
+    def sum():
+        return _call(Reducer,'Reducer.sum')
+
+    @staticmethod
+    def percentile(percentiles):
+        return _call(Reducer,'Reducer.percentile',percentiles)
+
+class Algorithms(object):
+    @staticmethod
+    def If(condition,trueCase,falseCase=None):
+        return _call(ComputedObject,'Algorithms.If',condition,trueCase,falseCase)
+
+class _Task(object):
+    def __init__(self,kind,image,kwargs):
+        self.kind = kind
+        self.image = image
+        self.config = kwargs
+        self.id = 'FAKE%06i'%next(_task_ids)
+        self.state = 'UNSUBMITTED'
+    def start(self):
+        counters['tasks'] += 1
+        counters['graph_bytes'] += len(serializer.toJSON(self.image))
+        self.state = 'READY'
+        tasks.append(self)
+    def status(self):
+        return {'id':self.id,'state':self.state}
+
+class batch(object):
+    class Export(object):
+        class image(object):
+            @staticmethod
+            def toDrive(image,description='myExportImageTask',**kwargs):
+                return _Task('image.toDrive',image,dict(kwargs,description=description))
+            @staticmethod
+            def toAsset(image,description='myExportImageTask',**kwargs):
+                return _Task('image.toAsset',image,dict(kwargs,description=description))
+        class table(object):
+            @staticmethod
+            def toDrive(collection,description='myExportTableTask',**kwargs):
+                return _Task('table.toDrive',collection,dict(kwargs,description=description))
+
+_types = {'ComputedObject':ComputedObject,'Element':Element,'Number':Number,'String':String,
+          'List':List,'Dictionary':Dictionary,'Date':Date,'Geometry':Geometry,'Projection':Projection,
+          'Image':Image,'ImageCollection':ImageCollection,'Feature':Feature,
+          'FeatureCollection':FeatureCollection}
+
+# -------------
+# server values
+# -------------
+
+class _Img(object):
+    '''image value: band names, data[bands,rows,cols] (NaN = masked), properties'''
+    def __init__(self,names,data,props=None,geom=None):
+        self.names = list(names)
+        self.data = np.asarray(data,dtype=np.float64)
+        self.props = dict(props or {})
+        self.geom = geom
+
+class _Proj(object):
+    def __init__(self,crs='EPSG:32632',scale=10.0):
+        self.crs = crs
+        self.scale = scale
+
+def _img(v):
+    '''promote numbers (and booleans) to constant images'''
+    if isinstance(v,_Img):
+        return v
+    if v is None:
+        v = 0
+    v = np.atleast_1d(np.asarray(v,dtype=np.float64))
+    names = ['constant'] if v.size == 1 else ['constant_%i'%i for i in range(v.size)]
+    return _Img(names,v[:,None,None])
+
+def _bandwise(f):
+    def op(a,b):
+        a,b = _img(a),_img(b)
+        out = a if len(a.names) >= len(b.names) else b
+        return _Img(out.names,f(a.data,b.data),a.props,a.geom)
+    return op
+
+def _unary(f):
+    def op(a):
+        a = _img(a)
+        return _Img(a.names,f(a.data),a.props,a.geom)
+    return op
+
+def _band_index(a,sel):
+    if isinstance(sel,(int,np.integer,float)):
+        return [int(sel)]
+    if isinstance(sel,str):
+        return [a.names.index(sel)]
+    return [i for s in sel for i in _band_index(a,s)]
+
+def _select(a,*sel):
+    a = _img(a)
+    idx = _band_index(a,list(sel))
+    return _Img([a.names[i] for i in idx],a.data[idx],a.props,a.geom)
+
+def _rename(a,*names):
+    a = _img(a)
+    if len(names) == 1 and isinstance(names[0],(list,tuple)):
+        names = names[0]
+    return _Img(names,a.data,a.props,a.geom)
+
+def _expression(a,expr,opt_map=None):
+    import re
+    a = _img(a)
+    scope = {'b%i'%i:a.data[i] for i in range(len(a.names))}
+    for key,val in (opt_map or {}).items():
+        scope[key] = _img(val).data[0]
+    code = re.sub(r'b\((\d+)\)',r'b\1',expr)
+    return _Img(['constant'],eval(code,{'__builtins__':{}},scope)[None,...],a.props,a.geom)
+
+def _where(a,test,value):
+    a,test,value = _img(a),_img(test),_img(value)
+    mask = np.nan_to_num(test.data) != 0
+    return _Img(a.names,np.where(mask,value.data,a.data),a.props,a.geom)
+
+def _addBands(a,b,names=None,overwrite=False):
+    a,b = _img(a),_img(b)
+    if names is not None:
+        idx = [b.names.index(n) for n in names]
+        b = _Img([b.names[i] for i in idx],b.data[idx])
+    rows = max(a.data.shape[1],b.data.shape[1])
+    cols = max(a.data.shape[2],b.data.shape[2])
+    adata = np.broadcast_to(a.data,(len(a.names),rows,cols)).copy()
+    bdata = np.broadcast_to(b.data,(len(b.names),rows,cols))
+    anames = list(a.names)
+    extra = []
+    for i,n in enumerate(b.names):
+        if n in anames:
+            if not overwrite:
+                raise EEException('duplicate band name %s'%n)
+            adata[anames.index(n)] = bdata[i]
+        else:
+            extra.append(i)
+    data = np.concatenate([adata,bdata[extra]]) if extra else adata
+    return _Img(anames+[b.names[i] for i in extra],data,a.props,a.geom)
+
+def _cat(images):
+    result = _img(images[0])
+    for b in images[1:]:
+        result = _addBands(result,b)
+    return result
+
+def _focal_median(a,radius=1.5,kernelType='circle',units='pixels',iterations=1):
+    a = _img(a)
+    size = 2*int(radius)+1
+    return _Img(a.names,np.stack([ndimage.median_filter(d,size=size) for d in a.data]),a.props,a.geom)
+
+def _reduceRegion(a,reducer,geometry=None,scale=None,maxPixels=None,**kwargs):
+    a = _img(a)
+    result = {}
+    for n,d in zip(a.names,a.data):
+        v = d[np.isfinite(d)]
+        if reducer[0] == 'mean':
+            result[n] = float(np.mean(v)) if v.size else None
+        elif reducer[0] == 'sum':
+            result[n] = float(np.sum(v))
+        else:
+            for p in reducer[1]:
+                result['%s_p%s'%(n,p)] = float(np.percentile(v,p)) if v.size else None
+    return result
+
+def _reduce_images(images,reducer):
+    data = np.stack([_img(i).data for i in images])
+    first = _img(images[0])
+    if reducer[0] == 'sum':
+        return _Img([n+'_sum' for n in first.names],np.nansum(data,0))
+    return _Img([n+'_mean' for n in first.names],np.nanmean(data,0))
+
+def _load_image(name):
+    if isinstance(name,str):
+        return assets[name]
+    return _img(name)
+
+def _filter_eq(name,value):
+    return lambda props: props.get(name) == value
+
+def _filter_neq(name,value):
+    return lambda props: props.get(name) != value
+
+def _date(d):
+    if isinstance(d,(int,float)):
+        return d
+    t = datetime.datetime.strptime(d[:10],'%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+    return t.timestamp()*1000.0
+
+def _sequence(start,end,step=1):
+    return list(np.arange(start,end+step/2.0,step).tolist()) if end >= start else []
+
+def _ring(g):
+    coords = np.asarray(g['coordinates'],dtype=np.float64).reshape(-1,2)
+    return coords
+
+def _bbox(g):
+    c = _ring(g)
+    if c.size == 0:
+        return None
+    x0,y0 = c.min(0)
+    x1,y1 = c.max(0)
+    return float(x0),float(y0),float(x1),float(y1)
+
+def _bounds(g):
+    b = _bbox(g)
+    if b is None:
+        return {'type':'Polygon','coordinates':[]}
+    x0,y0,x1,y1 = b
+    return {'type':'Polygon','coordinates':[[[x0,y0],[x1,y0],[x1,y1],[x0,y1],[x0,y0]]]}
+
+def _centroid(g):
+    c = _ring(g)
+    return {'type':'Point','coordinates':c.mean(0).tolist() if c.size else [0.0,0.0]}
+
+def _area(g):
+    b = _bbox(g)
+    if b is None:
+        return 0.0
+    x0,y0,x1,y1 = b
+    return (x1-x0)*(y1-y0)*111320.0**2*math.cos(math.radians((y0+y1)/2))
+
+def _multipolygon(coords):
+    return {'type':'MultiPolygon','coordinates':list(coords)}
+
+def _difference(g,h):
+    keep = [c for c in g['coordinates'] if c not in h['coordinates']]
+    return {'type':g['type'],'coordinates':keep}
+
+def _list_get(lst,i):
+    return lst[int(i)]
+
+def _list_slice(lst,start,end=None,step=None):
+    return lst[int(start):None if end is None else int(end)]
+
+def _dict_set(d,key,value):
+    d = dict(d)
+    d[key] = value
+    return d
+
+def _mean_images(images):
+    first = _img(images[0])
+    return _Img(first.names,np.nanmean(np.stack([_img(i).data for i in images]),0),geom=first.geom)
+
+def _collection_sort(images,prop,ascending=True):
+    return sorted(images,key=lambda i: i.props.get(prop),reverse=not ascending)
+
+def _number(f):
+    return lambda a,*b: f(float(a),*[float(x) for x in b])
+
+_impl = {
+    'Image.load': _load_image,
+    'Image.constant': _img,
+    'Image.cat': _cat,
+    'Image.select': _select,
+    'Image.rename': _rename,
+    'Image.bandNames': lambda a: list(_img(a).names),
+    'Image.add': _bandwise(np.add),
+    'Image.subtract': _bandwise(np.subtract),
+    'Image.multiply': _bandwise(np.multiply),
+    'Image.divide': _bandwise(np.divide),
+    'Image.pow': _bandwise(np.power),
+    'Image.max': _bandwise(np.fmax),
+    'Image.min': _bandwise(np.fmin),
+    'Image.eq': _bandwise(lambda x,y: (x==y).astype(float)),
+    'Image.neq': _bandwise(lambda x,y: (x!=y).astype(float)),
+    'Image.lt': _bandwise(lambda x,y: (x<y).astype(float)),
+    'Image.lte': _bandwise(lambda x,y: (x<=y).astype(float)),
+    'Image.gt': _bandwise(lambda x,y: (x>y).astype(float)),
+    'Image.gte': _bandwise(lambda x,y: (x>=y).astype(float)),
+    'Image.And': _bandwise(lambda x,y: ((x!=0)&(y!=0)).astype(float)),
+    'Image.Or': _bandwise(lambda x,y: ((x!=0)|(y!=0)).astype(float)),
+    'Image.Not': _unary(lambda x: (x==0).astype(float)),
+    'Image.sqrt': _unary(np.sqrt),
+    'Image.log': _unary(np.log),
+    'Image.log10': _unary(np.log10),
+    'Image.exp': _unary(np.exp),
+    'Image.abs': _unary(np.abs),
+    'Image.byte': _unary(lambda x: np.where(np.isfinite(x),np.clip(np.floor(np.nan_to_num(x)),0,255),x)),
+    'Image.float': _unary(lambda x: x),
+    'Image.double': _unary(lambda x: x),
+    'Image.toFloat': _unary(lambda x: x),
+    'Image.gammainc': lambda a,b: _Img(_img(a).names,special.gammainc(_img(b).data,_img(a).data),_img(a).props,_img(a).geom),
+    'Image.expression': _expression,
+    'Image.focal_median': _focal_median,
+    'Image.focal_mean': lambda a,radius=1.5,**kw: _Img(_img(a).names,np.stack([ndimage.uniform_filter(d,2*int(radius)+1) for d in _img(a).data])),
+    'Image.where': _where,
+    'Image.addBands': _addBands,
+    'Image.clip': lambda a,geometry=None: _img(a),
+    'Image.updateMask': lambda a,mask: _Img(_img(a).names,np.where(np.nan_to_num(_img(mask).data)!=0,_img(a).data,np.nan),_img(a).props,_img(a).geom),
+    'Image.mask': lambda a,mask=None: _img(a) if mask is None else _impl['Image.updateMask'](a,mask),
+    'Image.unmask': lambda a,value=0,**kw: _Img(_img(a).names,np.nan_to_num(_img(a).data,nan=value),_img(a).props,_img(a).geom),
+    'Image.visualize': lambda a,**kw: _img(a),
+    'Image.reproject': lambda a,crs=None,crsTransform=None,scale=None: _img(a),
+    'Image.reduceRegion': _reduceRegion,
+    'Image.projection': lambda a: _Proj(),
+    'Image.geometry': lambda a,**kw: _img(a).geom,
+    'Image.set': lambda a,*args: _Img(_img(a).names,_img(a).data,dict(_img(a).props,**(args[0] if len(args)==1 else {args[0]:args[1]})),_img(a).geom),
+    'Element.get': lambda a,prop: a.props.get(prop) if isinstance(a,_Img) else a.get(prop),
+    'Element.set': lambda a,*args: _impl['Image.set'](a,*args),
+    'Element.propertyNames': lambda a: list(a.props),
+    'Projection.nominalScale': lambda p: p.scale,
+    'Projection.crs': lambda p: p.crs,
+    'ImageCollection.load': lambda name: list(assets[name]) if isinstance(name,str) else [_img(i) for i in name],
+    'ImageCollection.filterBounds': lambda c,geometry: c,
+    'ImageCollection.filterDate': lambda c,start,end=None: [i for i in c if _date(start) <= i.props.get('system:time_start',0) < (_date(end) if end is not None else np.inf)],
+    'ImageCollection.filter': lambda c,f: [i for i in c if f(i.props)],
+    'ImageCollection.sort': _collection_sort,
+    'ImageCollection.limit': lambda c,n,prop=None,ascending=True: (_collection_sort(c,prop,ascending) if prop else c)[:int(n)],
+    'ImageCollection.aggregate_array': lambda c,prop: [i.props.get(prop) for i in c],
+    'ImageCollection.first': lambda c: c[0] if c else None,
+    'ImageCollection.toList': lambda c,count,offset=0: list(c[int(offset):int(offset)+int(count)]),
+    'ImageCollection.mean': _mean_images,
+    'ImageCollection.median': lambda c: _Img(_img(c[0]).names,np.nanmedian(np.stack([_img(i).data for i in c]),0),geom=_img(c[0]).geom),
+    'ImageCollection.sum': lambda c: _Img(_img(c[0]).names,np.nansum(np.stack([_img(i).data for i in c]),0),geom=_img(c[0]).geom),
+    'ImageCollection.mosaic': lambda c: _img(c[-1]),
+    'ImageCollection.reduce': _reduce_images,
+    'ImageCollection.size': lambda c: len(c),
+    'FeatureCollection': lambda features: list(features),
+    'FeatureCollection.size': lambda c: len(c),
+    'FeatureCollection.aggregate_array': lambda c,prop: [f['properties'].get(prop) for f in c],
+    'Feature': lambda geometry,properties: {'type':'Feature','geometry':geometry,'properties':properties},
+    'Filter.eq': _filter_eq,
+    'Filter.neq': _filter_neq,
+    'Reducer.mean': lambda: ('mean',),
+    'Reducer.sum': lambda: ('sum',),
+    'Reducer.percentile': lambda p: ('percentile',list(p)),
+    'Date': _date,
+    'Date.millis': lambda d: d,
+    'Geometry.Point': lambda coords: {'type':'Point','coordinates':list(coords)},
+    'Geometry.Polygon': lambda coords: {'type':'Polygon','coordinates':list(coords)},
+    'Geometry.MultiPolygon': _multipolygon,
+    'Geometry.Rectangle': lambda c: _bounds({'coordinates':[[c[0],c[1]],[c[2],c[3]]]}),
+    'Geometry.coordinates': lambda g: list(g['coordinates']),
+    'Geometry.centroid': lambda g,**kw: _centroid(g),
+    'Geometry.bounds': lambda g,**kw: _bounds(g),
+    'Geometry.area': lambda g,**kw: _area(g),
+    'Geometry.difference': lambda g,h,**kw: _difference(g,h),
+    'Geometry.union': lambda g,h,**kw: _multipolygon(list(g['coordinates'])+list(h['coordinates'])),
+    'Geometry.intersection': lambda g,h,**kw: g,
+    'Geometry.buffer': lambda g,distance,**kw: g,
+    'Number.add': _number(lambda a,b: a+b),
+    'Number.subtract': _number(lambda a,b: a-b),
+    'Number.multiply': _number(lambda a,b: a*b),
+    'Number.divide': _number(lambda a,b: a/b),
+    'Number.pow': _number(lambda a,b: a**b),
+    'Number.sqrt': _number(math.sqrt),
+    'Number.log': _number(math.log),
+    'Number.exp': _number(math.exp),
+    'Number.mod': _number(math.fmod),
+    'Number.abs': _number(abs),
+    'Number.round': _number(round),
+    'Number.floor': _number(math.floor),
+    'Number.int': _number(int),
+    'Number.min': _number(min),
+    'Number.max': _number(max),
+    'Number.eq': _number(lambda a,b: int(a==b)),
+    'Number.neq': _number(lambda a,b: int(a!=b)),
+    'Number.lt': _number(lambda a,b: int(a<b)),
+    'Number.lte': _number(lambda a,b: int(a<=b)),
+    'Number.gt': _number(lambda a,b: int(a>b)),
+    'Number.gte': _number(lambda a,b: int(a>=b)),
+    'Number.And': _number(lambda a,b: int(bool(a) and bool(b))),
+    'Number.Or': _number(lambda a,b: int(bool(a) or bool(b))),
+    'Number.Not': _number(lambda a: int(not a)),
+    'String.cat': lambda a,b: str(a)+str(b),
+    'List.sequence': _sequence,
+    'List.repeat': lambda value,count: [value]*int(count),
+    'List.get': _list_get,
+    'List.slice': _list_slice,
+    'List.add': lambda lst,x: list(lst)+[x],
+    'List.cat': lambda lst,other: list(lst)+list(other),
+    'List.length': len,
+    'List.size': len,
+    'List.reverse': lambda lst: list(lst)[::-1],
+    'List.distinct': lambda lst: [x for i,x in enumerate(lst) if x not in lst[:i]],
+    'List.flatten': lambda lst: [y for x in lst for y in (x if isinstance(x,list) else [x])],
+    'List.sort': lambda lst: sorted(lst),
+    'List.contains': lambda lst,x: int(x in lst),
+    'Dictionary.get': lambda d,key,defaultValue=None: d.get(key,defaultValue),
+    'Dictionary.set': _dict_set,
+    'Dictionary.values': lambda d,keys=None: [d[k] for k in (keys if keys is not None else sorted(d))],
+    'Dictionary.keys': lambda d: sorted(d),
+    'Dictionary.combine': lambda d,e,overwrite=True: dict(d,**e) if overwrite else dict(e,**d),
+    'Dictionary.contains': lambda d,key: int(key in d),
+    'Dictionary.size': len,
+}
+
+def _lazy_if(args,env,memo):
+    condition = _eval(args[0],env,memo)
+    if isinstance(condition,_Img):
+        condition = bool(np.any(condition.data))
+    return _eval(args[1] if condition else args[2],env,memo)
+
+def _lazy_iterate(args,env,memo):
+    lst = _eval(args[0],env,memo)
+    f = _eval(args[1],env,memo)
+    result = _eval(args[2],env,memo)
+    for x in lst:
+        result = f(x,result)
+    return result
+
+def _lazy_map(args,env,memo):
+    lst = _eval(args[0],env,memo)
+    f = _eval(args[1],env,memo)
+    return [f(x) for x in lst]
+
+_lazy = {'Algorithms.If':_lazy_if,'List.iterate':_lazy_iterate,'List.map':_lazy_map,
+         'ImageCollection.map':_lazy_map}
+
+# ---------------
+# synthetic data
+# ---------------
+
+def synthetic_s1(k=8,rows=60,cols=80,enl=4.4,seed=0,bbox=(6.30,50.90,6.45,50.98),start='2018-04-01'):
+    '''register synthetic Sentinel-1 (VV, VH in dB, angle), Sentinel-2 and water mask
+       assets over bbox, with a change in the lower half at the middle of the series'''
+    rng = np.random.default_rng(seed)
+    x0,y0,x1,y1 = bbox
+    geom = _bounds({'coordinates':[[x0,y0],[x1,y1]]})
+    t0 = _date(start)
+    s1 = []
+    for t in range(k):
+        vv = 0.1*np.ones((rows,cols))
+        vh = 0.02*np.ones((rows,cols))
+        if t >= k//2:
+            vv[rows//2:] *= 4
+        vv = vv*rng.gamma(enl,1.0/enl,(rows,cols))
+        vh = vh*rng.gamma(enl,1.0/enl,(rows,cols))
+        angle = np.full((rows,cols),38.0)
+        data = np.stack([10*np.log10(vv),10*np.log10(vh),angle])
+        props = {'system:time_start':t0+t*12*86400000.0,
+                 'relativeOrbitNumber_start':15,
+                 'platform_number':'A' if t%2==0 else 'B',
+                 'orbitProperties_pass':'ASCENDING',
+                 'transmitterReceiverPolarisation':['VV','VH'],
+                 'resolution_meters':10,
+                 'instrumentMode':'IW'}
+        s1.append(_Img(['VV','VH','angle'],data,props,geom))
+    assets['COPERNICUS/S1_GRD'] = s1
+    s2 = _Img(['B8','B4','B3'],rng.uniform(0,5000,(3,rows,cols)),
+              {'system:time_start':t0+86400000.0,'CLOUDY_PIXEL_PERCENTAGE':5.0},geom)
+    assets['COPERNICUS/S2'] = [s2]
+    assets['UMD/hansen/global_forest_change_2015'] = _Img(['datamask'],np.ones((1,rows,cols)),{},geom)
+    return s1
@@ -6,7 +6,8 @@ Created on 21.06.2018
 ipywidget interface to the GEE for sequential SAR change detection
 
 '''
-import ee, time, warnings, math
+import ee, time, warnings, math, sys, threading, contextlib
+from concurrent.futures import ThreadPoolExecutor
 import ipywidgets as widgets
 from IPython.display import display
 from ipyleaflet import (Map,DrawControl,TileLayer,
@@ -35,19 +36,127 @@ def update_figure(fig,line,profile):
 geolocator = photon.Photon(timeout=10)
 
 def get_incidence_angle(image):
-    ''' grab the mean incidence angle '''
-    result = ee.Image(image).select('angle') \
-           .reduceRegion(ee.Reducer.mean(),geometry=poly,maxPixels=1e9) \
-           .get('angle') \
-           .getInfo()
-    if result is not None:
-        return round(result,2)
+    ''' the mean incidence angle (server side), over all of the image 
+        geometry in case of incomplete overlap '''
+    angle = ee.Image(image).select('angle')
+    result = angle.reduceRegion(ee.Reducer.mean(),geometry=poly,maxPixels=1e9).get('angle')
+    return ee.Algorithms.If(result,result,
+                            angle.reduceRegion(ee.Reducer.mean(),maxPixels=1e9).get('angle'))
+
+#  client side caches of evaluated metadata and map ids, emptied by Reset.
+#  Map ids expire on the server, so their tile urls are reused for mapid_lifetime seconds only
+metadata_cache = {}
+mapid_cache = {}
+mapid_lifetime = 3600
+
+def get_metadata(key,metadata):
+    ''' evaluate an ee.Dictionary of metadata in a single round trip, 
+        cached under key '''
+    if key not in metadata_cache:
+        metadata_cache[key] = metadata.getInfo()
+    return metadata_cache[key]
+
+#  button handlers run one at a time on handler_pool, so that Collect and Preview never
+#  see each others partial state, concurrent server requests on request_pool.
+#  Widget changes bump generation, which supersedes the pending handlers
+handler_pool = ThreadPoolExecutor(max_workers=1)
+request_pool = ThreadPoolExecutor(max_workers=8)
+generation = 0
+pending = {}
+#  handlers whose queued requests are replaced by newer ones, exports always run
+superseded = ('on_collect_button_clicked','on_preview_button_clicked')
+state_lock = threading.Lock()
+_local = threading.local()
+
+class Superseded(Exception):
+    def __init__(self):
+        Exception.__init__(self,'request superseded by a widget change')
+
+class _Stdout(object):
+    ''' route print() from background handlers into w_out '''
+    def __init__(self,stdout):
+        self.stdout = stdout
+    def write(self,text):
+        if getattr(_local,'background',False):
+            w_out.append_stdout(text)
+        else:
+            self.stdout.write(text)
+    def flush(self):
+        self.stdout.flush()
+    def __getattr__(self,name):
+        return getattr(self.stdout,name)
+
+@contextlib.contextmanager
+def output():
+    ''' capture output in w_out, background handlers stream it there with append_stdout '''
+    if getattr(_local,'background',False):
+        yield w_out
+    else:
+        with w_out:
+            yield w_out
+
+def check_current():
+    ''' raise Superseded if a widget changed since the handler was started '''
+    if getattr(_local,'generation',generation) != generation:
+        raise Superseded()
+
+def publish(**state):
+    ''' set the module globals computed by a handler, unless it has been superseded '''
+    with state_lock:
+        check_current()
+        globals().update(state)
+
+def widget_values():
+    ''' the current values of all widgets, the inputs of every handler '''
+    return tuple((name,repr(widget.value)) for name,widget in sorted(globals().items()) 
+                 if name.startswith('w_') and hasattr(widget,'value'))
+
+def background(handler):
+    ''' on_click callback running handler on handler_pool. Clicks are ignored 
+        while an identical request (same handler, generation and widget values) 
+        is pending, otherwise a queued Collect or Preview is replaced '''
+    def run(gen,b):
+        _local.background = True
+        _local.generation = gen
+        try:
+            handler(b)
+        finally:
+            _local.background = False
+            del _local.generation
+    def on_click(b):
+        if not isinstance(sys.stdout,_Stdout):
+            sys.stdout = _Stdout(sys.stdout)
+        key = (generation,widget_values())
+        future = pending.get(handler.__name__)
+        if future is not None and not future.done():
+            if future.key == key:
+                return
+            if handler.__name__ in superseded:
+                future.cancel()
+        future = handler_pool.submit(run,generation,b)
+        future.key = key
+        pending[handler.__name__] = future
+    on_click.__name__ = handler.__name__
+    return on_click
+
+def start_tasks(tasks):
+    ''' start export tasks concurrently '''
+    list(request_pool.map(lambda task: task.start(),tasks))
+    return tasks
+
+def show_figure(fig):
+    ''' display a matplotlib figure in w_out '''
+    import matplotlib.pyplot as plt
+    if getattr(_local,'background',False):
+        w_out.append_display_data(fig)
+        plt.close(fig)
     else:
-#      incomplete overlap, so use all of the image geometry        
-        return round(ee.Image(image).select('angle') \
-           .reduceRegion(ee.Reducer.mean(),maxPixels=1e9) \
-           .get('angle') \
-           .getInfo(),2)
+        plt.show()
+
+def to_timestamp(timestamp):
+    ''' acquisition time in ms to TYYYYMMDD format '''
+    tmp = time.strftime('%x',time.gmtime(int(timestamp)/1000)).replace('/','')
+    return 'T20'+tmp[4:]+tmp[0:4]
 
 def get_vvvh(image):   
     ''' get 'VV' and 'VH' bands from sentinel-1 imageCollection and restore linear signal from db-values '''
@@ -93,8 +202,16 @@ dc.polygon = {"shapeOptions": {"fillColor": "#0000ff","color": "#0000ff","fillOp
 dc.on_draw(handle_draw)
 
 def GetTileLayerUrl(ee_image_object):
-    map_id = ee.Image(ee_image_object).getMapId()
-    return map_id["tile_fetcher"].url_format
+    key = ee.Image(ee_image_object).serialize()
+    now = time.time()
+    if key not in mapid_cache or now-mapid_cache[key][0] > mapid_lifetime:
+#      drop all expired entries        
+        for old,(t,_) in list(mapid_cache.items()):
+            if now-t > mapid_lifetime:
+                mapid_cache.pop(old,None)
+        map_id = ee.Image(ee_image_object).getMapId()
+        mapid_cache[key] = (now,map_id["tile_fetcher"].url_format)
+    return mapid_cache[key][1]
 
 w_collection = widgets.Text(
     value='COPERNICUS/S1_GRD',
@@ -259,6 +376,14 @@ w_output = widgets.HBox([w_reset,w_out])
 box = widgets.VBox([w_output,w_coll,w_dates,w_orbit,w_signif,w_run,w_exp])
 
 def on_widget_change(b):
+    global generation
+    with state_lock:
+        generation += 1
+#  the exports already clicked still run    
+    for name in superseded:
+        future = pending.get(name)
+        if future is not None:
+            future.cancel()
     w_preview.disabled = True
     w_export_ass.disabled = True
     w_export_drv.disabled = True
@@ -307,6 +432,8 @@ def getS2collection(coords):
                       .sort('CLOUDY_PIXEL_PERCENTAGE',True)
                       
 def on_reset_button_clicked(b):
+    metadata_cache.clear()
+    mapid_cache.clear()
     with w_out:
         w_out.clear_output()
         print('Algorithm output')   
@@ -344,10 +471,34 @@ def on_clearpoly_button_clicked(b):
     
 w_clearpoly.on_click(on_clearpoly_button_clicked)    
 
+def collect_metadata(collection,coords):
+    ''' all of the metadata needed by on_collect_button_clicked as one ee.Dictionary '''
+    collectionfirst = ee.Image(collection.first())
+    metadata = {'times':collection.aggregate_array('system:time_start'),
+                'scale':collectionfirst.select(0).projection().nominalScale(),
+#              GEE S1 archive crs for eventual image series export 
+                'crs':ee.Image(getS1collection(coords).first()).select(0).projection().crs()}
+    if (w_collection.value == 'COPERNICUS/S1_GRD') or (w_collection.value == ''):
+        rons = ee.List(collection.aggregate_array('relativeOrbitNumber_start')).distinct()
+        metadata['rons'] = rons
+        metadata['area'] = poly.area()
+        metadata['angle'] = ee.Algorithms.If(rons.length().eq(1),get_incidence_angle(collectionfirst),None)
+    else:
+        metadata['count'] = collection.size()
+        metadata['center'] = poly.centroid().coordinates()
+        metadata['time'] = collectionfirst.get('system:time_start')
+    if w_S2.value:
+        collection2 = getS2collection(coords)
+        count2 = collection2.size()
+        metadata['s2count'] = count2
+        metadata['s2time'] = ee.Algorithms.If(count2.gt(0),
+                                 ee.Image(collection2.first()).get('system:time_start'),None)
+    return ee.Dictionary(metadata)
+
 def on_collect_button_clicked(b):
-    global result,collection,count,imList,poly,timestamplist1,timestamps2, \
-           s2_image,rons,mean_incidence,collectionmean,archive_crs,coords,wc 
-    with w_out:
+    global poly
+#  the results are kept in locals and published only if the request is still current    
+    with output():
         try:
             if (w_collection.value == 'COPERNICUS/S1_GRD') or (w_collection.value == ''): 
                 w_out.clear_output()
@@ -359,38 +510,35 @@ def on_collect_button_clicked(b):
                 if w_platform.value != 'Both':
                     collection = collection.filter(ee.Filter.eq('platform_number', w_platform.value))         
                 collection = collection.sort('system:time_start') 
-                acquisition_times = ee.List(collection.aggregate_array('system:time_start')).getInfo()
+#              all metadata in one round trip, cached by AOI, dates, orbit and platform                
+                key = (w_collection.value,poly.serialize(),w_startdate.value,w_enddate.value,
+                       w_orbitpass.value,w_relativeorbitnumber.value,w_platform.value,w_S2.value)
+                metadata = get_metadata(key,collect_metadata(collection,coords))
+                acquisition_times = metadata['times']
                 count = len(acquisition_times) 
                 if count<2:
                     raise ValueError('Less than 2 images found')
-                timestamplist = []
-                for timestamp in acquisition_times:
-                    tmp = time.gmtime(int(timestamp)/1000)
-                    timestamplist.append(time.strftime('%x', tmp))  
 #              make timestamps in YYYYMMDD format            
-                timestamplist = [x.replace('/','') for x in timestamplist]  
-                timestamplist = ['T20'+x[4:]+x[0:4] for x in timestamplist]         
+                timestamplist = [to_timestamp(timestamp) for timestamp in acquisition_times]
                 timestamplist = timestamplist[::int(w_stride.value)]
 #              in case of duplicates add running integer
                 timestamplist1 = [timestamplist[i] + '_' + str(i+1) for i in range(len(timestamplist))]     
                 count = len(timestamplist)
                 if count<2:
                     raise ValueError('Less than 2 images found, decrease stride')            
-                relativeorbitnumbers = map(int,ee.List(collection.aggregate_array('relativeOrbitNumber_start')).getInfo())
-                rons = list(set(relativeorbitnumbers))
+                rons = list(map(int,metadata['rons']))
                 print('Images found: %i, platform: %s'%(count,w_platform.value))
-                print('Number of 10m pixels contained: %i'%math.floor(poly.area().getInfo()/100.0))
+                print('Number of 10m pixels contained: %i'%math.floor(metadata['area']/100.0))
                 print('Acquisition dates: %s to %s'%(str(timestamplist[0]),str(timestamplist[-1])))
                 print('Relative orbit numbers: '+str(rons))
                 if len(rons)==1:
-                    mean_incidence = get_incidence_angle(collection.first())
+                    mean_incidence = round(metadata['angle'],2)
                     print('Mean incidence angle: %f'%mean_incidence)
                 else:
                     mean_incidence = 'undefined'
                     print('Mean incidence angle: (select one rel. orbit)')
                 pcollection = collection.map(get_vvvh)            
-                collectionfirst = ee.Image(pcollection.first())
-                w_exportscale.value = collectionfirst.projection().nominalScale().getInfo()          
+                w_exportscale.value = metadata['scale']          
                 pList = pcollection.toList(500)   
                 first = ee.Dictionary({'imlist':ee.List([]),'poly':poly,'enl':ee.Number(w_enl.value),'ctr':ee.Number(0),'stride':ee.Number(int(w_stride.value))}) 
                 imList = ee.List(ee.Dictionary(pList.iterate(clipList,first)).get('imlist'))              
@@ -404,23 +552,19 @@ def on_collect_button_clicked(b):
                 w_out.clear_output()
                 collection = ee.ImageCollection(w_collection.value)
                 print('running on local collection %s \n ignoring start and end dates (please wait for raster overlay) ...'%w_collection.value)  
-                count = collection.size().getInfo()  
-                print('Images found: %i'%count )          
                 collectionfirst = ee.Image(collection.first())  
                 poly = collectionfirst.geometry()   
                 coords = ee.List(poly.bounds().coordinates().get(0))   
-                center = poly.centroid().coordinates().getInfo()
+                key = (w_collection.value,w_startdate.value,w_enddate.value,w_orbitpass.value,w_S2.value)
+                metadata = get_metadata(key,collect_metadata(collection,coords))
+                count = metadata['count']  
+                print('Images found: %i'%count )          
+                center = list(metadata['center'])
                 center.reverse()
                 m.center = center                
-                w_exportscale.value = collectionfirst.projection().nominalScale().getInfo()
-                if collectionfirst.get('system:time_start').getInfo() is not None:
-                    acquisition_times = ee.List(collection.aggregate_array('system:time_start')).getInfo()  
-                    timestamplist1 = []
-                    for timestamp in acquisition_times:
-                        tmp = time.gmtime(int(timestamp)/1000)
-                        timestamplist1.append(time.strftime('%x', tmp))            
-                    timestamplist1 = [x.replace('/','') for x in timestamplist1]  
-                    timestamplist1 = ['T20'+x[4:]+x[0:4] for x in timestamplist1]    
+                w_exportscale.value = metadata['scale']
+                if metadata['time'] is not None:
+                    timestamplist1 = [to_timestamp(timestamp) for timestamp in metadata['times']]    
                     print('Acquisition dates: %s'%str(timestamplist1))    
                 else:
                     timestamplist1 = ['T%i'%(i+1) for i in range(count)]
@@ -432,36 +576,42 @@ def on_collect_button_clicked(b):
                 mx = ee.Number(percentiles.get('b0_p98'))        
                 vorschau = collectionmean.select(0).visualize(min=mn, max=mx, opacity=w_opacity.value)       
                 imList = collection.toList(100)
-#          get GEE S1 archive crs for eventual image series export               
-            archive_crs = ee.Image(getS1collection(coords).first()).select(0).projection().crs().getInfo()
+                rons = []
+                mean_incidence = 'undefined'
+            archive_crs = metadata['crs']
 #          run the algorithm        
             result = omnibus(imList,w_significance.value,w_enl.value,w_median.value)         
-            w_preview.disabled = False
-            w_export_atsf.disabled = True
+            check_current()
             s2_image = None
+            timestamps2 = None
 #          display collection or S2 
-            if len(m.layers)>3:
-                m.remove_layer(m.layers[3])
             if w_S2.value:
 #              display sentinel-2 if available              
                 collection2 = getS2collection(coords) 
-                count1 = collection2.size().getInfo()
-                if count1>0:    
+                if metadata['s2count']>0:    
                     s2_image =  ee.Image(collection2.first()).select(['B8','B4','B3']).clip(poly)        
                     percentiles = s2_image.reduceRegion(ee.Reducer.percentile([2,98]),scale=w_exportscale.value,maxPixels=10e9)         
                     mn = percentiles.values(['B8_p2','B4_p2','B3_p2'])
                     mx = percentiles.values(['B8_p98','B4_p98','B3_p98'])
                     vorschau = s2_image.visualize(min=mn,max=mx,opacity=w_opacity.value)           
-                    timestamp = s2_image.get('system:time_start').getInfo() 
-                    timestamp = time.gmtime(int(timestamp)/1000)
-                    timestamp = time.strftime('%x', timestamp).replace('/','')
-                    timestamps2 = '20'+timestamp[4:]+timestamp[0:4]
+                    timestamps2 = to_timestamp(metadata['s2time'])[1:]
                     print('Sentinel-2 from %s'%timestamps2) 
-            m.add_layer(TileLayer(url=GetTileLayerUrl(vorschau)))
+            url = GetTileLayerUrl(vorschau)
+            publish(result=result,collection=collection,count=count,imList=imList,
+                    timestamplist1=timestamplist1,timestamps2=timestamps2,s2_image=s2_image,
+                    rons=rons,mean_incidence=mean_incidence,collectionmean=collectionmean,
+                    archive_crs=archive_crs,coords=coords)
+            w_preview.disabled = False
+            w_export_atsf.disabled = True
+            if len(m.layers)>3:
+                m.remove_layer(m.layers[3])
+            m.add_layer(TileLayer(url=url))
+        except Superseded:
+            return
         except Exception as e:
             print('Error: %s'%e)       
 
-w_collect.on_click(on_collect_button_clicked)
+w_collect.on_click(background(on_collect_button_clicked))
 
 def on_goto_button_clicked(b):
     try:
@@ -475,9 +625,8 @@ def on_goto_button_clicked(b):
 w_goto.on_click(on_goto_button_clicked)
 
 def on_preview_button_clicked(b):
-    global cmap,smap,fmap,bmap,avimg,pvQ,avimglog,count,watermask
     watermask = ee.Image('UMD/hansen/global_forest_change_2015').select('datamask').eq(1)  
-    with w_out:  
+    with output():  
         try:       
             jet = 'black,blue,cyan,yellow,red'
             rgy = 'black,red,green,yellow'
@@ -514,23 +663,28 @@ def on_preview_button_clicked(b):
                 mp = bmap.select(sel-1).clip(poly)
                 palette = rgy
                 mx = 3     
-            if len(m.layers)>3:
-                m.remove_layer(m.layers[3])
             if not w_Q.value:
                 mp = mp.reproject(crs=archive_crs,scale=float(w_exportscale.value))
             if w_maskwater.value==True:
                 mp = mp.updateMask(watermask)
             if w_maskchange.value==True:    
                 mp = mp.updateMask(mp.gt(0))    
-            m.add_layer(TileLayer(url=GetTileLayerUrl(mp.visualize(min=0, max=mx, palette=palette,opacity = w_opacity.value))))
+            url = GetTileLayerUrl(mp.visualize(min=0, max=mx, palette=palette,opacity = w_opacity.value))
+            publish(cmap=cmap,smap=smap,fmap=fmap,bmap=bmap,avimg=avimg,pvQ=pvQ,
+                    avimglog=avimglog,watermask=watermask)
+            if len(m.layers)>3:
+                m.remove_layer(m.layers[3])
+            m.add_layer(TileLayer(url=url))
             w_export_ass.disabled = False
             w_export_drv.disabled = False
             w_export_series.disabled = False
             w_export_atsf.disabled = False
+        except Superseded:
+            return
         except Exception as e:
             print('Error: %s'%e)
     
-w_preview.on_click(on_preview_button_clicked)   
+w_preview.on_click(background(on_preview_button_clicked))   
 
 def on_plot_button_clicked(b):          
 #  plot change fractions        
@@ -544,7 +698,7 @@ def on_plot_button_clicked(b):
                   .where(bmap1.eq(current),ee.Image.constant(1)) \
                   .reduceRegion(ee.Reducer.mean(),scale=w_exportscale.value,maxPixels=10e9)
         return ee.List(plots.add(res))
-    with w_out:
+    with output():
         try:
             w_out.clear_output()            
             print('Change fraction plots ...')                  
@@ -568,27 +722,32 @@ def on_plot_button_clicked(b):
             fn = w_exportassetsname.value.replace('/','-')+'.png'
             plt.savefig(fn,bbox_inches='tight') 
             w_out.clear_output()
-            plt.show()
+            show_figure(fig)
             print('Saved to ~/%s'%fn)
         except Exception as e:
             print('Error: %s'%e)               
     
-w_plot.on_click(on_plot_button_clicked)
+w_plot.on_click(background(on_plot_button_clicked))
 
 def on_export_ass_button_clicked(b):
     try:
         background = collectionmean.select(0).add(15).divide(15)
         bgname = 'collectionmean'
+#      everything needed from the server in one round trip        
+        info = {'scale':cmap.projection().nominalScale(),'poly':poly}
         if w_collection.value == 'COPERNICUS/S1_GRD':  
             collection1 = getS2collection(coords)
-            count1 = collection1.size().getInfo()
-            if count1>0:
+            info['count1'] = collection1.size()
+            info['timestamp'] = ee.Algorithms.If(collection1.size().gt(0),
+                                    ee.Image(collection1.first()).get('system:time_start'),None)
+        info = ee.Dictionary(info).getInfo()
+        if w_collection.value == 'COPERNICUS/S1_GRD':  
+            if info['count1']>0:
         #      use sentinel-2 as video background if available                       
                 background = ee.Image(collection1.first()) \
                                        .clip(poly) \
                                        .select('B8') 
-                timestamp = background.get('system:time_start').getInfo()
-                timestamp = time.gmtime(int(timestamp)/1000)
+                timestamp = time.gmtime(int(info['timestamp'])/1000)
                 timestamp = time.strftime('%x', timestamp)
                 bgname = 'sentinel-2 '+ str(timestamp) 
                 background = background.divide(5000)
@@ -596,10 +755,6 @@ def on_export_ass_button_clicked(b):
         assexport = ee.batch.Export.image.toAsset(cmaps.clip(poly),
                                     description='assetExportTask', 
                                     assetId=w_exportassetsname.value,scale=w_exportscale.value,maxPixels=1e9)      
-        assexport.start()
-        with w_out: 
-            w_out.clear_output() 
-            print('Exporting change maps to %s\n task id: %s'%(w_exportassetsname.value,str(assexport.id)))
     #  export metadata to drive
         if w_collection.value == 'COPERNICUS/S1_GRD': 
             times = [timestamp[1:9] for timestamp in timestamplist1]
@@ -608,7 +763,7 @@ def on_export_ass_button_clicked(b):
                                 'Asset export name: '+w_exportassetsname.value,  
                                 'ENL: '+str(w_enl.value),
                                 'Export scale (m): '+str(w_exportscale.value),
-                                'Nominal scale (m): '+str(cmap.projection().nominalScale().getInfo()),
+                                'Nominal scale (m): '+str(info['scale']),
                                 'Orbit pass: '+w_orbitpass.value,    
                                 'Significance: '+str(w_significance.value),  
                                 'Series length: '+str(len(times)),
@@ -619,14 +774,14 @@ def on_export_ass_button_clicked(b):
                                 'Mean incidence angles: '+str(mean_incidence),
                                 'Used 3x3 median filter: '+str(w_median.value)]) \
                                 .cat(['Polygon:']) \
-                                .cat(poly.getInfo()['coordinates'][0]) 
+                                .cat(info['poly']['coordinates'][0]) 
         else:
             metadata = ee.List(['SEQUENTIAL OMNIBUS: '+time.asctime(),  
                                 'Collection: '+w_collection.value,
                                 'Asset export name: '+w_exportassetsname.value,  
                                 'ENL: '+str(w_enl.value),  
                                 'Export scale (m): '+str(w_exportscale.value),
-                                'Nominal scale (m): '+str(cmap.projection().nominalScale().getInfo()),
+                                'Nominal scale (m): '+str(info['scale']),
                                 'Significance: '+str(w_significance.value),  
                                 'Series length: '+str(count),
                                 'Used 3x3 median filter: '+str(w_median.value)]) 
@@ -635,38 +790,32 @@ def on_export_ass_button_clicked(b):
                              description='driveExportTask_meta', 
                              folder = 'EarthEngineImages',
                              fileNamePrefix=fileNamePrefix )        
-        gdexport.start()
-        with w_out:
+        start_tasks([assexport,gdexport])
+        with output(): 
+            w_out.clear_output() 
+            print('Exporting change maps to %s\n task id: %s'%(w_exportassetsname.value,str(assexport.id)))
             print('Exporting metadata to Drive/gee/%s\n task id: %s'%(fileNamePrefix,str(gdexport.id)))    
     except Exception as e:
-        with w_out:
+        with output():
             print('Error: %s'%e)                                          
     
-w_export_ass.on_click(on_export_ass_button_clicked) 
+w_export_ass.on_click(background(on_export_ass_button_clicked)) 
 
 def on_export_drv_button_clicked(b):
     try:
+        info = ee.Dictionary({'scale':cmap.projection().nominalScale(),'poly':poly}).getInfo()
         cmaps = ee.Image.cat(cmap,smap,fmap,bmap).rename(['cmap','smap','fmap']+timestamplist1[1:])  
-        fileNamePrefix=w_exportdrivename.value.replace('/','-')            
-        gdexport = ee.batch.Export.image.toDrive(cmaps.byte().clip(poly),
+        fileNamePrefix1=w_exportdrivename.value.replace('/','-')            
+        gdexport1 = ee.batch.Export.image.toDrive(cmaps.byte().clip(poly),
                                     description='driveExportTask', 
                                     folder = 'gee',
-                                    fileNamePrefix=fileNamePrefix,scale=w_exportscale.value,maxPixels=1e9)   
-        gdexport.start()
-        with w_out:
-            w_out.clear_output()
-            print('Exporting change maps to Drive/EarthEngineImages/%s\n task id: %s'%(fileNamePrefix,str(gdexport.id))) 
-            
+                                    fileNamePrefix=fileNamePrefix1,scale=w_exportscale.value,maxPixels=1e9)   
 #      for Allan             
-        fileNamePrefix=w_exportdrivename.value.replace('/','-')+'_pvQ'            
-        gdexport = ee.batch.Export.image.toDrive(pvQ.clip(poly),
+        fileNamePrefix2=w_exportdrivename.value.replace('/','-')+'_pvQ'            
+        gdexport2 = ee.batch.Export.image.toDrive(pvQ.clip(poly),
                                     description='driveExportTask', 
                                     folder = 'gee',
-                                    fileNamePrefix=fileNamePrefix,scale=w_exportscale.value,maxPixels=1e9)   
-        gdexport.start()
-        with w_out:
-            print('Exporting omnibus p-value to Drive/gee/%s\n task id: %s'%(fileNamePrefix,str(gdexport.id)))     
-           
+                                    fileNamePrefix=fileNamePrefix2,scale=w_exportscale.value,maxPixels=1e9)   
 #      export metadata to drive
         if w_collection.value == 'COPERNICUS/S1_GRD': 
             times = [timestamp[1:9] for timestamp in timestamplist1]
@@ -675,7 +824,7 @@ def on_export_drv_button_clicked(b):
                                 'Drive export name: '+w_exportdrivename.value,  
                                 'ENL: '+str(w_enl.value),
                                 'Export scale (m): '+str(w_exportscale.value),
-                                'Nominal scale (m): '+str(cmap.projection().nominalScale().getInfo()),
+                                'Nominal scale (m): '+str(info['scale']),
                                 'Orbit pass: '+w_orbitpass.value,    
                                 'Significance: '+str(w_significance.value),  
                                 'Series length: '+str(len(times)),
@@ -685,14 +834,14 @@ def on_export_drv_button_clicked(b):
                                 'Mean incidence angles: '+str(mean_incidence),
                                 'Used 3x3 median filter: '+str(w_median.value)]) \
                                 .cat(['Polygon:']) \
-                                .cat(poly.getInfo()['coordinates'][0]) 
+                                .cat(info['poly']['coordinates'][0]) 
         else:
             metadata = ee.List(['SEQUENTIAL OMNIBUS: '+time.asctime(),  
                                 'Collection: '+w_collection.value,
                                 'Drive export name: '+w_exportdrivename.value,  
                                 'ENL: '+str(w_enl.value),  
                                 'Export scale (m): '+str(w_exportscale.value),
-                                'Nominal scale (m): '+str(cmap.projection().nominalScale().getInfo()),
+                                'Nominal scale (m): '+str(info['scale']),
                                 'Significance: '+str(w_significance.value),  
                                 'Series length: '+str(count),
                                 'Used 3x3 median filter: '+str(w_median.value)]) 
@@ -701,21 +850,25 @@ def on_export_drv_button_clicked(b):
                              description='driveExportTask_meta', 
                              folder = 'gee',
                              fileNamePrefix=fileNamePrefix )
-        gdexport.start()
-        with w_out:
+        start_tasks([gdexport1,gdexport2,gdexport])
+        with output():
+            w_out.clear_output()
+            print('Exporting change maps to Drive/EarthEngineImages/%s\n task id: %s'%(fileNamePrefix1,str(gdexport1.id))) 
+            print('Exporting omnibus p-value to Drive/gee/%s\n task id: %s'%(fileNamePrefix2,str(gdexport2.id)))     
             print('Exporting metadata to Drive/gee/%s\n task id: %s'%(fileNamePrefix,str(gdexport.id)))                   
     except Exception as e:
-        with w_out:
+        with output():
             print('Error: %s'%e) 
 
-w_export_drv.on_click(on_export_drv_button_clicked) 
+w_export_drv.on_click(background(on_export_drv_button_clicked)) 
 
 def on_export_series_button_clicked(b):
     try:
         imlist = ee.List(imList)
-        with w_out:
+        with output():
             w_out.clear_output()
             print('Exporting time series of %i images to Drive'%count)
+        tasks = []
         for i in range(count):
             if i<10:
                 pad = '0'
@@ -729,9 +882,9 @@ def on_export_series_button_clicked(b):
                                                       crs = archive_crs,
                                                       scale = w_exportscale.value,
                                                       maxPixels = 1e10)
-            gdexport1.start()  
+            tasks.append(gdexport1)  
         if s2_image is not None:
-            with w_out:
+            with output():
                 print('Exporting s2 image to Drive')
             gdexport2 = ee.batch.Export.image.toDrive(s2_image,
                                                       description='driveExportTask_s2', 
@@ -740,12 +893,15 @@ def on_export_series_button_clicked(b):
                                                       crs = archive_crs,
                                                       scale = w_exportscale.value,
                                                       maxPixels = 1e10)
-            gdexport2.start()                                           
+            tasks.append(gdexport2)                                           
+        start_tasks(tasks)
+        with output():
+            print('Started %i export tasks'%len(tasks))
     except Exception as e:
-        with w_out:
+        with output():
             print('Error: %s'%e)        
             
-w_export_series.on_click(on_export_series_button_clicked)             
+w_export_series.on_click(background(on_export_series_button_clicked))             
         
 def on_export_atsf_button_clicked(b):
     try:          
@@ -757,7 +913,7 @@ def on_export_atsf_button_clicked(b):
             img_atsf = ee.Image(avimg)  
         img_log = ee.Image(avimglog)                   
         img_hybrid = img_atsf.where(img_log.lt(ee.Number(count).divide(3)),img_rl)   
-        with w_out:       
+        with output():       
             w_out.clear_output()     
             print('Exporting ATSF (adaptive temporal speckle filter) image to Drive')            
             gdexport1 = ee.batch.Export.image.toDrive(img_atsf,
@@ -767,7 +923,7 @@ def on_export_atsf_button_clicked(b):
                                                       crs = archive_crs,
                                                       scale = w_exportscale.value,
                                                       maxPixels = 1e10)
-            gdexport1.start()    
+            tasks = [gdexport1]    
             print('Exporting ATSF log image to Drive')
             gdexport2 = ee.batch.Export.image.toDrive(ee.Image(img_log),
                                                       description='driveExportTask_atsf_log', 
@@ -776,7 +932,7 @@ def on_export_atsf_button_clicked(b):
                                                       crs = archive_crs,
                                                       scale = w_exportscale.value,
                                                       maxPixels = 1e10)
-            gdexport2.start()  
+            tasks.append(gdexport2)  
             if w_collection.value == 'COPERNICUS/S1_GRD':
                 print('Exporting hybrid image to Drive')
                 gdexport3 = ee.batch.Export.image.toDrive(ee.Image(img_hybrid),
@@ -786,7 +942,7 @@ def on_export_atsf_button_clicked(b):
                                                           crs = archive_crs,
                                                           scale = w_exportscale.value,
                                                           maxPixels = 1e10)
-                gdexport3.start()  
+                tasks.append(gdexport3)  
             print('Exporting last image to Drive')
             gdexport4 = ee.batch.Export.image.toDrive(ee.Image(img_last),
                                                       description='driveExportTask_last', 
@@ -795,13 +951,14 @@ def on_export_atsf_button_clicked(b):
                                                       crs = archive_crs,
                                                       scale = w_exportscale.value,
                                                       maxPixels = 1e10)
-            gdexport4.start()              
+            tasks.append(gdexport4)              
+            start_tasks(tasks)
                                 
     except Exception as e:
-        with w_out:
+        with output():
             print('Error: %s'%e)        
 
-w_export_atsf.on_click(on_export_atsf_button_clicked)             
+w_export_atsf.on_click(background(on_export_atsf_button_clicked))             
                           
 def run():
     global m,dc,center
@@ -5,10 +5,18 @@ The sequential omnibus algorithm for polarimetric SAR imagery
 
 usage: from auxil.eeWishart import omnibus
 
+omnibus runs on the GEE servers for a list of ee.Image objects and
+locally (auxil.wishart.omnibus) for a list of numpy arrays [rows,cols,bands]
+
 @author: mort
 '''
 
-import ee
+import json
+import numpy as np
+try:
+    import ee
+except ImportError:
+    ee = None
 
 def chi2cdf(chi2,df):
     ''' Chi square cumulative distribution function '''
@@ -37,10 +45,14 @@ def log_det(imList,j):
     im = ee.Image(ee.List(imList).get(j.subtract(1)))
     return ee.Image(det(im)).log()
     
-def pv(imList,median,j,enl):
-    ''' calculate -2log(R_ell,j) and return it and the P-value'''
-    imList = ee.List(imList)
-    p2 = ee.Image(imList.get(0)).bandNames().length()
+def log_det_image(current):
+    '''return the log of the determinant of an image (for mapping over lists)'''
+    return ee.Image(det(ee.Image(current))).log()
+    
+def pv(logdetsumj1,logdetj,logdetsumj,p2,median,j,enl):
+    ''' calculate -2log(R_ell,j) and return it and the P-value, given the log
+        determinants of the sum of the first j-1 images, of the jth image
+        and of the sum of the first j images'''
 #  diagonal cases  p = p2 else p = sqrt(p2) 
     p = ee.Number(ee.Algorithms.If(p2.eq(2).Or(p2.eq(3)),p2,p2.sqrt()))
     j = ee.Number(j)
@@ -69,12 +81,12 @@ def pv(imList,median,j,enl):
              .divide(rhoj.pow(2))  ) ))
     
 #  Zj = -2*lnRj
-    Zj = ee.Image(log_det_sum(imList,j.subtract(1))) \
+    Zj = ee.Image(logdetsumj1) \
                  .multiply(j.subtract(1)) \
-                 .add(log_det(imList,j))  \
+                 .add(logdetj)  \
                  .add(p.multiply(j).multiply(ee.Number(j).log())) \
                  .subtract(p.multiply(j.subtract(1)).multiply(j.subtract(1).log())) \
-                 .subtract(ee.Image(log_det_sum(imList,j)).multiply(j)) \
+                 .subtract(ee.Image(logdetsumj).multiply(j)) \
                  .multiply(-2).multiply(enl)
 #  (1.-omega2j)*stats.chi2.cdf(rhoj*Zj,[f])+omega2j*stats.chi2.cdf(rhoj*Zj,[f+4])                 
     P = chi2cdf(Zj.multiply(rhoj),f).multiply(one.subtract(omega2j)) \
@@ -88,13 +100,22 @@ def js_iter(current,prev):
     prev = ee.Dictionary(prev)
     median = prev.get('median')
     enl = ee.Number(prev.get('enl'))
-    imList = prev.get('imList')
+    imList = ee.List(prev.get('imList'))
+    logdets = ee.List(prev.get('logdets'))
+    p2 = ee.Number(prev.get('p2'))
     pvs = ee.List(prev.get('pvs'))
     Z = ee.Image(prev.get('Z')) 
-    pval,Zj = pv(imList,median,j,enl)  
+#  running sum of the first j images and its log determinant, so that
+#  no prefix sum is formed twice
+    sumj = ee.Image(prev.get('sum')).add(ee.Image(imList.get(j.subtract(1))))
+    logdetsumj1 = ee.Image(prev.get('logdetsum'))
+    logdetsumj = ee.Image(det(sumj)).log()
+    logdetj = ee.Image(logdets.get(j.subtract(1)))
+    pval,Zj = pv(logdetsumj1,logdetj,logdetsumj,p2,median,j,enl)  
 #  Z = sum_j Zj = -2lnQ_ell  
     Z = Z.add(Zj)
-    return ee.Dictionary({'median':median,'imList':imList,'enl':enl,'pvs':pvs.add(pval),'Z':Z})   
+    return ee.Dictionary({'median':median,'imList':imList,'logdets':logdets,'p2':p2,'enl':enl,
+                          'pvs':pvs.add(pval),'Z':Z,'sum':sumj,'logdetsum':logdetsumj})   
 
 def ells_iter(current,prev):
     ell = ee.Number(current)
@@ -104,11 +125,15 @@ def ells_iter(current,prev):
     enl = ee.Number(prev.get('enl'))
     median = prev.get('median')
     imList = ee.List(prev.get('imList'))
+    logdets = ee.List(prev.get('logdets'))
 #  number of bands (degrees of freedom)
     p2 = ee.Image(imList.get(0)).bandNames().length()
     imList_ell = imList.slice(ell.subtract(1))
+    logdets_ell = logdets.slice(ell.subtract(1))
     js = ee.List.sequence(2,k.subtract(ell).add(1))
-    first = ee.Dictionary({'median':median,'imList':imList_ell,'enl':enl,'pvs':ee.List([]),'Z':ee.Image.constant(0.0)})
+    first = ee.Dictionary({'median':median,'imList':imList_ell,'logdets':logdets_ell,'p2':p2,'enl':enl,
+                           'pvs':ee.List([]),'Z':ee.Image.constant(0.0),
+                           'sum':imList_ell.get(0),'logdetsum':logdets_ell.get(0)})
     result = ee.Dictionary(js.iterate(js_iter,first))
 #  list of P-values for R_ell,j, j = ell+1 ... k    
     pvs = ee.List(result.get('pvs'))
@@ -138,7 +163,7 @@ def ells_iter(current,prev):
     PvQ = ee.Algorithms.If(median, PvQ.focal_median(),PvQ) 
 #  put at end of current sequence     
     pvs = pvs.add(PvQ)          
-    return ee.Dictionary({'k':k,'median':median,'enl':enl,'imList':imList,'pv_arr':pv_arr.add(pvs)})
+    return ee.Dictionary({'k':k,'median':median,'enl':enl,'imList':imList,'logdets':logdets,'pv_arr':pv_arr.add(pvs)})
 
 def filter_j(current,prev):
     pv = ee.Image(current)
@@ -230,12 +255,22 @@ post-process for directional change maps
 def omnibus(imList,significance=0.0001,enl=4.4,median=False):
     '''
 return change maps for sequential omnibus change algorithm
+NumPy input is evaluated locally with auxil.wishart.omnibus. Note that the
+median filter is then applied to the P-values of R_ell,j only (as in sar_seqQ),
+whereas here the P-values of the omnibus statistics Q_ell are filtered too,
+so that with median set the change maps can differ at a few pixels
     ''' 
+    if isinstance(imList,np.ndarray) or \
+       (isinstance(imList,(list,tuple)) and len(imList)>0 and isinstance(imList[0],np.ndarray)):
+        from auxil.wishart import omnibus as np_omnibus
+        return np_omnibus(imList,significance,enl,median)
     imList = ee.List(imList)  
     k = imList.length()  
 #  pre-calculate p-value array    
     ells = ee.List.sequence(1,k.subtract(1))
-    first = ee.Dictionary({'k':k,'median':median,'enl':enl,'imList':imList,'pv_arr':ee.List([])}) 
+#  log determinants of the individual images, computed once    
+    logdets = imList.map(log_det_image)
+    first = ee.Dictionary({'k':k,'median':median,'enl':enl,'imList':imList,'logdets':logdets,'pv_arr':ee.List([])}) 
     result = ee.Dictionary(ells.iterate(ells_iter,first))
     pv_arr = ee.List(result.get('pv_arr'))           
 #  filter p-values to generate cmap, smap, fmap and bmap
@@ -258,5 +293,17 @@ return change maps for sequential omnibus change algorithm
     pvQ = ee.Image(ee.List(pv_arr.get(0)).get(-1))  
     return result.set('bmap',dmap).set('avimgs',avimgs).set('avimglog',avimglog).set('pvQ',pvQ)
 
+def graph_size(obj):
+    '''return the number of function invocations in the serialized expression
+       graph of an ee object, for offline profiling of graph growth'''
+    def count(node):
+        if isinstance(node,dict):
+            n = int('functionInvocationValue' in node or node.get('type') == 'Invocation')
+            return n + sum(count(v) for v in node.values())
+        elif isinstance(node,list):
+            return sum(count(v) for v in node)
+        return 0
+    return count(json.loads(ee.serializer.toJSON(obj)))
+
 if __name__ == '__main__':
     pass
\ No newline at end of file
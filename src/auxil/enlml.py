@@ -14,28 +14,61 @@
 # Copyright (c) 2018 Mort Canty
 
 import auxil.lookup as lookup
+import auxil.polmat as polmat
+from auxil import gdalio
+from auxil.stats import Stats
 import os, sys, getopt, time
 import numpy as np
+from scipy import ndimage
 import matplotlib.pyplot as plt
 from osgeo import gdal
-from osgeo.gdalconst import GA_ReadOnly, GDT_Float32
+from osgeo.gdalconst import GA_ReadOnly
    
-six = np.array([0,1,2,3,4,5,6])   
-   
-def get_windex(j,cols):
-#  first window for row j    
-    windex = np.zeros(49,dtype=int)   
-    windex[0:7]   = (j-3)*cols + six
-    windex[7:14]  = (j-2)*cols + six
-    windex[14:21] = (j-1)*cols + six
-    windex[21:28] = (j)*cols   + six 
-    windex[28:35] = (j+1)*cols + six 
-    windex[35:42] = (j+2)*cols + six
-    windex[42:49] = (j+3)*cols + six
-    return windex
+def ml_enl(c,d,refine=False):
+    '''vectorized solution L of c + f(L) = 0, f(L) = (d+1)ln(L) - sum_i=0..d digamma(L-i),
+       c = <ln|C|> - ln|<C>|. Returns the first 0.1 step of the lookup table past the root, 
+       or the root itself with refine=True, and 0 where there is no root in the table'''
+    from scipy.special import digamma, polygamma
+    f = lookup.table()[10*(d+1):,d]
+#  f is decreasing, find the first table entry with c + f < 0    
+    i = np.searchsorted(-f,c,side='right')
+    valid = (i > 0) & (i < len(f))
+    L = np.where(valid,(i+10*(d+1))/10.0,0.0)
+    if refine:
+#      Newton steps from the left of the root, f is convex    
+        x = L[valid] - 0.1
+        cv = c[valid]
+        for _ in range(6):
+            g = cv + (d+1)*np.log(x) - sum(digamma(x-k) for k in range(d+1))
+            dg = (d+1)/x - sum(polygamma(1,x-k) for k in range(d+1))
+            x = x - g/dg
+        L[valid] = x
+    return L
 
+def enl_tile(inDataset,dims,window,bands,d,refine=False):
+    '''ML ENL image of the row window of the spatial subset dims, read with
+       a 3 row halo. The 3 pixel border of the subset is set to 0'''
+    x0,y0,cols,rows = dims
+    y,r = window[1],window[3]
+    ya = max(y-3,y0)
+    yb = min(y+r+3,y0+rows)
+    n = yb-ya
+    enl_ml = np.zeros((n,cols), dtype= np.float32)
+    if n > 6 and cols > 6:
+#      polarimetric matrix elements (real band layout)        
+        img = gdalio.read(inDataset,[x0,ya,cols,n],range(1,bands+1))
+#      7x7 window averages of ln|C| and of C over the interior pixels            
+        det = np.reshape(polmat.det(img),(n,cols))
+        valid = ndimage.minimum_filter(det,size=7)[3:-3,3:-3] > 0.0
+        avlogdetC = ndimage.uniform_filter(np.log(np.maximum(det,np.finfo(float).tiny)),size=7)[3:-3,3:-3]
+        avC = np.zeros(((n-6)*(cols-6),bands))
+        for b in range(bands):
+            avC[:,b] = ndimage.uniform_filter(np.reshape(img[:,b],(n,cols)),size=7)[3:-3,3:-3].ravel()
+        logdetavC = np.reshape(polmat.logdet(avC),(n-6,cols-6))
+        enl_ml[3:-3,3:-3][valid] = ml_enl(avlogdetC[valid]-logdetavC[valid],d,refine)
+    return enl_ml[y-ya:y-ya+r]
 
-def enl(infile,dims=None,outfile='enl.tif',fileout=False,xrange=50,sfn=None):    
+def enl(infile,dims=None,outfile='enl.tif',fileout=False,xrange=50,sfn=None,refine=False):    
     try:
         gdal.AllRegister()         
         inDataset = gdal.Open(infile,GA_ReadOnly)     
@@ -52,112 +85,34 @@ def enl(infile,dims=None,outfile='enl.tif',fileout=False,xrange=50,sfn=None):
         print( 'infile:  %s'%infile )   
         if bands == 9:
             print( 'Quad polarimetry' )  
-    #      T11 (k)
-            band = inDataset.GetRasterBand(1)
-            k = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-    #      T12  (a)
-            band = inDataset.GetRasterBand(2)
-            a = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-            band = inDataset.GetRasterBand(3)    
-            im = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-            a = a + 1j*im
-    #      T13  (rho)
-            band = inDataset.GetRasterBand(4)
-            rho = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-            band = inDataset.GetRasterBand(5)
-            im = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-            rho = rho + 1j*im     
-    #      T22 (xsi)
-            band = inDataset.GetRasterBand(6)
-            xsi = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()    
-    #      T23 (b)        
-            band = inDataset.GetRasterBand(7)
-            b = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-            band = inDataset.GetRasterBand(8)
-            im = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-            b = b + 1j*im     
-    #      T33 (zeta)
-            band = inDataset.GetRasterBand(9)
-            zeta = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()                
-            det = k*xsi*zeta + 2*np.real(a*b*np.conj(rho)) - xsi*(abs(rho)**2) - k*(abs(b)**2) - zeta*(abs(a)**2)
             d = 2
         elif bands == 4:
             print( 'Dual polarimetry' )  
-    #      C11 (k)
-            band = inDataset.GetRasterBand(1)
-            k = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-    #      C12  (a)
-            band = inDataset.GetRasterBand(2)
-            a = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-            band = inDataset.GetRasterBand(3)
-            im = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel()
-            a = a + 1j*im       
-    #      C22 (xsi)
-            band = inDataset.GetRasterBand(4)
-            xsi = np.nan_to_num(band.ReadAsArray(x0,y0,cols,rows)).ravel() 
-            det = k*xsi - abs(a)**2   
             d = 1   
         elif bands <= 3:
             print( 'Diagonal-only polarimetry' )         
-    #      C11 (k)
-            band = inDataset.GetRasterBand(1)
-            k = band.ReadAsArray(x0,y0,cols,rows).ravel() 
-            det = k
+    #      C11 only    
+            bands = 1
             d = 0      
-        enl_ml = np.zeros((rows,cols), dtype= np.float32)
-        lu = lookup.table()
         print( 'filtering...' )
-        print( 'row: ',end='' )   
         start = time.time()
-        for i in range(3,rows-3):
-            if i%100 == 0:
-                print( '%i '%i,end='' ) 
-            windex = get_windex(i,cols)  
-            for j in range(3,cols-3):  
-                detC = det[windex]
-                if np.min(detC) > 0.0:
-                    avlogdetC = np.sum(np.log(detC))/49
-                    if bands == 9:
-                        k1 = np.sum(k[windex])/49
-                        a1 = np.sum(a[windex])/49
-                        rho1 = np.sum(rho[windex])/49
-                        xsi1 = np.sum(xsi[windex])/49
-                        b1 = np.sum(b[windex])/49
-                        zeta1 = np.sum(zeta[windex])/49
-                        detavC = k1*xsi1*zeta1 + 2*np.real(a1*b1*np.conj(rho1)) - xsi1*(np.abs(rho1)**2) - k1*(np.abs(b1)**2) - zeta1*(np.abs(a1)**2)
-                    elif bands == 4:
-                        k1 = np.sum(k[windex])/49
-                        xsi1 = np.sum(xsi[windex])/49
-                        a1 = np.sum(a[windex])/49   
-                        detavC =  k1*xsi1 - np.abs(a1)**2
-                    else:
-                        detavC = np.sum(k[windex])/49
-                    logdetavC = np.log(detavC)    
-                    arr =  avlogdetC - logdetavC + lu[:,d]    
-                    ell = np.where(arr*np.roll(arr,1)<0)[0]
-                    if len(ell)>0:
-                        enl_ml[i,j] = float(ell[-1])/10.0
-                windex += 1
         if fileout:
-            driver = inDataset.GetDriver()   
-            outDataset = driver.Create(outfile,cols,rows,1,GDT_Float32)
-            projection = inDataset.GetProjection()
-            geotransform = inDataset.GetGeoTransform()
-            if geotransform is not None:
-                gt = list(geotransform)
-                gt[0] = gt[0] + x0*gt[1]
-                gt[3] = gt[3] + y0*gt[5]
-                outDataset.SetGeoTransform(tuple(gt))
-            if projection is not None:
-                outDataset.SetProjection(projection)          
-            outBand = outDataset.GetRasterBand(1)
-            outBand.WriteArray(enl_ml,0,0) 
-            outBand.FlushCache() 
+            outDataset = gdalio.create(outfile,cols,rows,1,like=inDataset,dims=dims)
+#      histogram with bins centred on the 0.1 steps of the lookup table            
+        nbins = lookup.table().shape[0]
+        stats = Stats(1,nbins,(-0.05,nbins/10.0-0.05),moments=False)
+        for window in gdalio.windows(inDataset,dims):
+            enl_ml = enl_tile(inDataset,dims,window,bands,d,refine)
+            stats.update(enl_ml)
+            if fileout:
+                gdalio.write(outDataset,enl_ml,0,window[1]-y0)
+        if fileout:
             outDataset = None   
             print( '\nENL image written to: %s'%outfile )  
-        ya,xa = np.histogram(enl_ml,bins=1000)
-        ya[0:20] = 0.0
-        print( '\nMode: %f'%xa[np.argmax(ya)] )       
+        ya,xa = stats.histogram(0)
+        ya[0:20] = 0
+        i = np.argmax(ya)
+        print( '\nMode: %f'%((xa[i]+xa[i+1])/2) )       
         plt.plot(xa[1:-1],ya[1:])
         plt.title('Histogram ENL for %s'%infile)
         plt.xlim([0,xrange])
@@ -188,15 +143,17 @@ Options:
    -s <str>    save histogram image
    -x <int>    x-axis range (default 50)
    -d <list>   spatial subset list e.g. -d [0,0,400,400]
+   -r          refine the ENL beyond the 0.1 resolution of the lookup table
 
 An ENL image will be written to the same directory with '_enl' appended.
 
 ------------------------------------------------''' %sys.argv[0]
-    options,args = getopt.getopt(sys.argv[1:],'hfd:x:s:')
+    options,args = getopt.getopt(sys.argv[1:],'hfrd:x:s:')
     dims = None
     fileout = False
     xrange = 50
     sfn = None
+    refine = False
     for option, value in options: 
         if option == '-h':
             print( usage )
@@ -207,6 +164,8 @@ An ENL image will be written to the same directory with '_enl' appended.
             xrange = eval(value)    
         elif option == '-f':
             fileout = True  
+        elif option == '-r':
+            refine = True
         elif option == '-s':
             sfn = value       
     if len(args) != 1:
@@ -218,7 +177,7 @@ An ENL image will be written to the same directory with '_enl' appended.
     basename = os.path.basename(infile)
     root, ext = os.path.splitext(basename)
     outfile = path + '/' + root + '_enl' + ext       
-    enl(infile,dims,outfile,fileout,xrange,sfn)                
+    enl(infile,dims,outfile,fileout,xrange,sfn,refine)                
         
 if __name__ == '__main__':
     main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#******************************************************************************
+#  Name:     gdalio.py
+#  Purpose:  Tiled raster input/output with GDAL: block aligned windows,
+#            multi-band reads into preallocated buffers, subset geotransforms
+#            and tiled, compressed GeoTIFF output
+#  Usage:
+#    from auxil import gdalio
+#    inDataset = gdal.Open(infile,GA_ReadOnly)
+#    outDataset = gdalio.create(outfile,cols,rows,bands,like=inDataset,dims=dims)
+#    for x0,y0,cols,rows in gdalio.windows(inDataset,dims):
+#        img = gdalio.read(inDataset,[x0,y0,cols,rows])
+#        gdalio.write(outDataset,img,x0-dims[0],y0-dims[1])
+#
+# MIT License
+#
+# Copyright (c) 2018 Mort Canty
+
+import numpy as np
+from osgeo import gdal, gdal_array
+from osgeo.gdalconst import GDT_Float32
+
+#  creation options for GeoTIFF output
+gtiff_options = ['TILED=YES','COMPRESS=DEFLATE','BIGTIFF=IF_SAFER']
+
+#  default number of pixels per window
+window_pixels = 2**20
+
+def getdims(inDataset,dims=None):
+    '''return the spatial subset [x0,y0,cols,rows], default the whole image'''
+    if dims is None:
+        return [0,0,inDataset.RasterXSize,inDataset.RasterYSize]
+    return list(dims)
+
+def windows(inDataset,dims=None,lines=None):
+    '''generator of full width windows [x0,y0,cols,rows] covering the subset dims
+       whose boundaries lie on the block grid of the first band, with about
+       window_pixels pixels each (or lines rows)'''
+    x0,y0,cols,rows = getdims(inDataset,dims)
+    _,blockrows = inDataset.GetRasterBand(1).GetBlockSize()
+    blockrows = max(blockrows,1)
+    if lines is None:
+        lines = max(window_pixels//max(cols,1),1)
+    lines = max(lines//blockrows,1)*blockrows
+    y = y0
+    while y < y0+rows:
+#      next block boundary at least lines rows further on
+        y1 = min(((y+lines)//blockrows)*blockrows,y0+rows)
+        if y1 <= y:
+            y1 = min(y+lines,y0+rows)
+        yield [x0,y,cols,y1-y]
+        y = y1
+
+def read(inDataset,dims=None,pos=None,dtype=np.float64,out=None,nan=True):
+    '''read the bands pos (1-based, default all) of window dims into the
+       preallocated band sequential buffer out[bands,rows,cols] (or a new one
+       of type dtype) and return it as a pixel interleaved (rows*cols,bands) view,
+       NaNs are set to zero unless nan is False. out must be C-contiguous'''
+    x0,y0,cols,rows = getdims(inDataset,dims)
+    if pos is None:
+        pos = range(1,inDataset.RasterCount+1)
+    if out is None:
+        out = np.empty((len(pos),rows,cols),dtype=dtype)
+    elif not out.flags.c_contiguous:
+#      otherwise the returned array would be a copy, not a view of out    
+        raise ValueError('gdalio.read: out must be C-contiguous')
+    pos = list(pos)
+#  a single (band interleaved) RasterIO call for all bands    
+    inDataset.ReadAsArray(x0,y0,cols,rows,buf_obj=out if len(pos)>1 else out[0],band_list=pos)
+    if nan:
+        np.nan_to_num(out,copy=False)
+    return np.reshape(out,(len(pos),rows*cols)).T
+
+def geotransform(inDataset,dims=None):
+    '''return the geotransform of the spatial subset dims of inDataset or None'''
+    gt = inDataset.GetGeoTransform()
+    if gt is None:
+        return None
+    x0,y0,_,_ = getdims(inDataset,dims)
+    gt = list(gt)
+    gt[0],gt[3] = gt[0]+x0*gt[1]+y0*gt[2], gt[3]+x0*gt[4]+y0*gt[5]
+    return tuple(gt)
+
+def create(outfile,cols,rows,bands,like=None,dims=None,dtype=GDT_Float32,driver=None,options=None):
+    '''create an output dataset, georeferenced like the subset dims of the
+       dataset like, with the driver of like (default GTiff). GeoTIFFs are
+       tiled and compressed unless other creation options are given'''
+    if driver is None:
+        driver = like.GetDriver() if like is not None else gdal.GetDriverByName('GTiff')
+    elif isinstance(driver,str):
+        driver = gdal.GetDriverByName(driver)
+    if options is None:
+        options = gtiff_options if driver.ShortName == 'GTiff' else []
+    if not isinstance(dtype,int):
+        dtype = gdal_array.NumericTypeCodeToGDALTypeCode(np.dtype(dtype).type)
+    outDataset = driver.Create(outfile,cols,rows,bands,dtype,options)
+    if like is not None:
+        gt = geotransform(like,dims)
+        if gt is not None:
+            outDataset.SetGeoTransform(gt)
+        projection = like.GetProjection()
+        if projection is not None:
+            outDataset.SetProjection(projection)
+    return outDataset
+
+def write(outDataset,img,x0=0,y0=0,pos=None):
+    '''write img[bands,rows,cols] (or a single band img[rows,cols]) at offset x0, y0
+       to the bands pos (1-based, default 1 ... bands) of outDataset'''
+    if img.ndim == 2:
+        img = img[np.newaxis,...]
+    if pos is None:
+        pos = range(1,img.shape[0]+1)
+    for k,b in enumerate(pos):
+        outDataset.GetRasterBand(b).WriteArray(img[k],x0,y0)
+
+if __name__ == '__main__':
+    pass
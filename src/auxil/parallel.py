@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#******************************************************************************
+#  Name:     parallel.py
+#  Purpose:  Execution backends for mapping a function over a list of
+#            (small) argument tuples: serial, a local process pool or an
+#            ipyparallel cluster
+#  Usage:
+#    from auxil.parallel import pmap
+#    for result in pmap(func,args,backend='pool'):
+#        ...
+#
+# MIT License
+#
+# Copyright (c) 2018 Mort Canty
+
+import os
+
+backends = ['serial','pool','ipp']
+
+def nworkers(backend='pool',workers=None):
+    '''return the number of workers a backend will use'''
+    if backend == 'serial':
+        return 1
+    elif workers is not None:
+        return workers
+    elif backend == 'ipp':
+        try:
+            from ipyparallel import Client
+            return len(Client().ids)
+        except Exception:
+            return 1
+    else:
+        return os.cpu_count() or 1
+
+def pmap(func,args,backend='pool',workers=None):
+    '''generator yielding func(arg) for arg in args, in order
+
+       backend:  'serial'  map in the calling process
+                 'pool'    local process pool with workers processes
+                           (default os.cpu_count())
+                 'ipp'     running ipyparallel cluster (ipcluster start),
+                           falls back to serial if none is available
+
+       func must be picklable (module level) and args should carry file
+       names and index ranges rather than large arrays'''
+    if backend == 'serial':
+        for arg in args:
+            yield func(arg)
+    elif backend == 'pool':
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for result in executor.map(func,args):
+                yield result
+    elif backend == 'ipp':
+        try:
+            from ipyparallel import Client
+            c = Client()
+#          ship functions defined in scripts by value
+            c[:].use_cloudpickle()
+            v = c.load_balanced_view()
+            print( 'available engines %s'%str(c.ids) )
+            results = v.map(func,args,ordered=True,block=False)
+        except Exception as e:
+            print( '%s \nno ipyparallel cluster, so running sequentially ...'%e )
+            results = map(func,args)
+        for result in results:
+            yield result
+    else:
+        raise ValueError('unknown backend %s, must be one of %s'%(backend,str(backends)))
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#******************************************************************************
+#  Name:     polmat.py
+#  Purpose:  Kernels for polarimetric matrix images stored as real (N,bands)
+#            arrays, bands = 9 (quad pol), 4 (dual pol), 3 (quad pol diagonal),
+#            2 (dual pol diagonal) or 1 (single pol), with band layout
+#
+#              9:  k, Re(a), Im(a), Re(rho), Im(rho), xsi, Re(b), Im(b), zeta
+#              4:  k, Re(a), Im(a), xsi
+#
+#            for the Hermitian matrices [[k,a,rho],[a*,xsi,b],[rho*,b*,zeta]]
+#            and [[k,a],[a*,xsi]]. The kernels work on float32 or float64
+#            buffers without complex temporaries and accept preallocated outputs.
+#  Usage:
+#    from auxil import polmat
+#    d = polmat.det(img)
+#
+# MIT License
+#
+# Copyright (c) 2018 Mort Canty
+
+import numpy as np
+
+def diag(bands):
+    '''return positions of the diagonal matrix elements'''
+    if bands == 9:
+        return [0,5,8]
+    elif bands == 4:
+        return [0,3]
+    else:
+        return list(range(bands))
+
+def det(img,out=None):
+    '''return determinant of 1, 2, 3, 4, or 9-band polarimetric image img[...,bands]'''
+    bands = img.shape[-1]
+    if out is None:
+        out = np.empty(img.shape[:-1],dtype=img.dtype)
+    b = [img[...,i] for i in range(bands)]
+    if bands == 1:
+        out[...] = b[0]
+    elif bands == 2:
+        np.multiply(b[0],b[1],out=out)
+    elif bands == 3:
+        np.multiply(b[0],b[1],out=out)
+        out *= b[2]
+    elif bands == 4:
+        t = np.empty_like(out)
+        np.multiply(b[0],b[3],out=out)
+        np.multiply(b[1],b[1],out=t)
+        out -= t
+        np.multiply(b[2],b[2],out=t)
+        out -= t
+    elif bands == 9:
+        k,ar,ai,pr,pi,s,br,bi,z = b
+        t = np.empty_like(out)
+        u = np.empty_like(out)
+#      k*xsi*zeta
+        np.multiply(k,s,out=out)
+        out *= z
+#      + 2*Re(a*b*conj(rho)) = 2*( pr*(ar*br-ai*bi) + pi*(ai*br+ar*bi) )
+        np.multiply(ar,br,out=t)
+        np.multiply(ai,bi,out=u)
+        t -= u
+        t *= pr
+        t *= 2
+        out += t
+        np.multiply(ai,br,out=t)
+        np.multiply(ar,bi,out=u)
+        t += u
+        t *= pi
+        t *= 2
+        out += t
+#      - xsi*|rho|^2 - k*|b|^2 - zeta*|a|^2
+        for x,re,im in ((s,pr,pi),(k,br,bi),(z,ar,ai)):
+            np.multiply(re,re,out=t)
+            np.multiply(im,im,out=u)
+            t += u
+            t *= x
+            out -= t
+    else:
+        raise ValueError('number of bands must be 1, 2, 3, 4 or 9')
+    return out
+
+def logdet(img,out=None):
+    '''return log of determinant, non-positive determinants are clipped
+       at the smallest positive number of the image dtype'''
+    out = det(img,out)
+    np.nan_to_num(out,copy=False)
+    np.maximum(out,np.finfo(out.dtype).tiny,out=out)
+    return np.log(out,out=out)
+
+def logdetsum(imgs,j=None,out=None):
+    '''return log of the determinant of the sum of the first j images of
+       the stack imgs[k,...,bands] (default all k)'''
+    if j is None:
+        j = imgs.shape[0]
+    return logdet(np.sum(imgs[:j],axis=0),out)
+
+def loewner(img,out=None):
+    ''' return Loewner direction image (uint8): 1 positive definite
+                                                2 negative definite
+                                                3 neither '''
+    bands = img.shape[-1]
+    if out is None:
+        out = np.empty(img.shape[:-1],dtype=np.uint8)
+    out[...] = 3
+    if bands <= 3:
+#      diagonal matrices
+        d = np.min(img,axis=-1)
+        out[d > 0] = 1
+        np.max(img,axis=-1,out=d)
+        out[d < 0] = 2
+        return out
+#  Sylvester's criterion on the leading principal minors
+    if bands not in (4,9):
+        raise ValueError('number of bands must be 1, 2, 3, 4 or 9')
+    a = img[...,0]
+    d = det(img)
+    if bands == 4:
+        pos = (d > 0) & (a > 0)
+        neg = (d > 0) & (a < 0)
+    else:
+        m2 = det(img[...,[0,1,2,5]]) > 0
+        pos = m2 & (a > 0) & (d > 0)
+        neg = m2 & (a < 0) & (d < 0)
+    out[pos] = 1
+    out[neg] = 2
+    return out
+
+if __name__ == '__main__':
+    pass
@@ -12,15 +12,65 @@
 #  Usage:     
 #    import registersar
 #    register.register[sar|vnir] (reffilename,warpfilename,dims,outfile) 
+#    register.register_stack(reffilename,warpfilenames,dims,outfile) 
 #          or        
-#    python registersar.py [OPTIONS] reffilename warpfilename
+#    python registersar.py [OPTIONS] reffilename warpfilename [warpfilename ...]
 #
 #  Copyright (c) 2018 Mort Canty
 
 import sys, getopt
+
+#  reference spectra last loaded from an .npz file by this process (at most one
+#  entry), keyed by file name, modification time and size so that a reused 
+#  temporary name is not mistaken for an earlier reference
+_refcache = {}
+  
+def warp_affine(shape, scale, angle, shift):
+    '''Return (matrix, offset) of the single affine map from the output to the input 
+       pixel coordinates equivalent to applying ndii.zoom(1.0/scale), ndii.rotate(angle)
+       and ndii.shift(shift) in sequence to an image of the given shape'''
+    import numpy as np
+    from scipy import special
+    shape = np.asarray(shape,dtype=float)
+#  zoom     
+    zshape = np.round(shape/scale)
+    z = np.diag((shape-1)/np.maximum(zshape-1,1))
+#  rotate with reshape about the image centers  
+    c, s = special.cosdg(angle), special.sindg(angle)
+    rot = np.array([[c, s],[-s, c]])
+    bounds = np.dot(rot,[[0, 0, zshape[0], zshape[0]],[0, zshape[1], 0, zshape[1]]])
+    rshape = (np.ptp(bounds,axis=1) + 0.5).astype(int)
+    roffset = (zshape-1)/2 - np.dot(rot,(rshape-1)/2)
+#  compose, the shift comes last    
+    matrix = np.dot(z,rot)
+    offset = np.dot(z,roffset) - np.dot(matrix,shift)
+    return (matrix, offset)
   
-def register(file0, file1, dims=None, outfile=None): 
+def reference(file0, dims=None, pyramid=0):
+    '''Return the similarity spectra of the log span of (the subset dims of) 
+       the reference image file0, see auxil1.similarity_reference'''
     import auxil.auxil1 as auxil
+    import auxil.polmat as polmat
+    import numpy as np
+    from osgeo import gdal
+    from osgeo.gdalconst import GA_ReadOnly
+    gdal.AllRegister()
+    inDataset0 = gdal.Open(file0, GA_ReadOnly)     
+    if dims == None:
+        dims = [0,0,inDataset0.RasterXSize,inDataset0.RasterYSize]
+    x0,y0,cols,rows = dims 
+    span0 = 0.0
+    for p in polmat.diag(inDataset0.RasterCount):
+        span0 += inDataset0.GetRasterBand(p+1).ReadAsArray(x0, y0, cols, rows)
+    inDataset0 = None    
+    return auxil.similarity_reference(np.log(np.nan_to_num(span0)+0.001),pyramid)
+
+def register(file0, file1, dims=None, outfile=None, ref=None, params=False): 
+    '''Register file1 to (the subset dims of) file0 and return the warped filename, 
+       or (filename,scale,angle,shift) if params is set. ref may be reference(file0,dims)
+       or the name of an .npz file holding it, the reference image is then not read'''
+    import auxil.auxil1 as auxil
+    import auxil.polmat as polmat
     import os, time
     import numpy as np
     from osgeo import gdal
@@ -82,130 +132,52 @@ def register(file0, file1, dims=None, outfile=None):
         gt1[0] = ulx0 
         gt1[3] = uly0   
         outDataset.SetGeoTransform(tuple(gt1)) 
-    #  get matching subsets from geotransform     
-        rasterBand = inDataset0.GetRasterBand(1)   
-        span0 = rasterBand.ReadAsArray(x0, y0, cols, rows)
-        rasterBand = inDataset1.GetRasterBand(1)
-        span1 = rasterBand.ReadAsArray(x1, y1, cols, rows)
-        if bands == 9:
-    #      get warp parameters using span images         
-            print( 'warping 9 bands (quad pol)...' ) 
-            rasterBand = inDataset0.GetRasterBand(6)
-            span0 += rasterBand.ReadAsArray(x0, y0, cols, rows)
-            rasterBand = inDataset0.GetRasterBand(9)
-            span0 += rasterBand.ReadAsArray(x0, y0, cols, rows)  
-            span0 = np.log(np.nan_to_num(span0)+0.001)                                   
-            rasterBand = inDataset1.GetRasterBand(6)
-            span1 += rasterBand.ReadAsArray(x1, y1, cols, rows)
-            rasterBand = inDataset1.GetRasterBand(9)
-            span1 += rasterBand.ReadAsArray(x1, y1, cols, rows)  
-            span1 = np.log(np.nan_to_num(span1)+0.001)                           
-            scale, angle, shift = auxil.similarity(span0, span1)   
-    #      warp the target to the reference and clip
-            for k in range(9): 
-                rasterBand = inDataset1.GetRasterBand(k+1)
-                band = rasterBand.ReadAsArray(0, 0, cols1, rows1).astype(np.float32)
-                bn1 = np.nan_to_num(band)                  
-                bn2 = ndii.zoom(bn1, 1.0 / scale)
-                bn2 = ndii.rotate(bn2, angle)
-                bn2 = ndii.shift(bn2, shift)
-                bn = bn2[y1:y1+rows,x1:x1+cols] 
-                outBand = outDataset.GetRasterBand(k+1)
-                outBand.WriteArray(bn)
-                outBand.FlushCache()
-        elif bands == 4:
-    #      get warp parameters using span images         
-            print( 'warping 4 bands (dual pol)...' )
-            rasterBand = inDataset0.GetRasterBand(4)
-            span0 += rasterBand.ReadAsArray(x0, y0, cols, rows)
-            span0 = np.log(np.nan_to_num(span0)+0.001)                                   
-            rasterBand = inDataset1.GetRasterBand(4)
-            span1 += rasterBand.ReadAsArray(x1, y1, cols, rows)
-            span1 = np.log(np.nan_to_num(span1)+0.001)                           
-            scale, angle, shift = auxil.similarity(span0, span1)   
-    #      warp the target to the reference and clip
-            for k in range(4): 
-                rasterBand = inDataset1.GetRasterBand(k+1)
-                band = rasterBand.ReadAsArray(0, 0, cols1, rows1).astype(np.float32)
-                bn1 = np.nan_to_num(band)                  
-                bn2 = ndii.zoom(bn1, 1.0 / scale)
-                bn2 = ndii.rotate(bn2, angle)
-                bn2 = ndii.shift(bn2, shift)
-                bn = bn2[y1:y1+rows,x1:x1+cols] 
-                outBand = outDataset.GetRasterBand(k+1)
-                outBand.WriteArray(bn)
-                outBand.FlushCache()           
-        elif bands ==3:
-    #      get warp parameters using span images         
-            print( 'warping 3 bands (quad pol diagonal)...' ) 
-            rasterBand = inDataset0.GetRasterBand(2)
-            span0 += rasterBand.ReadAsArray(x0, y0, cols, rows)
-            rasterBand = inDataset0.GetRasterBand(3)
-            span0 += rasterBand.ReadAsArray(x0, y0, cols, rows)
-            span0 = np.log(np.nan_to_num(span0)+0.001)                                   
-            rasterBand = inDataset1.GetRasterBand(2)
+    #  get matching subsets from geotransform, warp parameters from the log span images
+        layout = {9:'9 bands (quad pol)',4:'4 bands (dual pol)',3:'3 bands (quad pol diagonal)',
+                  2:'2 bands (dual pol diagonal)',1:'1 band (single pol)'}
+        print( 'warping %s...'%layout[bands] ) 
+        if ref is None:
+            ref = reference(file0, dims)
+        elif isinstance(ref, str):
+            st = os.stat(ref)
+            key = (ref,st.st_mtime_ns,st.st_size)
+            if key not in _refcache:
+                _refcache.clear()
+                with np.load(ref) as f:
+                    _refcache[key] = {name:f[name] for name in f.files}
+                _refcache[key]['shape'] = tuple(_refcache[key]['shape'])
+                _refcache[key]['pyramid'] = int(_refcache[key]['pyramid'])
+            ref = _refcache[key]
+        span1 = 0.0
+        for p in polmat.diag(bands):
+            rasterBand = inDataset1.GetRasterBand(p+1)
             span1 += rasterBand.ReadAsArray(x1, y1, cols, rows)
-            rasterBand = inDataset1.GetRasterBand(3)
-            span1 += rasterBand.ReadAsArray(x1, y1, cols, rows)
-            span1 = np.log(np.nan_to_num(span1)+0.001)                           
-            scale, angle, shift = auxil.similarity(span0, span1)   
-    #      warp the target to the reference and clip
-            for k in range(3): 
-                rasterBand = inDataset1.GetRasterBand(k+1)
-                band = rasterBand.ReadAsArray(0, 0, cols1, rows1).astype(np.float32)
-                bn1 = np.nan_to_num(band)                  
-                bn2 = ndii.zoom(bn1, 1.0 / scale)
-                bn2 = ndii.rotate(bn2, angle)
-                bn2 = ndii.shift(bn2, shift)
-                bn = bn2[y1:y1+rows,x1:x1+cols] 
-                outBand = outDataset.GetRasterBand(k+1)
-                outBand.WriteArray(bn)
-                outBand.FlushCache()            
-        elif bands == 2:
-    #      get warp parameters using span images         
-            print( 'warping 2 bands (dual pol diagonal)...' ) 
-            rasterBand = inDataset0.GetRasterBand(2)
-            span0 += rasterBand.ReadAsArray(x0, y0, cols, rows)
-            span0 = np.log(np.nan_to_num(span0)+0.001)                                   
-            rasterBand = inDataset1.GetRasterBand(2)
-            span1 += rasterBand.ReadAsArray(x1, y1, cols, rows)
-            span1 = np.log(np.nan_to_num(span1)+0.001)                           
-            scale, angle, shift = auxil.similarity(span0, span1)   
-    #      warp the target to the reference and clip
-            for k in range(2): 
+        span1 = np.log(np.nan_to_num(span1)+0.001)                           
+        scale, angle, shift = auxil.similarity(None, span1, ref)   
+        print( 'scale: %f  angle: %f  shift: %s'%(scale,angle,str(shift)) )
+    #  warp the target to the reference and clip, reading only the source footprint 
+        matrix, offset = warp_affine((rows1,cols1),scale,angle,shift)
+        offset = offset + np.dot(matrix,[y1,x1])
+        corners = np.dot(matrix,[[0,0,rows-1,rows-1],[0,cols-1,0,cols-1]]).T + offset
+        ya,xa = np.maximum(np.floor(corners.min(axis=0)).astype(int)-8,0)
+        yb,xb = np.minimum(np.ceil(corners.max(axis=0)).astype(int)+9,[rows1,cols1])
+        for k in range(bands): 
+            outBand = outDataset.GetRasterBand(k+1)
+            if (ya < yb) and (xa < xb):
                 rasterBand = inDataset1.GetRasterBand(k+1)
-                band = rasterBand.ReadAsArray(0, 0, cols1, rows1).astype(np.float32)
-                bn1 = np.nan_to_num(band)                  
-                bn2 = ndii.zoom(bn1, 1.0 / scale)
-                bn2 = ndii.rotate(bn2, angle)
-                bn2 = ndii.shift(bn2, shift)
-                bn = bn2[y1:y1+rows,x1:x1+cols] 
-                outBand = outDataset.GetRasterBand(k+1)
-                outBand.WriteArray(bn)
-                outBand.FlushCache()            
-        elif bands == 1:
-    #      get warp parameters using span images         
-            print( 'warping 1 band (single pol)...' ) 
-            span0 = np.log(np.nan_to_num(span0)+0.001)                                   
-            span1 = np.log(np.nan_to_num(span1)+0.001)                           
-            scale, angle, shift = auxil.similarity(span0, span1)   
-    #      warp the target to the reference and clip
-            for k in range(1): 
-                rasterBand = inDataset1.GetRasterBand(k+1)
-                band = rasterBand.ReadAsArray(0, 0, cols1, rows1).astype(np.float32)
-                bn1 = np.nan_to_num(band)                  
-                bn2 = ndii.zoom(bn1, 1.0 / scale)
-                bn2 = ndii.rotate(bn2, angle)
-                bn2 = ndii.shift(bn2, shift)
-                bn = bn2[y1:y1+rows,x1:x1+cols] 
-                outBand = outDataset.GetRasterBand(k+1)
-                outBand.WriteArray(bn)
-                outBand.FlushCache()           
+                band = rasterBand.ReadAsArray(int(xa), int(ya), int(xb-xa), int(yb-ya)).astype(np.float32)
+                bn = ndii.affine_transform(np.nan_to_num(band), matrix, offset-[ya,xa], output_shape=(rows,cols))
+            else:
+                bn = np.zeros((rows,cols),dtype=np.float32)
+            outBand.WriteArray(bn)
+            outBand.FlushCache()           
         inDataset0 = None
         inDataset1 = None
         outDataset = None    
         print( 'Warped image written to: %s'%outfile )
         print( 'elapsed time: ' + str(time.time() - start)  )
+        if params:
+            return (outfile, scale, angle, shift)
         return outfile
     except Exception as e:
         print( 'registersar failed: %s'%e )    
@@ -213,20 +185,93 @@ def register(file0, file1, dims=None, outfile=None):
     
 
     
+def call_register(arg4):
+    file0,file1,dims,reffile = arg4
+    return register(file0,file1,dims,ref=reffile,params=True)
+
+def register_stack(file0, files, dims=None, outfile=None, backend='pool', workers=None, pyramid=0):
+    '''Register the images files to (the subset dims of) file0 concurrently. The
+       reference spectra are computed once and shared with the workers through a 
+       temporary .npz file. Returns the list of warped filenames and the list of 
+       (scale,angle,shift). If outfile is given, the warped images are also 
+       stacked band sequentially into it, as a virtual raster if it ends in .vrt.
+       With pyramid > 0 scale and angle are estimated on decimated span images'''
+    import os, tempfile, time
+    import numpy as np
+    from osgeo import gdal
+    from osgeo.gdalconst import GA_ReadOnly, GDT_Float32
+    from auxil.parallel import pmap
+    start = time.time()
+    ref = reference(file0, dims, pyramid)
+    fd, reffile = tempfile.mkstemp(suffix='.npz',dir=os.path.dirname(os.path.abspath(file0)))
+    os.close(fd)
+    try:
+        np.savez(reffile,**ref)
+        ref = None
+        results = list(pmap(call_register,[(file0,fn,dims,reffile) for fn in files],backend,workers))
+    finally:
+        os.remove(reffile)
+        _refcache.clear()
+    if any(result in (None,0) for result in results):
+        print( 'register_stack failed for %s'%str([fn for fn,result in zip(files,results) if result in (None,0)]) )
+        return None
+    outfiles = [result[0] for result in results]
+    params = [result[1:] for result in results]
+    print( '========================= ' )
+    print( '     Register SAR stack'    )
+    print( '========================='  )
+    for fn,(scale,angle,shift) in zip(outfiles,params):
+        print( '%s  scale: %f  angle: %f  shift: %s'%(fn,scale,angle,str(shift)) )
+    if outfile is not None:
+        inDataset = gdal.Open(outfiles[0],GA_ReadOnly)
+        cols = inDataset.RasterXSize
+        rows = inDataset.RasterYSize
+        bands = inDataset.RasterCount
+        if outfile.lower().endswith('.vrt'):
+            outDataset = gdal.GetDriverByName('VRT').Create(outfile,cols,rows,0)
+        else:
+            outDataset = inDataset.GetDriver().Create(outfile,cols,rows,len(outfiles)*bands,GDT_Float32)
+        outDataset.SetGeoTransform(inDataset.GetGeoTransform())
+        outDataset.SetProjection(inDataset.GetProjection())
+        inDataset = None
+        for i,fn in enumerate(outfiles):
+            inDataset = gdal.Open(fn,GA_ReadOnly)
+            for k in range(bands):
+                if outfile.lower().endswith('.vrt'):
+                    outDataset.AddBand(GDT_Float32)
+                    source = '<SimpleSource><SourceFilename relativeToVRT="0">%s</SourceFilename>' \
+                             '<SourceBand>%i</SourceBand></SimpleSource>'%(os.path.abspath(fn),k+1)
+                    outDataset.GetRasterBand(i*bands+k+1).SetMetadataItem('source_0',source,'new_vrt_sources')
+                else:
+                    outBand = outDataset.GetRasterBand(i*bands+k+1)
+                    outBand.WriteArray(inDataset.GetRasterBand(k+1).ReadAsArray())
+                    outBand.FlushCache()
+            inDataset = None
+        outDataset = None
+        print( 'stack written to: %s'%outfile )
+    print( 'elapsed time: ' + str(time.time() - start)  )
+    return (outfiles, params)
+    
 def main(): 
     usage = '''
 Usage:
 ------------------------------------------------
 
-python %s [OPTIONS] reffilename warpfilename
+python %s [OPTIONS] reffilename warpfilename [warpfilename ...]
     
     
-Perform image-image registration of two polarimetric SAR images   
+Perform image-image registration of two polarimetric SAR images,
+or of a stack of them to the same reference   
     
 Options:
 
    -h         this help
    -d  <list> spatial subset list e.g. -d [0,0,500,500]
+   -o  <str>  (stack) also write all warped images to this file, band sequential,
+              as a virtual raster if it ends in .vrt
+   -j  <int>  (stack) number of workers for the pool backend (default number of cores)
+   -y  <int>  (stack) estimate scale and angle on span images decimated this many times (default 0)
+   --backend <str>  (stack) execution backend: serial, pool or ipp (default pool)
    
 The reference image should be smaller than the warp image 
 (i.e., the warp image should overlap the reference image completely) 
@@ -246,21 +291,39 @@ dimensions of the reference image.
    
 --------------------------------------------'''%sys.argv[0]
 
-    options,args = getopt.getopt(sys.argv[1:],'hd:')
+    options,args = getopt.getopt(sys.argv[1:],'hd:o:j:y:',['backend='])
     dims = None
+    outfile = None
+    backend = 'pool'
+    workers = None
+    pyramid = 0
     for option, value in options: 
         if option == '-h':
             print( usage )
             return 
         elif option == '-d':
             dims = eval(value)          
-    if len(args) != 2:
+        elif option == '-o':
+            outfile = value
+        elif option == '-j':
+            workers = eval(value)
+        elif option == '--backend':
+            backend = value
+        elif option == '-y':
+            pyramid = eval(value)
+    from auxil.parallel import backends
+    if backend not in backends:
+        print('backend must be one of %s'%str(backends))
+        sys.exit(1)
+    if len(args) < 2:
         print( 'Incorrect number of arguments' )
         print( usage )
         sys.exit(1)        
     fn0 = args[0]
-    fn1 = args[1]
-    outfile = register(fn0,fn1,dims=dims)     
+    if (len(args) == 2) and (outfile is None) and (pyramid == 0):
+        register(fn0,args[1],dims=dims)     
+    else:
+        register_stack(fn0,args[1:],dims,outfile,backend,workers,pyramid)
 
 if __name__ == '__main__':
     main()    
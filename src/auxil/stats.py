@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#******************************************************************************
+#  Name:     stats.py
+#  Purpose:  Mergeable summary statistics (count, mean, covariance, minimum,
+#            maximum, fixed-bin histograms) accumulated tile by tile and
+#            combined across workers, for single pass statistics and
+#            contrast stretches of large rasters
+#  Usage:
+#    from auxil.stats import raster_stats
+#    s = raster_stats(infile,dims,pos,byte=True,backend='pool')
+#    mn, cov = s.means(), s.covariance()
+#    for k in range(len(pos)):
+#        tile = auxil1.lin2pcstr(tile,s.range(k),s.hist[k])
+#
+# MIT License
+#
+# Copyright (c) 2018 Mort Canty
+
+import numpy as np
+from auxil.auxil1 import Cpm
+
+class Stats(object):
+    '''Mergeable statistics of N-dimensional observations. The histogram of
+       each component has `bins` fixed bins over rng (one (lo,hi) pair or one
+       per component) or, with byte=True, counts the 256 levels of
+       auxil1.bytestr(x,rng). With moments=False the count, mean and 
+       covariance (a rank-k update per block) are not accumulated'''
+    def __init__(self,N,bins=0,rng=None,byte=False,moments=True):
+        self.N = N
+        self.cpm = Cpm(N) if moments else None
+        self.min = np.full(N,np.inf)
+        self.max = np.full(N,-np.inf)
+        self.byte = byte
+        self.bins = 256 if byte else bins
+        if self.bins:
+            self.rng = np.broadcast_to(np.asarray(rng,dtype=np.float64),(N,2))
+            self.hist = np.zeros((N,self.bins),dtype=np.int64)
+        else:
+            self.rng = None
+            self.hist = None
+
+    def update(self,X):
+        '''add the observations X[n,N]'''
+        X = np.reshape(X,(-1,self.N))
+        if X.shape[0] == 0:
+            return
+        if self.cpm is not None:
+            self.cpm.update(X)
+        self.min = np.minimum(self.min,np.min(X,axis=0))
+        self.max = np.maximum(self.max,np.max(X,axis=0))
+        if self.bins:
+            for k in range(self.N):
+                lo,hi = self.rng[k]
+                if self.byte:
+                    levels = (X[:,k]-lo)*255.0/(hi-lo)
+                    levels = np.asarray(np.clip(levels,0,255),np.uint8)
+                    self.hist[k] += np.bincount(levels,minlength=256)
+                else:
+                    self.hist[k] += np.histogram(X[:,k],self.bins,(lo,hi))[0]
+
+    def merge(self,other):
+        '''add the observations summarized by other, return self'''
+        if self.cpm is not None:
+            self.cpm.merge(other.cpm)
+        self.min = np.minimum(self.min,other.min)
+        self.max = np.maximum(self.max,other.max)
+        if self.bins:
+            self.hist += other.hist
+        return self
+
+    def count(self):
+        return self.cpm.sw
+
+    def means(self):
+        return self.cpm.means()
+
+    def covariance(self):
+        return np.asarray(self.cpm.covariance())
+
+    def variance(self):
+        return np.diag(self.covariance())
+
+    def range(self,k):
+        '''[min,max] of component k'''
+        return [self.min[k],self.max[k]]
+
+    def histogram(self,k):
+        '''histogram and bin edges of component k'''
+        lo,hi = self.rng[k]
+        if self.byte:
+            return self.hist[k], np.arange(257.0)
+        return self.hist[k], np.linspace(lo,hi,self.bins+1)
+
+def tile_stats(arg6):
+    '''statistics of the bands pos of the window of a raster file'''
+    from osgeo import gdal
+    from osgeo.gdalconst import GA_ReadOnly
+    from auxil import gdalio
+    fn,window,pos,bins,rng,byte,nan = arg6
+    X = gdalio.read(gdal.Open(fn,GA_ReadOnly),window,pos,nan=nan)
+    s = Stats(len(pos),bins,rng,byte)
+    s.update(X)
+    return s
+
+def raster_stats(fn,dims=None,pos=None,bins=0,rng=None,byte=False,nan=True,
+                 backend='serial',workers=None):
+    '''statistics of the bands pos (1-based, default all) of the spatial subset
+       dims of a raster file, accumulated over row windows mapped with
+       auxil.parallel.pmap. Histograms without a range rng are taken over the
+       [min,max] range of each band, found in a first pass'''
+    from osgeo import gdal
+    from osgeo.gdalconst import GA_ReadOnly
+    from auxil import gdalio
+    from auxil.parallel import pmap
+    inDataset = gdal.Open(fn,GA_ReadOnly)
+    if pos is None:
+        pos = range(1,inDataset.RasterCount+1)
+    pos = list(pos)
+    windows = list(gdalio.windows(inDataset,dims))
+    inDataset = None
+    if (bins or byte) and rng is None:
+        s = raster_stats(fn,dims,pos,nan=nan,backend=backend,workers=workers)
+        rng = np.stack([s.min,s.max],axis=1)
+    args = [(fn,window,pos,bins,rng,byte,nan) for window in windows]
+    s = Stats(len(pos),bins,rng,byte)
+    for t in pmap(tile_stats,args,backend,workers):
+        s.merge(t)
+    return s
+
+if __name__ == '__main__':
+    pass
@@ -14,7 +14,8 @@
 import numpy as np
 import os, sys, getopt, time
 from osgeo import gdal
-from osgeo.gdalconst import GA_ReadOnly,GDT_Float32
+from osgeo.gdalconst import GA_ReadOnly
+from auxil import gdalio
 
 def subset(infile, dims=None, pos=None, outfile=None): 
     gdal.AllRegister()
@@ -39,35 +40,16 @@ def subset(infile, dims=None, pos=None, outfile=None):
         else:
             x0 = 0
             y0 = 0       
+            dims = [0,0,cols,rows]
         if pos is not None:
             bands = len(pos)
         else:
             pos = range(1,bands+1)     
-    #   subset
-        G = np.zeros((rows,cols,bands)) 
-        k = 0                               
-        for b in pos:
-            band = inDataset.GetRasterBand(b)
-            G[:,:,k] = band.ReadAsArray(x0,y0,cols,rows)\
-                                  .astype(float)
-            k += 1         
-    #  write to disk       
-        driver = inDataset.GetDriver() 
-        outDataset = driver.Create(outfile,
-                    cols,rows,bands,GDT_Float32)
-        projection = inDataset.GetProjection()
-        geotransform = inDataset.GetGeoTransform()
-        if geotransform is not None:
-            gt = list(geotransform)
-            gt[0] = gt[0] + x0*gt[1]
-            gt[3] = gt[3] + y0*gt[5]
-            outDataset.SetGeoTransform(tuple(gt))
-        if projection is not None:
-            outDataset.SetProjection(projection)        
-        for k in range(bands):        
-            outBand = outDataset.GetRasterBand(k+1)
-            outBand.WriteArray(G[:,:,k],0,0) 
-            outBand.FlushCache() 
+    #   subset, window by window
+        outDataset = gdalio.create(outfile,cols,rows,bands,like=inDataset,dims=dims)
+        for window in gdalio.windows(inDataset,dims):
+            G = gdalio.read(inDataset,window,pos,nan=False)
+            gdalio.write(outDataset,np.reshape(G.T,(bands,window[3],cols)),0,window[1]-y0)
         outDataset = None    
         inDataset = None        
         print( 'elapsed time: %s'%str(time.time()-start) )
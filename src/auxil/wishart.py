@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#******************************************************************************
+#  Name:     wishart.py
+#  Purpose:  Local (numpy) evaluation of the sequential omnibus test statistics
+#            for multi-temporal polarimetric SAR images, see
+#            Condradsen et al. (2016) IEEE Transactions on Geoscience and Remote Sensing,
+#            Vol. 54 No. 5 pp. 3007-3024
+#  Usage:
+#    from auxil.wishart import Cpv
+#     or
+#    from auxil.wishart import omnibus
+#
+# MIT License
+#
+# Copyright (c) 2018 Mort Canty
+
+import os
+import numpy as np
+from scipy import stats, ndimage
+from auxil.polmat import logdet, loewner
+
+def getpvR(lnRj,bands,j,n):
+    '''return p-values for test statistic ln(R_j)'''
+    if (bands==9) or (bands==4) or (bands==1):
+#      full quad, dual pol or intensity (p = 3, 2 or 1)
+        p = np.sqrt(bands)
+        f = p**2
+    else:
+#      quad and dual diagonal matrix cases (f = 3 or 2, p1 = p2 (= p3) =: p = 1)
+        f = bands
+        p = 1
+    rhoj = 1 - (2.*p**2 - 1)*(1. + 1./(j*(j-1)))/(6.*p*n)
+    omega2j = -(f/4.)*(1.-1./rhoj)**2 + (1./(24.*n*n))*p*p*(p*p-1)*(1+(2.*j-1)/(j*(j-1))**2)/rhoj**2
+    Z = -2*rhoj*lnRj
+    return 1.0-((1.-omega2j)*stats.chi2.cdf(Z,[f])+omega2j*stats.chi2.cdf(Z,[f+4]))
+
+def getpvQ(lnQ,bands,k,n):
+    '''return p-values for omnibus test statistic ln(Q) over k images'''
+    if (bands==9) or (bands==4) or (bands==1):
+#      full quad, dual pol or intensity (p = 3, 2 or 1)
+        p = np.sqrt(bands)
+        f =(k-1)*p**2
+        rho = 1.0 - (2*p**2-1)*(k/n-1.0/(n*k))/(6.0*(k-1)*p)
+        omega2 = p**2*(p**2-1)*(k/n**2 - 1.0/(n*n*k*k))/(24.0*rho**2) - p**2*(k-1)*(1.0-1.0/rho)**2/4.0
+    elif bands==2:
+#      dual diagonal matrix case,
+        f = 2.0*(k-1)
+        rho = 1.0 - (k/n-1.0/(n*k))/(6.0*(k-1))
+        omega2 = -(k-1)*(1.0-1/rho)**2/2.0
+    else:
+#      quad diagonal matrix case
+        f = 3.0*(k-1)
+        rho = 1.0 - (k/n-1.0/(n*k))/(6.0*(k-1))
+        omega2 = -3.0*(k-1)*(1.0-1/rho)**2/4.0
+    Z = -2*rho*lnQ
+    return 1.0-((1.-omega2)*stats.chi2.cdf(Z,[f])+omega2*stats.chi2.cdf(Z,[f+4]))
+
+def change_maps(pvbits,n):
+    '''return change maps (cmap,smap,fmap,bmap) for n pixels from the
+       packed significance bits pvbits[ell,j] = packbits(P(R^ell_j+1) <= significance),
+       j = ell ... k-2, and pvbits[ell,k-1] = packbits(P(Q_ell) <= significance)'''
+    k = pvbits.shape[0]
+#  map of most recent change occurrences
+    cmap = np.zeros(n,dtype=np.byte)
+#  map of first change occurrence
+    smap = np.zeros(n,dtype=np.byte)
+#  change frequency map
+    fmap = np.zeros(n,dtype=np.byte)
+#  bitemporal change maps
+    bmap = np.zeros((n,k-1),dtype=np.byte)
+    for ell in range(k-1):
+#      pixels unchanged since ell for which the omnibus test is significant
+        sig = np.unpackbits(pvbits[ell,ell:],axis=-1,count=n).view(bool)
+        idx = np.flatnonzero(sig[-1] & (cmap==ell))
+        if idx.size == 0:
+            continue
+#      first significant R^ell_j at these pixels
+        sig = sig[:-1,idx]
+        j = np.argmax(sig,axis=0)
+        hit = sig[j,np.arange(idx.size)]
+        idx = idx[hit]
+        j = j[hit] + ell
+        fmap[idx] += 1
+        cmap[idx] = j+1
+        bmap[idx,j] = 1
+        if ell==0:
+            smap[idx] = j+1
+    return (cmap,smap,fmap,bmap)
+
+class Cpv(object):
+    '''Incremental p-values for the change indices R^ell_j
+
+       Each image is ingested once. For every interval start ell the
+       running sum n*(X_ell + ... + X_j) and its log-determinant are kept,
+       so that ln(R^ell_j) follows from the previous step alone.'''
+    def __init__(self,n,bands):
+        self.n = np.float64(n)
+        self.bands = bands
+        if bands in (9,3):
+            self.p = 3
+        elif bands in (4,2):
+            self.p = 2
+        else:
+            self.p = 1
+        self.k = 0
+        self.sums = []
+        self.logdetsums = []
+        self.lnQ = []
+
+    def update(self,img):
+        '''ingest the next (N,bands) image and return a list of
+           tuples (ell, p-value, lnRj) for the change indices R^ell_j
+           ending with this image, ell = 0 ... k-2'''
+        n = self.n
+        p = self.p
+        X = n*np.asarray(img,dtype=np.float64)
+        logdetj = logdet(X)
+        logdetsumj = np.empty_like(logdetj)
+        result = []
+        for ell in range(self.k):
+            j = np.float64(self.k - ell + 1)
+            self.sums[ell] += X
+            logdet(self.sums[ell],out=logdetsumj)
+            lnRj = n*( p*( j*np.log(j)-(j-1)*np.log(j-1.) ) + (j-1)*self.logdetsums[ell] + logdetj - j*logdetsumj )
+#          in place, so that memory mapped state is updated too            
+            self.logdetsums[ell][...] = logdetsumj
+            self.lnQ[ell] += lnRj
+            result.append( (ell, getpvR(lnRj,self.bands,j,n), lnRj) )
+        self.sums.append(X)
+        self.logdetsums.append(logdetj)
+        self.lnQ.append(np.zeros(logdetj.shape))
+        self.k += 1
+        return result
+
+    def pvQ(self,ell):
+        '''return p-values for the omnibus test over images ell ... k-1'''
+        return getpvQ(self.lnQ[ell],self.bands,self.k-ell,self.n)
+
+    def direction(self,ell,idx=None):
+        '''return Loewner direction of the last image relative to the 
+           mean of images ell ... k-2 (at the pixels idx)'''
+        j = self.k - ell
+        if idx is None:
+            return loewner(j*self.sums[-1] - self.sums[ell])
+        return loewner(j*self.sums[-1][idx] - self.sums[ell][idx])
+
+    def allocate(self,path,N):
+        '''create the state files for N pixels of the k images ingested so far 
+           in directory path'''
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for ell in range(self.k):
+            np.lib.format.open_memmap(os.path.join(path,'sums%i.npy'%ell),'w+',np.float64,(N,self.bands))
+            np.lib.format.open_memmap(os.path.join(path,'logdetsums%i.npy'%ell),'w+',np.float64,(N,))
+            np.lib.format.open_memmap(os.path.join(path,'lnQ%i.npy'%ell),'w+',np.float64,(N,))
+
+    def save(self,path,i0=0,j0=0,m=None):
+        '''write pixels j0 ... j0+m-1 of the state to pixels i0 ... i0+m-1 of 
+           the files in directory path (see allocate)'''
+        for name in ('sums','logdetsums','lnQ'):
+            for ell,arr in enumerate(getattr(self,name)):
+                out = np.load(os.path.join(path,'%s%i.npy'%(name,ell)),mmap_mode='r+')
+                n = len(arr)-j0 if m is None else m
+                out[i0:i0+n] = arr[j0:j0+n]
+                out.flush()
+
+    def load(self,path,k,i0=0,i1=None):
+        '''read pixels i0 ... i1-1 of the state of k images saved in directory path'''
+        for name in ('sums','logdetsums','lnQ'):
+            setattr(self,name,[np.array(np.load(os.path.join(path,'%s%i.npy'%(name,ell)),mmap_mode='r')[i0:i1])
+                               for ell in range(k)])
+        self.k = k
+
+def omnibus(imList,significance=0.0001,enl=4.4,median=False,lines=256):
+    '''NumPy evaluation of the sequential omnibus algorithm for the k
+       images imList[k][rows,cols,bands], in blocks of lines rows. Returns
+       a dictionary with the keys of eeWishart.omnibus: 
+       cmap, smap, fmap, bmap[rows,cols,k-1] (with Loewner directions),
+       avimgs (the k running means since the last change), avimglog and
+       pvQ (P-values of the omnibus test over all images). As in sar_seqQ,
+       the median filter is applied to the P-values of R_ell,j only'''
+    imgs = [np.asarray(img) for img in imList]
+    k = len(imgs)
+    rows,cols = imgs[0].shape[:2]
+    if imgs[0].ndim == 2:
+        imgs = [img[:,:,np.newaxis] for img in imgs]
+    bands = imgs[0].shape[2]
+    cmap = np.zeros((rows,cols),dtype=np.byte)
+    smap = np.zeros((rows,cols),dtype=np.byte)
+    fmap = np.zeros((rows,cols),dtype=np.byte)
+    bmap = np.zeros((rows,cols,k-1),dtype=np.byte)
+    avimgs = [np.array(imgs[0],dtype=np.float64)]+[np.empty((rows,cols,bands)) for i in range(k-1)]
+    avimglog = np.full((rows,cols),float(k))
+    pvQ = np.zeros((rows,cols))
+    for y0 in range(0,rows,lines):
+        y1 = min(y0+lines,rows)
+#      the median filter needs one row of context above and below the block    
+        t0,t1 = (max(y0-1,0),min(y1+1,rows)) if median else (y0,y1)
+        m = (y1-y0)*cols
+        i0 = (y0-t0)*cols
+        pvbits = np.zeros((k,k,(m+7)//8),dtype=np.uint8)
+        cpv = Cpv(enl,bands)
+        for i in range(k):
+            for ell,pv,_ in cpv.update(np.reshape(imgs[i][t0:t1],(-1,bands))):
+                if median:
+                    pv = ndimage.median_filter(np.reshape(pv,(t1-t0,cols)),size=(3,3)).ravel()
+                pvbits[ell,i-1,:] = np.packbits(pv[i0:i0+m] <= significance)
+        for ell in range(k-1):
+            pv = cpv.pvQ(ell)[i0:i0+m]
+            pvbits[ell,k-1,:] = np.packbits(pv <= significance)
+            if ell == 0:
+                pvQ[y0:y1] = np.reshape(pv,(y1-y0,cols))
+        cpv = None
+        cm,sm,fm,bm = change_maps(pvbits,m)
+        cmap[y0:y1] = np.reshape(cm,(y1-y0,cols))
+        smap[y0:y1] = np.reshape(sm,(y1-y0,cols))
+        fmap[y0:y1] = np.reshape(fm,(y1-y0,cols))
+#      Loewner directions and running means, reset where change occurred
+        avimg = np.reshape(avimgs[0][y0:y1],(m,bands)).copy()
+        r = np.ones((m,1))
+        for i in range(k-1):
+            img = np.reshape(imgs[i+1][y0:y1],(m,bands))
+            changed = bm[:,i] > 0
+            bm[changed,i] = loewner(img[changed]-avimg[changed])
+            r += 1
+            avimg += (img-avimg)/r
+            avimg[changed] = img[changed]
+            r[changed] = 1
+            avimgs[i+1][y0:y1] = np.reshape(avimg,(y1-y0,cols,bands))
+            avimglog[y0:y1][np.reshape(changed,(y1-y0,cols))] = k-i
+        bmap[y0:y1] = np.reshape(bm,(y1-y0,cols,k-1))
+    return {'cmap':cmap,'smap':smap,'fmap':fmap,'bmap':bmap,
+            'avimgs':avimgs,'avimglog':avimglog,'pvQ':pvQ}
+
+if __name__ == '__main__':
+    pass
@@ -12,7 +12,8 @@
 import numpy as np
 import sys, getopt, os
 from osgeo import gdal
-from osgeo.gdalconst import GA_ReadOnly,GDT_Float32
+from osgeo.gdalconst import GA_ReadOnly
+from auxil import gdalio
   
     
 def main(): 
@@ -67,48 +68,28 @@ Options:
     rows2 = inDataset2.RasterYSize   
     cols = min(cols,cols2) 
     rows = min(rows,rows2)
-    inDataset2 = None
-    if dims:
-        x0,y0,cols,rows = dims
-    else:
-        x0 = 0
-        y0 = 0    
-    g1 = np.zeros((cols*rows,bands))      
-    for k in range(bands):      
-        g1[:,k] = np.nan_to_num(inDataset1.GetRasterBand(k+1).ReadAsArray(x0,y0,cols,rows).astype(float).ravel())       
-    inDataset = gdal.Open(fn2,GA_ReadOnly)   
-    g2 = np.zeros((cols*rows,bands))   
-    for k in range(bands):      
-        g2[:,k] = np.nan_to_num(inDataset.GetRasterBand(k+1).ReadAsArray(x0,y0,cols,rows).astype(float).ravel())   
-    inDataset = gdal.Open(fn3,GA_ReadOnly)   
-    g3 = np.zeros((cols*rows,bands))   
-    for k in range(bands):      
-        g3[:,k] = np.nan_to_num(inDataset.GetRasterBand(1).ReadAsArray(x0,y0,cols,rows).astype(float).ravel())   
+    if not dims:
+        dims = [0,0,cols,rows]
+    x0,y0,cols,rows = dims
+    inDataset3 = gdal.Open(fn3,GA_ReadOnly)   
     if thresh == None:
-        thresh = np.max(g3)/4   
-    inDataset = None
-    
-    g1 = np.reshape(np.where(g3<thresh,g2,g1),(rows,cols,bands)) 
-    
-    driver = inDataset1.GetDriver() 
-    outDataset = driver.Create(outfn,cols,rows,3,GDT_Float32)
-    
-    geotransform = inDataset1.GetGeoTransform()
-    if geotransform is not None:
-        gt = list(geotransform)
-        gt[0] = gt[0] + x0*gt[1]
-        gt[3] = gt[3] + y0*gt[5]
-        outDataset.SetGeoTransform(tuple(gt))
-    projection = inDataset1.GetProjection()        
-    if projection is not None:
-        outDataset.SetProjection(projection) 
-    for k in range(bands):    
-        outBand = outDataset.GetRasterBand(k+1)
-        outBand.WriteArray(g1[:,:,k],0,0) 
-        outBand.FlushCache() 
+        thresh = 0
+        for window in gdalio.windows(inDataset3,dims):
+            thresh = max(thresh,np.max(gdalio.read(inDataset3,window,pos=[1])))
+        thresh = thresh/4   
+    outDataset = gdalio.create(outfn,cols,rows,bands,like=inDataset1,dims=dims)
+#  window by window, so that memory use does not grow with the image size    
+    for window in gdalio.windows(inDataset1,dims):
+        g1 = gdalio.read(inDataset1,window)
+        g2 = gdalio.read(inDataset2,window)
+        g3 = gdalio.read(inDataset3,window,pos=[1])
+        g1 = np.where(g3<thresh,g2,g1) 
+        gdalio.write(outDataset,np.reshape(g1.T,(bands,window[3],cols)),0,window[1]-y0)
     outDataset = None
     inDataset1 = None
+    inDataset2 = None
+    inDataset3 = None
     print('result written to: '+outfn) 
    
 if __name__ == '__main__':
-    main()    
\ No newline at end of file
+    main()    
\ No newline at end of file
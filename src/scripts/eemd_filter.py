@@ -30,15 +30,43 @@ def getimg(fn,b,dims):
         print( 'Error: %s  -- Could not read file'%e )
         sys.exit(1)    
                        
+def emd_chunk(arg4):
+#  filter the pixels i0 ... i1-1 of band ell of the decibel stack kept in 
+#  directory workdir and write the result into the filtered stack
+    import os
+    import numpy as np
+    from pyeemd import emd
+    
+    workdir,ell,i0,i1 = arg4
+    imarray = np.load(os.path.join(workdir,'db%i.npy'%ell),mmap_mode='r')
+    outarray = np.load(os.path.join(workdir,'emd%i.npy'%ell),mmap_mode='r+')
+    pixels = np.array(imarray[:,i0:i1].T)
+    for i in range(i1-i0):
+        imfs = emd(pixels[i,:], S_number=4, num_siftings=50)
+        pixels[i,:] = np.sum(imfs[2:,:],0)
+    outarray[:,i0:i1] = pixels.T
+    outarray.flush()
+    return (ell,i0,i1)
+                       
+def checkpoint(workdir,done):
+    '''save the finished chunks, replacing done.npy atomically so that 
+       an interrupted run never leaves a truncated file'''
+    import os
+    import numpy as np
+    tmpfn = os.path.join(workdir,'done.tmp.npy')
+    np.save(tmpfn,done)
+    os.replace(tmpfn,os.path.join(workdir,'done.npy'))
+
 def main():  
     import numpy as np
-    import os, sys, time, getopt
+    import os, sys, time, getopt, json, shutil
     from os import listdir
     from os.path import isfile, join
     from osgeo import gdal 
-    from osgeo.gdalconst import GA_ReadOnly, GDT_Float32
-    from tempfile import NamedTemporaryFile
-    from pyeemd import emd
+    from osgeo.gdalconst import GA_ReadOnly
+    from tempfile import mkdtemp
+    from auxil import gdalio
+    from auxil.parallel import pmap, backends
     
     usage = '''
 Usage:
@@ -46,12 +74,18 @@ Usage:
 
 EEMD speckle filter for polarimetric SAR images
 
-python %s [OPTIONS]  infiledir target 
+python %s [OPTIONS]  infiledir [target] 
 
 Options:
   
   -h           this help 
   -d  <list>   spatial subset
+  -a           write filtered images for all dates
+  -c  <str>    checkpoint directory, an interrupted run 
+               with the same directory resumes where it stopped
+  -n  <int>    pixels per work chunk (default 4096)
+  -j  <int>    number of workers (default number of cores)
+  --backend <str>  serial, pool or ipp (default pool)
 
 infiledir:
 
@@ -59,23 +93,37 @@ infiledir:
   
 target (<int>):
 
-  index of target file to filter 
-  
-enl (<float>):
-
-  equivalent number of looks
+  index of target file to filter (not needed with -a)
 
 -------------------------------------------------'''%sys.argv[0]
 
-    options,args = getopt.getopt(sys.argv[1:],'hd:')
+    options,args = getopt.getopt(sys.argv[1:],'hd:ac:n:j:',['backend='])
     dims = None
+    alldates = False
+    workdir = None
+    chunk = 4096
+    workers = None
+    backend = 'pool'
     for option, value in options: 
         if option == '-h':
             print( usage )
             return 
         elif option == '-d':
             dims = eval(value)            
-    if len(args)!=2:
+        elif option == '-a':
+            alldates = True
+        elif option == '-c':
+            workdir = value
+        elif option == '-n':
+            chunk = eval(value)
+        elif option == '-j':
+            workers = eval(value)
+        elif option == '--backend':
+            backend = value
+    if backend not in backends:
+        print('backend must be one of %s'%str(backends))
+        sys.exit(1)
+    if len(args)!=2 and not (alldates and len(args)==1):
         print('incorrect number of arguments')
         print( usage )
         sys.exit()
@@ -86,7 +134,10 @@ enl (<float>):
         if f.find('emd') == -1:
             fns.append(f)   
     k = len(fns)
-    target = eval(args[1]) 
+    if alldates:
+        targets = range(1,k+1)
+    else:
+        targets = [eval(args[1])]
     gdal.AllRegister()        
 #  first SAR image   
     try:            
@@ -121,52 +172,58 @@ enl (<float>):
     else:
         print( 'Intensity image' )
         pos = [0]
-#  output file
-    path = os.path.dirname(fns[0])    
-    basename = os.path.basename(fns[target-1])
-    print( 'Target image: %s'%basename )
-    root, ext = os.path.splitext(basename)
-    outfn = path + '/' + root + '_emd' + ext
-#  create temporary, memory-mapped array of images (1st band only, in decibels)
-    mm = NamedTemporaryFile()
-    imarray = np.memmap(mm.name,dtype=np.float64,mode='w+',shape=(rows*cols,k))  
-    outarr = np.zeros((len(pos),cols*rows))
     start = time.time()   
-    ell = 0
-    for p in pos:
-        print( 'filtering band: %i'%p )       
-        for j in range(k):
-            arr = getimg(fns[j],p,dims)
-            imarray[:,j] = 10*np.log10(arr)
-#      run the ceemdan algorithm        
-        for i in range(rows*cols):
-            imfs = emd(imarray[i,:], S_number=4, num_siftings=50)
-            imarray[i,:] = np.sum(imfs[2:,:],0)
-#  restore linear scale to filtered target        
-        outarr[ell,:] = 10**(imarray[:,target-1]/10.0)
-        ell += 1
-#  write to file system     
-    driver = inDataset1.GetDriver() 
-    outDataset = driver.Create(outfn,cols,rows,len(pos),GDT_Float32)
-    geotransform = inDataset1.GetGeoTransform()
-    if geotransform is not None:
-        gt = list(geotransform)
-        gt[0] = gt[0] + x0*gt[1]
-        gt[3] = gt[3] + y0*gt[5]
-    outDataset.SetGeoTransform(tuple(gt))
-    projection = inDataset1.GetProjection()        
-    if projection is not None:
-        outDataset.SetProjection(projection)  
-    ell = 0
-    for p in pos:
-        outBand = outDataset.GetRasterBand(ell+1)
-        outBand.WriteArray(np.reshape(outarr[ell,:],(rows,cols)),0,0) 
-        outBand.FlushCache()  
-        ell += 1
-    print('result written to: '+outfn) 
+#  working directory with the decibel stacks db<ell>.npy[k,rows*cols] of the 
+#  diagonal bands, their filtered versions emd<ell>.npy and the finished chunks 
+    cleanup = workdir is None
+    if cleanup:
+        workdir = mkdtemp()
+    state = {'fns':fns,'dims':list(dims),'pos':pos,'chunk':chunk}
+    statefn = join(workdir,'state.json')
+    if os.path.exists(statefn):
+        with open(statefn) as f:
+            saved = json.load(f)
+        if {key:saved[key] for key in state} != state:
+            print( 'Error: checkpoint %s belongs to a different run'%workdir )
+            sys.exit(1)
+        done = np.load(join(workdir,'done.npy'))
+        print( 'resuming from %s, %i of %i chunks done'%(workdir,np.sum(done),done.size) )
+    else:
+        os.makedirs(workdir,exist_ok=True)
+        for ell,p in enumerate(pos):
+            imarray = np.lib.format.open_memmap(join(workdir,'db%i.npy'%ell),mode='w+',dtype=np.float64,shape=(k,rows*cols))
+            for j in range(k):
+                imarray[j,:] = 10*np.log10(getimg(fns[j],p,dims))
+            imarray.flush()
+            np.lib.format.open_memmap(join(workdir,'emd%i.npy'%ell),mode='w+',dtype=np.float64,shape=(k,rows*cols)).flush()
+            imarray = None
+        done = np.zeros((len(pos),(rows*cols+chunk-1)//chunk),dtype=bool)
+        checkpoint(workdir,done)
+        with open(statefn+'.tmp','w') as f:
+            json.dump(state,f,indent=1)
+        os.replace(statefn+'.tmp',statefn)
+#  run the ceemdan algorithm over the unfinished pixel chunks       
+    work = [(workdir,ell,c*chunk,min((c+1)*chunk,rows*cols)) for ell,c in zip(*np.nonzero(~done))]
+    print( 'filtering %i chunks of %i pixels ...'%(len(work),chunk) )
+    for ell,i0,i1 in pmap(emd_chunk,work,backend,workers):
+        done[ell,i0//chunk] = True
+        checkpoint(workdir,done)
+#  restore linear scale to filtered targets and write to file system     
+    path = os.path.dirname(fns[0])    
+    for target in targets:
+        basename = os.path.basename(fns[target-1])
+        root, ext = os.path.splitext(basename)
+        outfn = path + '/' + root + '_emd' + ext
+        outDataset = gdalio.create(outfn,cols,rows,len(pos),like=inDataset1,dims=dims)
+        for ell in range(len(pos)):
+            outarray = np.load(join(workdir,'emd%i.npy'%ell),mmap_mode='r')
+            gdalio.write(outDataset,np.reshape(10**(outarray[target-1]/10.0),(rows,cols)),pos=[ell+1])
+        outDataset = None    
+        print('result written to: '+outfn) 
     print('elapsed time: '+str(time.time()-start))
-    outDataset = None    
     inDataset1 = None        
+    if cleanup:
+        shutil.rmtree(workdir)
     
 if __name__ == '__main__':
-    main()     
\ No newline at end of file
+    main()     
@@ -16,19 +16,6 @@ from ipyparallel import Client
 
 def gamma_filter(tpl): 
     k,inimage,rows,cols,m = tpl   
-    from scipy.ndimage import zoom   
-    def get_windex(j,cols):     
-        windex = np.zeros(49,dtype=int)
-        six = np.array([0,1,2,3,4,5,6])      
-        windex[0:7]   = (j-3)*cols + six
-        windex[7:14]  = (j-2)*cols + six
-        windex[14:21] = (j-1)*cols + six
-        windex[21:28] = (j)*cols   + six 
-        windex[28:35] = (j+1)*cols + six 
-        windex[35:42] = (j+2)*cols + six
-        windex[42:49] = (j+3)*cols + six
-        return windex  
-
     templates = np.zeros((8,7,7),dtype=int)
     for j in range(7):
         templates[0,j,0:3] = 1
@@ -45,9 +32,11 @@ def gamma_filter(tpl):
     templates[6] = np.rot90(templates[4])
     templates[7] = np.rot90(templates[5])
     
+#  template pixels as offsets from the window center in the flattened image    
     tmp = np.zeros((8,21),dtype=int)
     for i in range(8):
-        tmp[i,:] = np.where(templates[i].ravel())[0] 
+        r,c = np.where(templates[i])
+        tmp[i,:] = (r-3)*cols + c-3 
     templates = tmp
     
     edges = np.zeros((4,3,3),dtype=int)
@@ -56,49 +45,47 @@ def gamma_filter(tpl):
     edges[2] = [[1,1,1],[0,0,0],[-1,-1,-1]]
     edges[3] = [[1,1,0],[1,0,-1],[0,-1,-1]]        
     result = np.copy(inimage[k])
+    if cols < 7:
+#      no interior pixels
+        return result
     arr = inimage[k].ravel()
-    zf = 3./7
-    for j in range(3,rows-3):
-        windex = get_windex(j,cols)
-        for i in range(3,cols-3):
-            g = inimage[k,j,i]            
-            wind = np.reshape(arr[windex],(7,7))
-#          3x3 compression             
-            w = zoom(wind,zf,order=1,prefilter=False)              
-#          get appropriate edge mask
-            es = [np.sum(edges[p]*w) for p in range(4)]
-            idx = np.argmax(es)  
-            if idx == 0:
-                if np.abs(w[1,1]-w[1,0]) < np.abs(w[1,1]-w[1,2]):
-                    edge = templates[0]
-                else:
-                    edge = templates[4]
-            elif idx == 1:
-                if np.abs(w[1,1]-w[2,0]) < np.abs(w[1,1]-w[0,2]):
-                    edge = templates[1]
-                else:
-                    edge = templates[5]                
-            elif idx == 2:
-                if np.abs(w[1,1]-w[0,1]) < np.abs(w[1,1]-w[2,1]):
-                    edge = templates[6]
-                else:
-                    edge = templates[2]  
-            elif idx == 3:
-                if np.abs(w[1,1]-w[0,0]) < np.abs(w[1,1]-w[2,2]):
-                    edge = templates[7]
-                else:
-                    edge = templates[3] 
-            wind = wind.ravel()[edge] 
-            var = np.var(wind)
-            if var > 0: 
-                mu = np.mean(wind)  
-                alpha = (1 +1.0/m)/(var/mu**2 - 1/m)
-                if alpha < 0:
-                    alpha = np.abs(alpha)
-                a = mu*(alpha-m-1)
-                x = (a+np.sqrt(4*g*m*alpha*mu+a**2))/(2*alpha)        
-                result[j,i] = x
-            windex += 1  
+#  interior pixels in blocks of rows    
+    block = max(2**18//cols,1)
+    for j0 in range(3,rows-3,block):
+        j1 = min(j0+block,rows-3)
+#      3x3 compression of the 7x7 windows (linear zoom by 3/7 samples rows and columns 0, 3, 6)
+        w = [[inimage[k,j0-3+3*p:j1-3+3*p,3*q:cols-6+3*q] for q in range(3)] for p in range(3)]
+#      get appropriate edge mask
+        es = np.zeros((4,j1-j0,cols-6))
+        for e in range(4):
+            for p in range(3):
+                for q in range(3):
+                    if edges[e,p,q] != 0:
+                        es[e] += edges[e,p,q]*w[p][q]
+        idx = np.argmax(es,axis=0).ravel()
+        es = None
+        d = lambda p,q: np.abs(w[1][1]-w[p][q]).ravel()
+        edge = np.choose(idx,[np.where(d(1,0) < d(1,2),0,4),
+                              np.where(d(2,0) < d(0,2),1,5),
+                              np.where(d(0,1) < d(2,1),6,2),
+                              np.where(d(0,0) < d(2,2),7,3)])
+        center = (np.arange(j0,j1)[:,np.newaxis]*cols + np.arange(3,cols-3)).ravel()
+        mu = np.zeros(center.size)
+        var = np.zeros(center.size)
+        for e in range(8):
+            i = np.flatnonzero(edge == e)
+            wind = arr[center[i,np.newaxis] + templates[e]]
+            mu[i] = np.mean(wind,axis=1)
+            var[i] = np.var(wind,axis=1)
+        g = arr[center]
+        x = np.copy(g)
+        i = np.flatnonzero(var > 0)
+        mu = mu[i]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            alpha = np.abs((1 +1.0/m)/(var[i]/mu**2 - 1/m))
+            a = mu*(alpha-m-1)
+            x[i] = (a+np.sqrt(4*g[i]*m*alpha*mu+a**2))/(2*alpha)        
+        result[j0:j1,3:cols-3] = np.reshape(x,(j1-j0,cols-6))
                    
     return result          
 
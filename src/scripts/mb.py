@@ -13,8 +13,9 @@ import numpy as np
 import sys, getopt
 from osgeo import gdal
 from osgeo.gdalconst import GA_ReadOnly
+from auxil.parallel import backends
+from auxil.stats import raster_stats
   
-    
 def main(): 
     usage = '''
     Usage:
@@ -29,11 +30,17 @@ Options:
    -h          this help
    -p  <list>    band positions e.g. -p [1,2,3,4,5,7]
    -d <list>   spatial subset
+   -j <int>    number of workers (default number of cores)
+   --backend <str>  serial, pool or ipp (default pool)
+   
+The images are processed in row blocks, so memory use does not depend on their size.
 '''      
    
-    options, args = getopt.getopt(sys.argv[1:],'hd:p:') 
+    options, args = getopt.getopt(sys.argv[1:],'hd:p:j:',['backend=']) 
     dims = None 
     pos = None
+    workers = None
+    backend = 'pool'
     for option, value in options:
         if option == '-h':
             print(usage)
@@ -42,6 +49,13 @@ Options:
             dims = eval(value)   
         elif option == '-p':
             pos = eval(value)            
+        elif option == '-j':
+            workers = eval(value)
+        elif option == '--backend':
+            backend = value
+    if backend not in backends:
+        print('backend must be one of %s'%str(backends))
+        sys.exit(1)
     if len(args)==2:
         fn1 = args[0] 
         fn2 = args[1]  
@@ -64,20 +78,11 @@ Options:
         bands = len(pos)
     else:
         pos = range(1,bands+1)            
-    g1 = np.zeros((cols*rows,bands))    
-    k = 0  
-    for b in pos:      
-        g1[:,k] = np.nan_to_num(inDataset.GetRasterBand(b).ReadAsArray(x0,y0,cols,rows).astype(float).ravel())
- #       g1[:,k] = np.nan_to_num(inDataset.GetRasterBand(b).ReadAsArray(0,0,cols,rows).astype(float).ravel())
-        k += 1       
-    inDataset = gdal.Open(fn2,GA_ReadOnly)   
-    g2 = np.zeros((cols*rows,bands))  
-    k = 0 
-    for b in pos:      
-        g2[:,k] = np.nan_to_num(inDataset.GetRasterBand(b).ReadAsArray(x0,y0,cols,rows).astype(float).ravel()) 
-        k += 1 
+    dims = [x0,y0,cols,rows]
+    mean1 = raster_stats(fn1,dims,pos,backend=backend,workers=workers).means()
+    mean2 = raster_stats(fn2,dims,pos,backend=backend,workers=workers).means()
     for i in range(bands):
-        print('minus log mean bias for band %i: %f' %(i+1,-np.log(np.abs((np.mean(g2[:,i])-np.mean(g1[:,i]))/np.mean(g1[:,i])))))
+        print('minus log mean bias for band %i: %f' %(i+1,-np.log(np.abs((mean2[i]-mean1[i])/mean1[i]))))
     inDataset = None
    
 if __name__ == '__main__':
@@ -10,9 +10,9 @@
 #
 #  Copyright (c) 2018, Mort Canty
 
-import auxil.congrid as congrid
 import os, sys, time, getopt
 import numpy as np
+from scipy import ndimage
 from osgeo import gdal
 from osgeo.gdalconst import GA_ReadOnly, GDT_Float32
 
@@ -42,20 +42,52 @@ edges[0] = [[-1,0,1],[-1,0,1],[-1,0,1]]
 edges[1] = [[0,1,1],[-1,0,1],[-1,-1,0]]
 edges[2] = [[1,1,1],[0,0,0],[-1,-1,-1]]
 edges[3] = [[1,1,0],[1,0,-1],[0,-1,-1]]   
+
+#  3x3 spline compression of a 7x7 window w (congrid with centre=True) is A w A^T
+compress = np.array([ndimage.map_coordinates(np.eye(7)[r],[(np.arange(3)+0.5)*7/3.-0.5]) 
+                      for r in range(7)]).T
     
-   
-def get_windex(j,cols):
-#  first window for row j    
-    windex = np.zeros(49,dtype=int)
-    six = np.array([0,1,2,3,4,5,6])
-    windex[0:7]   = (j-3)*cols + six
-    windex[7:14]  = (j-2)*cols + six
-    windex[14:21] = (j-1)*cols + six
-    windex[21:28] = (j)*cols   + six 
-    windex[28:35] = (j+1)*cols + six 
-    windex[35:42] = (j+2)*cols + six
-    windex[42:49] = (j+3)*cols + six
-    return windex
+def get_edge_idx(span,j0,j1):
+    '''edge direction index and template offsets (flattened image) for 
+       the 7x7 windows centered on the interior pixels of rows j0 ... j1-1'''
+    rows,cols = span.shape
+#  compress along rows, then along columns    
+    c = [sum(compress[q,r]*span[j0-3:j1+3,r:cols-6+r] for r in range(7)) for q in range(3)]
+    w = [[sum(compress[p,r]*c[q][r:r+j1-j0] for r in range(7)) for q in range(3)] for p in range(3)]
+    c = None
+#  get appropriate edge mask
+    es = np.zeros((4,j1-j0,cols-6))
+    for e in range(4):
+        for p in range(3):
+            for q in range(3):
+                if edges[e,p,q] != 0:
+                    es[e] += edges[e,p,q]*w[p][q]
+    idx = np.argmax(es,axis=0).ravel()
+    es = None
+    d = lambda p,q: np.abs(w[1][1]-w[p][q]).ravel()
+    return np.choose(idx,[np.where(d(1,0) < d(1,2),0,4),
+                          np.where(d(2,0) < d(0,2),1,5),
+                          np.where(d(0,1) < d(2,1),6,2),
+                          np.where(d(0,0) < d(2,2),7,3)])
+
+def template_stats(img,edge_idx,j0,j1,var=False):
+    '''means (and variances) of images img[...,rows,cols] over the edge aligned
+       templates edge_idx of the interior pixels of rows j0 ... j1-1'''
+    rows,cols = img.shape[-2:]
+    arr = np.reshape(img,img.shape[:-2]+(rows*cols,))
+    center = (np.arange(j0,j1)[:,np.newaxis]*cols + np.arange(3,cols-3)).ravel()
+    gbar = np.zeros(arr.shape[:-1]+center.shape)
+    varg = np.zeros(arr.shape[:-1]+center.shape)
+    for e in range(8):
+        i = np.flatnonzero(edge_idx == e)
+        r,c = np.divmod(templates[e],7)
+        wind = arr[...,center[i,np.newaxis] + (r-3)*cols + c-3]
+        gbar[...,i] = np.mean(wind,axis=-1)
+        if var:
+            varg[...,i] = np.var(wind,axis=-1)
+    if var:
+        return (gbar,varg)
+    return gbar
 
 def mmse_filter(infile, m, dims=None):
     gdal.AllRegister()                  
@@ -70,74 +102,42 @@ def mmse_filter(infile, m, dims=None):
     basename = os.path.basename(infile)
     root, ext = os.path.splitext(basename)
     outfile = path + '/' + root + '_mmse' + ext  
-#  get filter weights from span image
-    b = np.ones((rows,cols))
-    band = inDataset.GetRasterBand(1)
-    span = band.ReadAsArray(x0,y0,cols,rows).ravel()
-    if bands==9:      
-        band = inDataset.GetRasterBand(6)
-        span += band.ReadAsArray(x0,y0,cols,rows).ravel()
-        band = inDataset.GetRasterBand(9)
-        span += band.ReadAsArray(x0,y0,cols,rows).ravel()
-    elif bands==4:
-        band = inDataset.GetRasterBand(4)
-        span += band.ReadAsArray(x0,y0,cols,rows).ravel()    
-    elif bands==2:
-        band = inDataset.GetRasterBand(2)
-        span += band.ReadAsArray(x0,y0,cols,rows).ravel()            
-    edge_idx = np.zeros((rows,cols),dtype=int)
     print ('=========================')
     print ('       MMSE_FILTER')
     print ('=========================')
     print (time.asctime())
     print ('infile:  %s'%infile)
     print ('number of looks: %f'%m)     
-    print ('Determining filter weights from span image')    
     start = time.time()
-    print( 'row: ',)
-    sys.stdout.flush()     
-    for j in range(3,rows-3):
-        if j%100 == 0:
-            print( '%i '%j,) 
-            sys.stdout.flush()
-        windex = get_windex(j,cols)
-        for i in range(3,cols-3):            
-            wind = np.reshape(span[windex],(7,7))         
-#          3x3 compression
-            w = congrid.congrid(wind,(3,3),method='spline',centre=True)
-#          get appropriate edge mask
-            es = [np.sum(edges[p]*w) for p in range(4)]
-            idx = np.argmax(es)  
-            if idx == 0:
-                if np.abs(w[1,1]-w[1,0]) < np.abs(w[1,1]-w[1,2]):
-                    edge_idx[j,i] = 0
-                else:
-                    edge_idx[j,i] = 4
-            elif idx == 1:
-                if np.abs(w[1,1]-w[2,0]) < np.abs(w[1,1]-w[0,2]):
-                    edge_idx[j,i] = 1
-                else:
-                    edge_idx[j,i] = 5                
-            elif idx == 2:
-                if np.abs(w[1,1]-w[0,1]) < np.abs(w[1,1]-w[2,1]):
-                    edge_idx[j,i] = 6
-                else:
-                    edge_idx[j,i] = 2  
-            elif idx == 3:
-                if np.abs(w[1,1]-w[0,0]) < np.abs(w[1,1]-w[2,2]):
-                    edge_idx[j,i] = 7
-                else:
-                    edge_idx[j,i] = 3 
-            edge = templates[edge_idx[j,i]]  
-            wind = wind.ravel()[edge]
-            gbar = np.mean(wind)
-            varg = np.var(wind)
-            if varg > 0:
-                b[j,i] = np.max( ((1.0 - gbar**2/(varg*m))/(1.0+1.0/m), 0.0) )        
-            windex += 1
-    print( ' done')        
-#  filter the image
-    outim = np.zeros((rows,cols),dtype=np.float32)
+    image = np.zeros((bands,rows,cols))
+    for k in range(bands):
+        band = inDataset.GetRasterBand(k+1)
+        image[k] = band.ReadAsArray(x0,y0,cols,rows)
+#  get filter weights from span image
+    if bands==9:      
+        span = image[0] + image[5] + image[8]
+    elif bands==4:
+        span = image[0] + image[3]
+    elif bands==2:
+        span = image[0] + image[1]
+    else:
+        span = np.copy(image[0])    
+    print ('Determining filter weights from span image')    
+    print('Filtering covariance matrix elements')  
+    outimage = np.copy(image)
+#  interior pixels in blocks of rows, the edge index is shared by all bands   
+    block = max(2**18//cols,1)
+    for j0 in range(3,rows-3,block):
+        j1 = min(j0+block,rows-3)
+        edge_idx = get_edge_idx(span,j0,j1)
+        gbar,varg = template_stats(span,edge_idx,j0,j1,var=True)
+        b = np.ones(gbar.shape)
+        i = np.flatnonzero(varg > 0)
+        b[i] = np.maximum( (1.0 - gbar[i]**2/(varg[i]*m))/(1.0+1.0/m), 0.0 )
+#      window means of all bands and adaptive filter      
+        gbar = template_stats(image,edge_idx,j0,j1)
+        band = np.reshape(image[:,j0:j1,3:cols-3],(bands,-1))
+        outimage[:,j0:j1,3:cols-3] = np.reshape(gbar + b*(band-gbar),(bands,j1-j0,cols-6))
     driver = inDataset.GetDriver()    
     outDataset = driver.Create(outfile,cols,rows,bands,GDT_Float32)
     geotransform = inDataset.GetGeoTransform()
@@ -149,25 +149,9 @@ def mmse_filter(infile, m, dims=None):
     projection = inDataset.GetProjection()        
     if projection is not None:
         outDataset.SetProjection(projection) 
-    print('Filtering covariance matrix elements')  
-    for k in range(1,bands+1):
-        print( 'band: %i'%(k))
-        band = inDataset.GetRasterBand(k)
-        band = band.ReadAsArray(0,0,cols,rows)
-        gbar = band*0.0
-#      get window means
-        for j in range(3,rows-3):        
-            windex = get_windex(j,cols)
-            for i in range(3,cols-3):
-                wind = band.ravel()[windex]
-                edge = templates[edge_idx[j,i]]
-                wind = wind[edge]
-                gbar[j,i] = np.mean(wind)
-                windex += 1
-#      apply adaptive filter and write to disk
-        outim = np.reshape(gbar + b*(band-gbar),(rows,cols))   
-        outBand = outDataset.GetRasterBand(k)
-        outBand.WriteArray(outim,0,0) 
+    for k in range(bands):
+        outBand = outDataset.GetRasterBand(k+1)
+        outBand.WriteArray(outimage[k],0,0) 
         outBand.FlushCache() 
     outDataset = None
     print( 'result written to: '+outfile) 
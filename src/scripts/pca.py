@@ -11,7 +11,10 @@ import numpy as np
 import os, sys, getopt, time
 from osgeo import gdal
 import matplotlib.pyplot as plt
-from osgeo.gdalconst import GA_ReadOnly,GDT_Float32
+from osgeo.gdalconst import GA_ReadOnly
+from auxil import gdalio
+from auxil.parallel import backends
+from auxil.stats import raster_stats
 
 def main(): 
     usage = '''            
@@ -29,12 +32,19 @@ Options:
                               e.g. -d [0,0,200,200]
   -r  <int>     number of components for reconstruction (default 0)
   -n            disable graphics   
+  -j  <int>     number of workers for the covariance pass (default number of cores)
+  --backend <str>  serial, pool or ipp (default pool)
+  
+  The image is read twice in row blocks, once to accumulate the covariance
+  matrix and once to project, so memory use does not depend on its size.
   
   -------------------------------------'''%sys.argv[0]            
                     
-    options,args = getopt.getopt(sys.argv[1:],'hr:nd:p:')
+    options,args = getopt.getopt(sys.argv[1:],'hr:nd:p:j:',['backend='])
     dims = None
     pos = None
+    workers = None
+    backend = 'pool'
     graphics = True
     recon = 0
     for option, value in options: 
@@ -49,6 +59,13 @@ Options:
             dims = eval(value)  
         elif option == '-p':
             pos = eval(value)
+        elif option == '-j':
+            workers = eval(value)
+        elif option == '--backend':
+            backend = value
+    if backend not in backends:
+        print('backend must be one of %s'%str(backends))
+        sys.exit(1)
     gdal.AllRegister()
     infile = args[0] 
     path = os.path.dirname(infile)
@@ -78,17 +95,14 @@ Options:
         bands = len(pos)
     else:
         pos = range(1,bands+1)        
-#  data matrix
-    G = np.zeros((rows*cols,bands)) 
-    k = 0                               
-    for b in pos:
-        band = inDataset.GetRasterBand(b)
-        tmp = band.ReadAsArray(x0,y0,cols,rows)\
-                              .astype(float).ravel()
-        G[:,k] = tmp - np.mean(tmp)
-        k += 1      
+    dims = [x0,y0,cols,rows]
+    windows = list(gdalio.windows(inDataset,dims))
+#  flat, so that the buffer of a shorter last window is contiguous too    
+    buf = np.empty(bands*max(w[3] for w in windows)*cols)
 #  covariance matrix
-    C = np.mat(G).T*np.mat(G)/(cols*rows-1)   
+    stats = raster_stats(infile,dims,pos,nan=False,backend=backend,workers=workers)
+    mn = stats.means()
+    C = stats.covariance()
 #  diagonalize    
     lams,U = np.linalg.eigh(C)     
 #  sort
@@ -103,44 +117,22 @@ Options:
         plt.xlabel('Spectral Band')
         plt.show()
         plt.close()                  
-#  project
-    pcs = np.array(G*U)
-    PCs = np.reshape(pcs,(rows,cols,bands)) 
-    if recon > 0:  
-        grs = np.array(pcs[:,:recon]*U[:,:recon].T)  
-        GRs = np.reshape(grs,(rows,cols,bands))
-#  write to disk       
-    driver = inDataset.GetDriver() 
-    outDataset = driver.Create(outfile,
-                cols,rows,bands,GDT_Float32)
-    projection = inDataset.GetProjection()
-    geotransform = inDataset.GetGeoTransform()
-    if geotransform is not None:
-        gt = list(geotransform)
-        gt[0] = gt[0] + x0*gt[1]
-        gt[3] = gt[3] + y0*gt[5]
-        outDataset.SetGeoTransform(tuple(gt))
-    if projection is not None:
-        outDataset.SetProjection(projection)        
-    for k in range(bands):        
-        outBand = outDataset.GetRasterBand(k+1)
-        outBand.WriteArray(PCs[:,:,k],0,0) 
-        outBand.FlushCache() 
+#  project and write to disk tile by tile
+    outDataset = gdalio.create(outfile,cols,rows,bands,like=inDataset,dims=dims)
+    if recon > 0:
+        outDataset1 = gdalio.create(outfile1,cols,rows,bands,like=inDataset,dims=dims)
+    for window in windows:
+        r = window[3]
+        G = gdalio.read(inDataset,window,pos,out=np.reshape(buf[:bands*r*cols],(bands,r,cols)),nan=False)
+        G -= mn
+        pcs = np.dot(G,U)
+        gdalio.write(outDataset,np.reshape(pcs.T,(bands,r,cols)),0,window[1]-y0)
+        if recon > 0:
+            grs = np.dot(pcs[:,:recon],U[:,:recon].T)
+            gdalio.write(outDataset1,np.reshape(grs.T,(bands,r,cols)),0,window[1]-y0)
     print('PCs written to: %s'%outfile)    
     if recon > 0:
-        outDataset = driver.Create(outfile1,
-                    cols,rows,bands,GDT_Float32)
-        if geotransform is not None:
-            gt = list(geotransform)
-            gt[0] = gt[0] + x0*gt[1]
-            gt[3] = gt[3] + y0*gt[5]
-            outDataset.SetGeoTransform(tuple(gt))
-        if projection is not None:
-            outDataset.SetProjection(projection)        
-        for k in range(bands):        
-            outBand = outDataset.GetRasterBand(k+1)
-            outBand.WriteArray(GRs[:,:,k],0,0) 
-            outBand.FlushCache() 
+        outDataset1 = None
         print('Reconstruction written to: %s'%outfile1)        
     outDataset = None    
     inDataset = None           
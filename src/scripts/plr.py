@@ -11,8 +11,63 @@ import os, time, sys, getopt
 import numpy as np
 from osgeo import gdal
 from osgeo.gdalconst import GA_ReadOnly, GDT_Byte
+from auxil import gdalio
+from auxil.parallel import pmap, backends
+
+def compatibility(inDataset):
+    '''estimate the compatibility matrix from the most probable labels of
+       each pixel and its lower and right hand neighbours'''
+    rows = inDataset.RasterYSize
+    classes = inDataset.RasterCount
+    counts = np.zeros(classes*classes,dtype=np.int64)
+    for x0,y,cols,r in gdalio.windows(inDataset):
+#      pairs for the rows of the window, the lower neighbours need one more row        
+        k = min(r,rows-1-y)
+        if k <= 0 or cols < 2:
+            continue
+        buf = np.empty((classes,k+1,cols),dtype=np.float32)
+        gdalio.read(inDataset,[0,y,cols,k+1],out=buf,nan=False)
+#      byte encoded probabilities, as in relax_tile        
+        buf /= 255.
+        labels = np.argmax(buf,axis=0)
+        m = labels[:k,:-1]*classes
+        counts += np.bincount((m+labels[1:,:-1]).ravel(),minlength=classes*classes)
+        counts += np.bincount((m+labels[:k,1:]).ravel(),minlength=classes*classes)
+    Pmn = np.reshape(counts,(classes,classes)).astype(np.float64)
+    n = np.sum(Pmn,axis=1)
+    Pmn[n>0,:] /= n[n>0,np.newaxis]
+    return Pmn
+
+def relax(prob_image,Pmn):
+    '''one relaxation step, in place, of the interior pixels of prob_image[classes,rows,cols]'''
+    if min(prob_image.shape[1:]) < 3:
+        return
+    Pm = prob_image[:,1:-1,1:-1]
+#  average of the 4-neighbourhood    
+    Pn = (prob_image[:,:-2,1:-1] + prob_image[:,2:,1:-1] + prob_image[:,1:-1,:-2] + prob_image[:,1:-1,2:])/4
+    Q = np.tensordot(Pmn,Pn,axes=(1,0))
+    den = np.sum(Pm*Q,axis=0)
+    nz = den != 0
+    Q[:,nz] /= den[nz]
+    Q[:,~nz] = 1.0
+    Pm *= Q
+
+def relax_tile(arg4):
+    '''class image of a row window after nitr relaxation steps, computed
+       on the window extended by a halo of nitr rows'''
+    infile,window,Pmn,nitr = arg4
+    inDataset = gdal.Open(infile,GA_ReadOnly)
+    x0,y,cols,r = window
+    ya = max(y-nitr,0)
+    yb = min(y+r+nitr,inDataset.RasterYSize)
+    prob_image = np.empty((inDataset.RasterCount,yb-ya,cols))
+    gdalio.read(inDataset,[0,ya,cols,yb-ya],out=prob_image,nan=False)
+    prob_image /= 255.
+    for itr in range(nitr):
+        relax(prob_image,Pmn)
+    return np.asarray(np.argmax(prob_image[:,y-ya:y-ya+r,:],axis=0)+1,np.uint8)
     
-def plr(infile,nitr=3):    
+def plr(infile,nitr=3,backend='pool',workers=None):    
     path = os.path.dirname(infile)
     basename = os.path.basename(infile)
     root, ext = os.path.splitext(basename)
@@ -21,70 +76,20 @@ def plr(infile,nitr=3):
     inDataset = gdal.Open(infile,GA_ReadOnly)     
     cols = inDataset.RasterXSize
     rows = inDataset.RasterYSize    
-    classes = inDataset.RasterCount
     print('=====================')
     print('       PLR')
     print('=====================')
     print('infile:  %s'%infile)
     print('iterations:  %i'%nitr)
     start = time.time()                                   
-    prob_image = np.zeros((classes,rows,cols))
-    for k in range (classes):
-        band = inDataset.GetRasterBand(k+1)
-        prob_image[k,:,:] = np.array(band.ReadAsArray(0,0,cols,rows),dtype=np.float64)/255.
-#  compatibility matrix
-    Pmn = np.zeros((classes,classes))
-    n_samples = (cols-1)*(rows-1)
-    samplem = np.reshape(prob_image[:,0:rows-1,0:cols-1],(classes,n_samples))
-    samplen = np.reshape(prob_image[:,1:rows,0:cols-1],(classes,n_samples))
-    sampleu = np.reshape(prob_image[:,0:rows-1,1:cols],(classes,n_samples))
     print('estimating compatibility matrix...')
-    for j in range(n_samples):     
-        m1 = np.argmax(samplem[:,j])
-        n1 = np.argmax(samplen[:,j])
-        u1 = np.argmax(sampleu[:,j])
-        Pmn[m1,n1] += 1  
-        Pmn[m1,u1] += 1  
-    for j in range(classes):
-        n = np.sum(Pmn[j,:])
-        if n>0:
-            Pmn[j,:] /= n   
-    itr = 0
-    temp = prob_image*0
+    Pmn = compatibility(inDataset)
     print('label relaxation...')
-    while itr<nitr:
-        print('iteration %i'%(itr+1))
-        Pm = np.zeros(classes)
-        Pn = np.zeros(classes)
-        for i in range(1,rows-1):
-            for j in range(1,cols-1):
-                Pm[:] = prob_image[:,i,j]
-                Pn[:] = prob_image[:,i-1,j]/4
-                Pn[:] += prob_image[:,i+1,j]/4
-                Pn[:] += prob_image[:,i,j-1]/4
-                Pn[:] += prob_image[:,i,j+1]/4
-                Pn = np.transpose(Pn)
-                den = (np.dot(np.dot(Pm,Pmn),Pn))
-                if den == 0:
-                    Pm_new = Pm
-                else:
-                    Pm_new = Pm*(np.dot(Pmn,Pn))/den
-                temp[:,i,j] = Pm_new
-        prob_image = temp
-        itr += 1     
-    class_image = np.argmax(prob_image,axis=0)+1   
-#  write to disk
-    driver = gdal.GetDriverByName('GTiff')    
-    outDataset = driver.Create(outfile,cols,rows,1,GDT_Byte)
-    projection = inDataset.GetProjection()
-    geotransform = inDataset.GetGeoTransform()
-    if geotransform is not None:
-        outDataset.SetGeoTransform(geotransform)
-    if projection is not None:
-        outDataset.SetProjection(projection)               
-    outBand = outDataset.GetRasterBand(1)
-    outBand.WriteArray(class_image,0,0) 
-    outBand.FlushCache() 
+    outDataset = gdalio.create(outfile,cols,rows,1,like=inDataset,dtype=GDT_Byte,driver='GTiff')
+    windows = list(gdalio.windows(inDataset))
+    args = [(infile,window,Pmn,nitr) for window in windows]
+    for window,class_image in zip(windows,pmap(relax_tile,args,backend,workers)):
+        gdalio.write(outDataset,class_image,0,window[1])
     outDataset = None
     inDataset = None
     print('result written to: '+outfile)    
@@ -106,18 +111,29 @@ Options:
   
   -h         this help  
   -i  <int>  number of iterations (default 3)
+  -j  <int>  number of workers (default number of cores)
+  --backend <str>  serial, pool or ipp (default pool)
 
 -------------------------------------------------'''%sys.argv[0]                  
-    options,args = getopt.getopt(sys.argv[1:],'hi:')
+    options,args = getopt.getopt(sys.argv[1:],'hi:j:',['backend='])
     iterations = 3
+    workers = None
+    backend = 'pool'
     for option, value in options: 
         if option == '-h':
             print(usage)
             return 
         elif option == '-i':
             iterations = eval(value)  
+        elif option == '-j':
+            workers = eval(value)
+        elif option == '--backend':
+            backend = value
+    if backend not in backends:
+        print('backend must be one of %s'%str(backends))
+        sys.exit(1)
     infile = args[0] 
-    plr(infile,iterations)
+    plr(infile,iterations,backend,workers)
               
 if __name__ == '__main__':
     main()    
\ No newline at end of file
@@ -12,7 +12,18 @@
 import numpy as np
 import sys, os, getopt
 from osgeo import gdal
-from osgeo.gdalconst import GA_ReadOnly, GDT_Float32
+from osgeo.gdalconst import GA_ReadOnly
+from auxil import gdalio
+from auxil.parallel import pmap, backends
+  
+def ratio_tile(arg4):
+    '''return the ratio image[bands,rows,cols] of window of the two files'''
+    fn1,fn2,window,pos = arg4
+    g1 = gdalio.read(gdal.Open(fn1,GA_ReadOnly),window,pos,dtype=np.float32)
+    g2 = gdalio.read(gdal.Open(fn2,GA_ReadOnly),window,pos,dtype=np.float32)
+    g2[g2==0] = 0.0001
+    g1 /= g2
+    return np.reshape(g1.T,(len(pos),window[3],window[2]))
   
 def main(): 
     usage = '''
@@ -28,11 +39,17 @@ Options:
    -h          this help
    -p  <list>  band positions e.g. -p [1,2,3,4,5,7]
    -d <list>   spatial subset
+   -j <int>    number of workers (default number of cores)
+   --backend <str>  serial, pool or ipp (default pool)
+   
+The images are processed in row blocks, so memory use does not depend on their size.
 '''      
    
-    options, args = getopt.getopt(sys.argv[1:],'hd:p:') 
+    options, args = getopt.getopt(sys.argv[1:],'hd:p:j:',['backend=']) 
     dims = None 
     pos = None
+    workers = None
+    backend = 'pool'
     for option, value in options:
         if option == '-h':
             print(usage)
@@ -41,6 +58,13 @@ Options:
             dims = eval(value)   
         elif option == '-p':
             pos = eval(value)    
+        elif option == '-j':
+            workers = eval(value)
+        elif option == '--backend':
+            backend = value
+    if backend not in backends:
+        print('backend must be one of %s'%str(backends))
+        sys.exit(1)
     if len(args)==2:
         fn1 = args[0] 
         fn2 = args[1]  
@@ -70,38 +94,12 @@ Options:
         bands = len(pos)
     else:
         pos = range(1,bands+1)            
-    g1 = np.zeros((cols*rows,bands))    
-    k = 0  
-    for b in pos:      
-        g1[:,k] = np.nan_to_num(inDataset.GetRasterBand(b).ReadAsArray(x0,y0,cols,rows).ravel())
-        k += 1       
-    inDataset = gdal.Open(fn2,GA_ReadOnly)   
-    g2 = np.zeros((cols*rows,bands))  
-    k = 0 
-    for b in pos:      
-        g2[:,k] = np.nan_to_num(inDataset.GetRasterBand(b).ReadAsArray(x0,y0,cols,rows).ravel()) 
- #       g2[:,k] = np.nan_to_num(inDataset.GetRasterBand(b).ReadAsArray(0,0,cols,rows).ravel()) 
-        k += 1  
-    
-    g2 = np.where(g2==0,0.0001,g2)
-    ratio = g1/g2
-
-
-    driver = inDataset.GetDriver()   
-    outDataset = driver.Create(outfile,cols,rows,bands,GDT_Float32)
-    projection = inDataset.GetProjection()
-    geotransform = inDataset.GetGeoTransform()
-    if geotransform is not None:
-        gt = list(geotransform)
-        gt[0] = gt[0] + x0*gt[1]
-        gt[3] = gt[3] + y0*gt[5]
-        outDataset.SetGeoTransform(tuple(gt))
-    if projection is not None:
-        outDataset.SetProjection(projection)   
-    for k in range(bands):       
-        outBand = outDataset.GetRasterBand(k+1)
-        outBand.WriteArray(np.reshape(ratio[:,k],(rows,cols)),0,0) 
-        outBand.FlushCache() 
+    dims = [x0,y0,cols,rows]
+    outDataset = gdalio.create(outfile,cols,rows,bands,like=inDataset,dims=dims)
+    windows = list(gdalio.windows(inDataset,dims))
+    args1 = [(fn1,fn2,window,list(pos)) for window in windows]
+    for window,ratio in zip(windows,pmap(ratio_tile,args1,backend,workers)):
+        gdalio.write(outDataset,ratio,0,window[1]-y0)
     outDataset = None  
     print( 'Ratio image written to: %s'%outfile )     
     
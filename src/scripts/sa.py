@@ -12,7 +12,20 @@
 import numpy as np
 import sys, os, getopt
 from osgeo import gdal
-from osgeo.gdalconst import GA_ReadOnly, GDT_Float32
+from osgeo.gdalconst import GA_ReadOnly
+from auxil import gdalio
+from auxil.parallel import pmap, backends
+  
+def angle_tile(arg3):
+    '''return the spectral angle image[rows,cols] in degrees of window of the two files'''
+    fn1,fn2,window,pos = arg3
+    g1 = gdalio.read(gdal.Open(fn1,GA_ReadOnly),window,pos)
+    g2 = gdalio.read(gdal.Open(fn2,GA_ReadOnly),window,pos)
+    numer = np.einsum('ij,ij->i',g1,g2)
+    den = np.sqrt(np.einsum('ij,ij->i',g1,g1)*np.einsum('ij,ij->i',g2,g2))
+    costheta = np.where(den>10e-9,numer/np.where(den>10e-9,den,1.0),1.0)
+    theta = np.where(costheta<1,np.arccos(np.clip(costheta,-1,1)),0.0)
+    return np.reshape(np.rad2deg(theta),(window[3],window[2]))
   
 def main(): 
     usage = '''
@@ -29,12 +42,18 @@ Options:
    -p  <list>  band positions e.g. -p [1,2,3,4,5,7]
    -d <list>   spatial subset
    -w          write an angle image    
+   -j <int>    number of workers (default number of cores)
+   --backend <str>  serial, pool or ipp (default pool)
+   
+The images are processed in row blocks, so memory use does not depend on their size.
 '''      
    
-    options, args = getopt.getopt(sys.argv[1:],'hd:p:w') 
+    options, args = getopt.getopt(sys.argv[1:],'hd:p:wj:',['backend=']) 
     dims = None 
     pos = None
     wrt = False
+    workers = None
+    backend = 'pool'
     for option, value in options:
         if option == '-h':
             print(usage)
@@ -45,6 +64,13 @@ Options:
             pos = eval(value)    
         elif option == '-w':
             wrt = True            
+        elif option == '-j':
+            workers = eval(value)
+        elif option == '--backend':
+            backend = value
+    if backend not in backends:
+        print('backend must be one of %s'%str(backends))
+        sys.exit(1)
     if len(args)==2:
         fn1 = args[0] 
         fn2 = args[1]  
@@ -73,43 +99,19 @@ Options:
         bands = len(pos)
     else:
         pos = range(1,bands+1)            
-    g1 = np.zeros((cols*rows,bands))    
-    k = 0  
-    for b in pos:      
-        g1[:,k] = np.nan_to_num(inDataset.GetRasterBand(b).ReadAsArray(x0,y0,cols,rows).ravel())
- #       g1[:,k] = np.nan_to_num(inDataset.GetRasterBand(b).ReadAsArray(0,0,cols,rows).ravel())
-        k += 1       
-    inDataset = gdal.Open(fn2,GA_ReadOnly)   
-    g2 = np.zeros((cols*rows,bands))  
-    k = 0 
-    for b in pos:      
-        g2[:,k] = np.nan_to_num(inDataset.GetRasterBand(b).ReadAsArray(x0,y0,cols,rows).ravel()) 
-        k += 1  
-    
-    numer = 0
-    for k in range(bands):
-        numer += g1[:,k]*g2[:,k]
-    den = np.sqrt(np.sum(g1**2,1)*np.sum(g2**2,1)) 
-    costheta = np.where(den>10e-9,numer/den,1.0)
-    theta = np.where(costheta<1,np.arccos(costheta),0.0)
-    theta = np.rad2deg(theta)
-    print( 'mean spectral angle difference: %f degrees'%np.mean(theta))
+    dims = [x0,y0,cols,rows]
+    if wrt: 
+        outDataset = gdalio.create(outfile,cols,rows,1,like=inDataset,dims=dims)
+    windows = list(gdalio.windows(inDataset,dims))
+    args1 = [(fn1,fn2,window,list(pos)) for window in windows]
+    total = 0.0
+    for window,theta in zip(windows,pmap(angle_tile,args1,backend,workers)):
+        total += np.sum(theta)
+        if wrt:
+            gdalio.write(outDataset,theta,0,window[1]-y0)
+    print( 'mean spectral angle difference: %f degrees'%(total/(rows*cols)))
     
     if wrt: 
-        driver = inDataset.GetDriver()   
-        outDataset = driver.Create(outfile,cols,rows,1,GDT_Float32)
-        projection = inDataset.GetProjection()
-        geotransform = inDataset.GetGeoTransform()
-        if geotransform is not None:
-            gt = list(geotransform)
-            gt[0] = gt[0] + x0*gt[1]
-            gt[3] = gt[3] + y0*gt[5]
-            outDataset.SetGeoTransform(tuple(gt))
-        if projection is not None:
-            outDataset.SetProjection(projection)          
-        outBand = outDataset.GetRasterBand(1)
-        outBand.WriteArray(np.reshape(theta,(rows,cols)),0,0) 
-        outBand.FlushCache() 
         outDataset = None  
         print( 'Theta image written to: %s'%outfile )     
     
@@ -14,306 +14,217 @@
 # 
 # Copyright (c) 2018 Mort Canty
 
-def call_register(arg3):
-    from auxil.registersar import register
-    fn0,fni,dims = arg3
-    return register(fn0,fni,dims)
-
 def call_median_filter(pv):
     from scipy import ndimage
     return ndimage.filters.median_filter(pv, size = (3,3))
 
-def getimg(fn):
+def getimg(fn,dims=None):
 #  read 9- 4- 3- 2- or 1-band preprocessed polarimetric matrix file 
+#  or a spatial subset dims = [x0,y0,cols,rows] of it
     from osgeo.gdalconst import GA_ReadOnly
     from osgeo import gdal
-    import numpy as np
+    from auxil import gdalio
     import sys
     gdal.AllRegister()
     try:            
         inDataset = gdal.Open(fn,GA_ReadOnly)                             
-        cols = inDataset.RasterXSize
-        rows = inDataset.RasterYSize    
-        bands = inDataset.RasterCount
-        result = np.zeros((rows*cols,bands))
-        for k in range(bands):
-            result[:,k] = inDataset.GetRasterBand(k+1).ReadAsArray(0,0,cols,rows).ravel()
+        result = gdalio.read(inDataset,dims)
         inDataset = None    
-        return np.nan_to_num(result)  
+        return result  
     except Exception as e:
         print( 'Error: %s  -- Could not read file'%e )
         sys.exit(1)    
         
-def det(img):            
-    '''return determinant of 1, 2, 3, 4, or 9-band polarimetric image '''
-    bands = img.shape[1]
-    if bands==1:
-        return img
-    elif bands==2:
-        return img[:,0]*img[:,1]
-    elif bands==3:
-        return img[:,0]*img[:,1]*img[:,2]
-    elif bands==4:
-        return img[:,0]*img[:,3] - img[:,1]**2 - img[:,2]**2
+def seq_tile(arg10):
+    '''Return change maps (cmap,smap,fmap,bmap) for the row block y0 ... y1-1,
+       and the ATSF image if atsf is set'''
+    import numpy as np
+    from auxil.wishart import Cpv, change_maps
+    from auxil.polmat import loewner
+    fns,n,bands,cols,rows,y0,y1,significance,medianfilter,atsf = arg10
+    k = len(fns)
+    m = (y1-y0)*cols
+#  the median filter needs one row of context above and below the block    
+    if medianfilter:
+        t0 = max(y0-1,0)
+        t1 = min(y1+1,rows)
     else:
-        return img[:,0]*img[:,5]*img[:,8] + \
-               2*(img[:,1]*img[:,6]*img[:,3] + img[:,2]*img[:,7]*img[:,3] + img[:,2]*img[:,6]*img[:,4] + img[:,1]*img[:,7]*img[:,4]) - \
-               img[:,5]*(img[:,3]**2 + img[:,4]**2) - \
-               img[:,0]*(img[:,6]**2 + img[:,7]**2) - \
-               img[:,5]*(img[:,1]**2 + img[:,2]**2) 
-        
-def loewner(img):  
-    ''' return Loewner direction image: 1 positive definite
-                                        2 negative definite
-                                        3 neither ''' 
+        t0 = y0
+        t1 = y1
+    i0 = (y0-t0)*cols    
+#  only the significance of each test is needed, keep it as packed bits     
+    pvbits = np.zeros((k,k,(m+7)//8),dtype=np.uint8)
+#  the block of each scene is kept for the Loewner pass, so every file is read once 
+    stack = np.empty((k,m,bands),dtype=np.float32)
+    cpv = Cpv(n,bands)
+    for i in range(k):
+        img = getimg(fns[i],[0,t0,cols,t1-t0])
+        stack[i] = img[i0:i0+m]
+        for ell,pv,_ in cpv.update(img):
+            if medianfilter:
+                pv = call_median_filter(np.reshape(pv,(t1-t0,cols))).ravel()
+            pvbits[ell,i-1,:] = np.packbits(pv[i0:i0+m] <= significance)
+    img = None
+    for ell in range(k-1):
+        pvbits[ell,k-1,:] = np.packbits(cpv.pvQ(ell)[i0:i0+m] <= significance)
+    cpv = None    
+    cmap,smap,fmap,bmap = change_maps(pvbits,m)   
+#  post process bmap for Loewner direction, avimg is the running mean 
+#  since the last change (ATSF)  
+    avimg = stack[0].copy()
+    r = np.ones((m,1),dtype=np.float32)
+    diff = np.empty_like(avimg)
+    for i in range(k-1):
+        img = stack[i+1]
+        np.subtract(img,avimg,out=diff)
+        changed = bmap[:,i] > 0
+        bmap[changed,i] = loewner(diff[changed])
+        r += 1
+        diff /= r
+        avimg += diff
+#      reset avimg where change occurred
+        avimg[changed] = img[changed]
+        r[changed] = 1
+    result = ( np.reshape(cmap,(y1-y0,cols)),
+               np.reshape(smap,(y1-y0,cols)),
+               np.reshape(fmap,(y1-y0,cols)),
+               np.reshape(bmap,(y1-y0,cols,k-1)) )
+    if atsf:
+        result += (np.reshape(avimg,(y1-y0,cols,bands)),)
+    return result
+                       
+def state_rows(path,name,ell,i0,i1):
+    '''pixels i0 ... i1-1 of the state array name%ell in directory path'''
     import numpy as np
-    bands = img.shape[1]  
-    dir3 = np.zeros(img.shape[0]) + 3
-    dir2 = np.zeros(img.shape[0]) + 2
-    dir1 = np.zeros(img.shape[0]) + 1
-    if bands <= 3:
-        dmy = np.where(np.min(img,1)>0,dir1,dir3)
-        result = np.where(np.max(img,1)<0,dir2,dmy)
-    elif bands == 4:
-        result = np.where( (img[:,0]>0) & (det(img)>0),dir1,dir3 )
-        result = np.where( (img[:,0]<0) & (det(img)<0) ,dir2,result )
-    elif bands == 9:
-        result = np.where( (img[:,0]>0) & (det(img[:,[0,1,2,5]])>0) & (det(img)>0),dir1,dir3 )
-        result = np.where( (img[:,0]<0) & (det(img[:,[0,1,2,5]])<0) & (det(img)<0),dir2,result )    
-    return result    
-         
-def PV(arg5):
-    '''Return p-values for change indices R^ell_j'''        
+    import os
+    return np.array(np.load(os.path.join(path,'%s%i.npy'%(name,ell)),mmap_mode='r')[i0:i1])
+
+def append_tile(arg5):
+    '''Ingest the row block y0 ... y1-1 of image fn into the state of k images 
+       in directory statedir/k and write the block of the new state to statedir/k+1. 
+       For each interval start ell the state holds, besides the running sums of 
+       Cpv, the first image with significant R^ell_j and the Loewner direction 
+       of that image relative to the mean since ell'''
     import numpy as np
-    import sys
-    from scipy import stats   
-    from osgeo.gdalconst import GA_ReadOnly 
-    from osgeo import gdal
-    
-    def getmat(fn,cols,rows,bands):
-    #  read 9- 4- 3- 2- or 1-band preprocessed polarimetric matrix file 
-    #  and return (complex) matrix elements      
-        try:
-            inDataset1 = gdal.Open(fn,GA_ReadOnly)     
-            if bands == 9:
-        #      T11 (k1)
-                b = inDataset1.GetRasterBand(1)
-                k1 = b.ReadAsArray(0,0,cols,rows)
-        #      T12  (a1)
-                b = inDataset1.GetRasterBand(2)
-                a1 = b.ReadAsArray(0,0,cols,rows)
-                b = inDataset1.GetRasterBand(3)    
-                im = b.ReadAsArray(0,0,cols,rows)
-                a1 = (a1 + 1j*im)
-        #      T13  (rho1)
-                b = inDataset1.GetRasterBand(4)
-                rho1 = b.ReadAsArray(0,0,cols,rows)
-                b = inDataset1.GetRasterBand(5)
-                im = b.ReadAsArray(0,0,cols,rows)
-                rho1 = (rho1 + 1j*im)      
-        #      T22 (xsi1)
-                b = inDataset1.GetRasterBand(6)
-                xsi1 = b.ReadAsArray(0,0,cols,rows)    
-        #      T23 (b1)        
-                b = inDataset1.GetRasterBand(7)
-                b1 = b.ReadAsArray(0,0,cols,rows)
-                b = inDataset1.GetRasterBand(8)
-                im = b.ReadAsArray(0,0,cols,rows)
-                b1 = (b1 + 1j*im)      
-        #      T33 (zeta1)
-                b = inDataset1.GetRasterBand(9)
-                zeta1 = b.ReadAsArray(0,0,cols,rows) 
-                result = (k1,a1,rho1,xsi1,b1,zeta1)             
-            elif bands == 4:
-        #      C11 (k1)
-                b = inDataset1.GetRasterBand(1)
-                k1 = b.ReadAsArray(0,0,cols,rows)
-        #      C12  (a1)
-                b = inDataset1.GetRasterBand(2)
-                a1 = b.ReadAsArray(0,0,cols,rows)
-                b = inDataset1.GetRasterBand(3)
-                im = b.ReadAsArray(0,0,cols,rows)
-                a1 = (a1 + 1j*im)        
-        #      C22 (xsi1)
-                b = inDataset1.GetRasterBand(4)
-                xsi1 = b.ReadAsArray(0,0,cols,rows)   
-                result = (k1,a1,xsi1)
-            elif bands == 3:
-        #      T11 (k1)
-                b = inDataset1.GetRasterBand(1)
-                k1 = b.ReadAsArray(0,0,cols,rows)
-        #      T22 (xsi1)
-                b = inDataset1.GetRasterBand(2)
-                xsi1 = b.ReadAsArray(0,0,cols,rows)    
-        #      T33 (zeta1)
-                b = inDataset1.GetRasterBand(3)
-                zeta1 = b.ReadAsArray(0,0,cols,rows) 
-                result = (k1,xsi1,zeta1)          
-            elif bands == 2:
-        #      C11 (k1)
-                b = inDataset1.GetRasterBand(1)
-                k1 = b.ReadAsArray(0,0,cols,rows)    
-        #      C22 (xsi1)
-                b = inDataset1.GetRasterBand(2)
-                xsi1 = b.ReadAsArray(0,0,cols,rows)  
-                result = (k1,xsi1)         
-            elif bands == 1:        
-        #      C11 (k1)
-                b = inDataset1.GetRasterBand(1)
-                k1 = b.ReadAsArray(0,0,cols,rows) 
-                result = (k1,)
-            inDataset1 = None
-            return result
-        except Exception as e:
-            print( 'Error: %s  -- Could not read file'%e )
-            sys.exit(1)   
-            
-    fns,n,cols,rows,bands = arg5
-              
-    j = np.float64(len(fns))
-    eps = sys.float_info.min
-    k = 0.0; a = 0.0; rho = 0.0; xsi = 0.0; b = 0.0; zeta = 0.0
-    for fn in fns:
-        result = getmat(fn,cols,rows,bands)
-        if bands==9:
-            k1,a1,rho1,xsi1,b1,zeta1 = result
-            k1 = n*np.float64(k1)
-            a1 = n*np.complex128(a1)
-            rho1 = n*np.complex128(rho1)
-            xsi1 = n*np.float64(xsi1)
-            b1 = n*np.complex128(b1)
-            zeta1 = n*np.float64(zeta1)
-            k += k1; a += a1; rho += rho1; xsi += xsi1; b += b1; zeta += zeta1  
-        elif bands==4:
-            k1,a1,xsi1 = result
-            k1 = n*np.float64(k1)
-            a1 = n*np.complex128(a1)
-            xsi1 = n*np.float64(xsi1)
-            k += k1; a += a1; xsi += xsi1
-        elif bands==3:
-            k1,xsi1,zeta1 = result
-            k1 = n*np.float64(k1)
-            xsi1 = n*np.float64(xsi1)
-            zeta1 = n*np.float64(zeta1)
-            k += k1; xsi += xsi1; zeta += zeta1  
-        elif bands==2:
-            k1,xsi1 = result
-            k1 = n*np.float64(k1)
-            xsi1 = n*np.float64(xsi1)
-            k += k1; xsi += xsi1
-        elif bands==1:
-            k1 = n*np.float64(result[0])
-            k += k1              
-    if bands==9: 
-        p = 3
-        detsumj = k*xsi*zeta + 2*np.real(a*b*np.conj(rho)) - xsi*(abs(rho)**2) - k*(abs(b)**2) - zeta*(abs(a)**2) 
-        k -= k1; a -= a1; rho -= rho1; xsi -= xsi1; b -= b1; zeta -= zeta1 
-        detsumj1 = k*xsi*zeta + 2*np.real(a*b*np.conj(rho)) - xsi*(abs(rho)**2) - k*(abs(b)**2) - zeta*(abs(a)**2)
-        detj = k1*xsi1*zeta1 + 2*np.real(a1*b1*np.conj(rho1)) - xsi1*(abs(rho1)**2) - k1*(abs(b1)**2) - zeta1*(abs(a1)**2)
-    elif bands==4:
-        p = 2
-        detsumj = k*xsi - abs(a)**2 
-        k -= k1; a -= a1; xsi -= xsi1
-        detsumj1 = k*xsi - abs(a)**2
-        detj = k1*xsi1 - abs(a1)**2
-    elif bands==3:
-        p = 3
-        detsumj = k*xsi*zeta 
-        k -= k1; xsi -= xsi1;  zeta -= zeta1 
-        detsumj1 = k*xsi*zeta 
-        detj = k1*xsi1*zeta1
-    elif bands==2:
-        p = 2
-        detsumj = k*xsi
-        k -= k1; xsi -= xsi1
-        detsumj1 = k*xsi
-        detj = k1*xsi1
-    elif bands==1:
-        p = 1
-        detsumj = k+0.0 # !!! deep copy
-        k -= k1
-        detsumj1 = k
-        detj = k1    
-    detsumj = np.nan_to_num(detsumj)    
-    detsumj = np.where(detsumj <= eps,eps,detsumj)
-    logdetsumj = np.log(detsumj)
-    detsumj1 = np.nan_to_num(detsumj1)
-    detsumj1 = np.where(detsumj1 <= eps,eps,detsumj1)
-    logdetsumj1 = np.log(detsumj1)
-    detj = np.nan_to_num(detj)
-    detj = np.where(detj <= eps,eps,detj)
-    logdetj = np.log(detj)
-#  test statistic
-    lnRj = n*( p*( j*np.log(j)-(j-1)*np.log(j-1.) ) + (j-1)*logdetsumj1 + logdetj - j*logdetsumj )  
-    if (bands==9) or (bands==4) or (bands==1):
-#      full quad, dual pol or intensity (p = 3, 2 or 1)      
-        f =p**2
+    import os
+    from auxil.wishart import Cpv
+    statedir,state,fn,y0,y1 = arg5
+    k = len(state['fns'])
+    rows,cols,bands = state['rows'],state['cols'],state['bands']
+    olddir = os.path.join(statedir,str(k))
+    newdir = os.path.join(statedir,str(k+1))
+#  the median filter needs one row of context above and below the block    
+    if state['medianfilter']:
+        t0,t1 = max(y0-1,0),min(y1+1,rows)
     else:
-#      quad and dual diagonal matrix cases (f = 3 or 2, p1 = p2 (= p3) =: p = 1)
-        f = bands
-        p = 1
-    rhoj = 1 - (2.*p**2 - 1)*(1. + 1./(j*(j-1)))/(6.*p*n)
-    omega2j = -(f/4.)*(1.-1./rhoj)**2 + (1./(24.*n*n))*p*p*(p*p-1)*(1+(2.*j-1)/(j*(j-1))**2)/rhoj**2     
-#  return (p-values, lnRj)  
-    Z = -2*rhoj*lnRj
-    return ( 1.0-((1.-omega2j)*stats.chi2.cdf(Z,[f])+omega2j*stats.chi2.cdf(Z,[f+4])), lnRj )
+        t0,t1 = y0,y1
+    i0 = (y0-t0)*cols
+    m = (y1-y0)*cols
+    img = getimg(fn,[0,t0,cols,t1-t0])
+    if img.shape != ((t1-t0)*cols,bands):
+        raise ValueError('%s does not match the dimensions of the state images'%fn)
+    cpv = Cpv(state['enl'],bands)
+    if k > 0:
+        cpv.load(olddir,k,t0*cols,t1*cols)
+    first = [state_rows(olddir,'first',ell,y0*cols,y1*cols) for ell in range(k)]
+    dirs = [state_rows(olddir,'dirs',ell,y0*cols,y1*cols) for ell in range(k)]
+    for ell,pv,_ in cpv.update(img):
+        if state['medianfilter']:
+            pv = call_median_filter(np.reshape(pv,(t1-t0,cols))).ravel()
+        idx = np.flatnonzero((pv[i0:i0+m] <= state['significance']) & (first[ell] == 0))
+        first[ell][idx] = k
+        dirs[ell][idx] = cpv.direction(ell,idx+i0)
+    first.append(np.zeros(m,dtype=np.uint8))
+    dirs.append(np.zeros(m,dtype=np.uint8))
+    cpv.save(newdir,y0*cols,i0,m)
+    for ell in range(k+1):
+        for name,arr in (('first',first[ell]),('dirs',dirs[ell])):
+            out = np.load(os.path.join(newdir,'%s%i.npy'%(name,ell)),mmap_mode='r+')
+            out[y0*cols:y1*cols] = arr
+            out.flush()
 
-def change_maps(pvarray,significance):
+def seq_append(statedir,state,fn,tile=256,backend='serial',workers=None):
+    '''Ingest image fn into the change detection state kept in directory statedir,
+       in row blocks of tile rows. The new state is written next to the old one 
+       and becomes current when state.json is replaced'''
     import numpy as np
-    k = pvarray.shape[0] 
-    n = pvarray.shape[2]
-#  map of most recent change occurrences
-    cmap = np.zeros(n,dtype=np.byte)    
-#  map of first change occurrence
-    smap = np.zeros(n,dtype=np.byte)
-#  change frequency map 
-    fmap = np.zeros(n,dtype=np.byte)
-#  bitemporal change maps
-    bmap = np.zeros((n,k-1),dtype=np.byte)  
-    for ell in range(k-1):        
-        pvQ = pvarray[ell,k-1,:]    
-        for j in range(ell,k-1): 
-            pv = pvarray[ell,j,:] 
-            idx = np.where((pv<=significance)&(pvQ<=significance)&(cmap==ell)) 
-            fmap[idx] += 1 
-            cmap[idx] = j+1 
-            bmap[idx,j] = 1 
-            if ell==0:
-                smap[idx] = j+1    
-    return (cmap,smap,fmap,bmap) 
+    import os, json, shutil
+    from auxil.wishart import Cpv
+    from auxil.parallel import pmap
+    k = len(state['fns'])
+    rows,cols,bands = state['rows'],state['cols'],state['bands']
+    if k >= 255:
+        raise ValueError('at most 255 images can be appended')
+    newdir = os.path.join(statedir,str(k+1))
+    cpv = Cpv(state['enl'],bands)
+    cpv.k = k+1
+    cpv.allocate(newdir,rows*cols)
+    for ell in range(k+1):
+        for name in ('first','dirs'):
+            np.lib.format.open_memmap(os.path.join(newdir,'%s%i.npy'%(name,ell)),'w+',np.uint8,(rows*cols,))
+    args = [(statedir,state,fn,y0,min(y0+tile,rows)) for y0 in range(0,rows,tile)]
+    list(pmap(append_tile,args,backend,workers))
+    state['fns'].append(os.path.abspath(fn))
+    tmp = os.path.join(statedir,'state.json.tmp')
+    with open(tmp,'w') as f:
+        json.dump(state,f,indent=1)
+    os.replace(tmp,os.path.join(statedir,'state.json'))
+    shutil.rmtree(os.path.join(statedir,str(k)),ignore_errors=True)
 
-def getpvQ(lnQ,bands,k,n):
-    import math
-    from scipy import stats
-#  test statistic 
-    if (bands==9) or (bands==4) or (bands==1):
-#      full quad, dual pol or intensity (p = 3, 2 or 1)   
-        p = math.sqrt(bands)   
-        f =(k-1)*p**2
-        rho = 1.0 - (2*p**2-1)*(k/n-1.0/(n*k))/(6.0*(k-1)*p)
-        omega2 = p**2*(p**2-1)*(k/n**2 - 1.0/(n*n*k*k))/(24.0*rho**2) - p**2*(k-1)*(1.0-1.0/rho)**2/4.0
-    elif bands==2:
-#      dual diagonal matrix case, 
-        f = 2.0*(k-1)
-        rho = 1.0 - (k/n-1.0/(n*k))/(6.0*(k-1))
-        omega2 = -(k-1)*(1.0-1/rho)**2/2.0     
-    else: 
-#      quad diagonal matrix case
-        f = 3.0*(k-1)
-        rho = 1.0 - (k/n-1.0/(n*k))/(6.0*(k-1))
-        omega2 = -3.0*(k-1)*(1.0-1/rho)**2/4.0  
-#  return p-value  
-    Z = -2*rho*lnQ 
-    return 1.0-((1.-omega2)*stats.chi2.cdf(Z,[f])+omega2*stats.chi2.cdf(Z,[f+4]))   
+def seq_maps(arg5):
+    '''Return change maps (cmap,smap,fmap,bmap) for the row block y0 ... y1-1 of
+       all images in the state kept in directory statedir, and the ATSF image 
+       if atsf is set'''
+    import numpy as np
+    import os
+    from auxil.wishart import getpvQ
+    statedir,state,atsf,y0,y1 = arg5
+    k = len(state['fns'])
+    cols,bands = state['cols'],state['bands']
+    n = np.float64(state['enl'])
+    path = os.path.join(statedir,str(k))
+    i0,i1 = y0*cols,y1*cols
+    m = i1-i0
+    cmap = np.zeros(m,dtype=np.byte)
+    smap = np.zeros(m,dtype=np.byte)
+    fmap = np.zeros(m,dtype=np.byte)
+    bmap = np.zeros((m,k-1),dtype=np.byte)
+#  follow the chain of changes: pixels unchanged since ell for which the omnibus 
+#  test is significant change at the first image with significant R^ell_j     
+    for ell in range(k-1):
+        pvQ = getpvQ(state_rows(path,'lnQ',ell,i0,i1),bands,k-ell,n)
+        first = state_rows(path,'first',ell,i0,i1)
+        idx = np.flatnonzero((cmap == ell) & (first > 0) & (pvQ <= state['significance']))
+        if idx.size == 0:
+            continue
+        j = first[idx]
+        fmap[idx] += 1
+        cmap[idx] = j
+        bmap[idx,j-1] = state_rows(path,'dirs',ell,i0,i1)[idx]
+        if ell == 0:
+            smap[idx] = j
+    result = ( np.reshape(cmap,(y1-y0,cols)),
+               np.reshape(smap,(y1-y0,cols)),
+               np.reshape(fmap,(y1-y0,cols)),
+               np.reshape(bmap,(y1-y0,cols,k-1)) )
+    if atsf:
+#      mean since the most recent change         
+        avimg = np.zeros((m,bands),dtype=np.float32)
+        for ell in range(k):
+            idx = np.flatnonzero(cmap == ell)
+            if idx.size > 0:
+                avimg[idx] = state_rows(path,'sums',ell,i0,i1)[idx]/(n*(k-ell))
+        result += (np.reshape(avimg,(y1-y0,cols,bands)),)
+    return result
                        
 def main():  
     import numpy as np
-    import os, sys, time, getopt
+    import os, sys, time, getopt, json
     from osgeo import gdal
-    from auxil import subset
-    from ipyparallel import Client 
-    from osgeo.gdalconst import GA_ReadOnly, GDT_Byte
-    from tempfile import NamedTemporaryFile
+    from auxil import subset, gdalio
+    from auxil.registersar import register_stack
+    from auxil.parallel import pmap, backends
+    from osgeo.gdalconst import GA_ReadOnly, GDT_Byte, GDT_Float32
     usage = '''
 Usage:
 ------------------------------------------------
@@ -329,6 +240,19 @@ Options:
                it is assumed that the images are co-registered and have identical spatial dimensions  
   -m           run 3x3 median filter over p-values   
   -s  <float>  significance level for change detection (default 0.0001)
+  -t  <int>    (or --tile) process the images in blocks of this many rows, 
+               peak memory per worker is then proportional to block size x number of images 
+               (default 256)
+  -j  <int>    number of workers for the pool backend (default number of cores)
+  --backend <str>  execution backend for co-registration and row blocks: 
+               serial, pool (local process pool) or ipp (running ipyparallel cluster) (default pool)
+  -a           also write the ATSF (adaptive temporal speckle filter) image, the mean 
+               of each pixel since its most recent change
+  --append <dir>  incremental mode: ingest the infiles into the state directory dir 
+               (created with the first infiles if it does not exist) and write the 
+               change maps for all images ingested so far. Only the new images are read, 
+               enl, -d, -m and -s are taken from an existing state. The state holds the 
+               running sums and, for each image, the first later change and its direction
 
 infiles:
 
@@ -344,33 +268,68 @@ enl:
 
 -------------------------------------------------'''%sys.argv[0]
 
-    options,args = getopt.getopt(sys.argv[1:],'hmd:s:')
+    options,args = getopt.getopt(sys.argv[1:],'hmad:s:t:j:',['tile=','append=','backend='])
     dims = None
     significance = 0.0001
     medianfilter = False
+    tile = None
+    backend = 'pool'
+    workers = None
+    atsf = False
+    statedir = None
     for option, value in options: 
         if option == '-h':
             print( usage )
             return 
         elif option == '-m':
             medianfilter = True
+        elif option == '-a':
+            atsf = True
+        elif option == '--append':
+            statedir = value
         elif option == '-d':
             dims = eval(value)
         elif option == '-s':
             significance = eval(value)   
-    if len(args)<4:
+        elif option in ('-t','--tile'):
+            tile = eval(value)
+        elif option == '-j':
+            workers = eval(value)
+        elif option == '--backend':
+            backend = value
+    if backend not in backends:
+        print('backend must be one of %s'%str(backends))
+        print( usage )
+        sys.exit()
+    state = None
+    if statedir is not None and os.path.exists(os.path.join(statedir,'state.json')):
+#      append to an existing state, its parameters take precedence    
+        with open(os.path.join(statedir,'state.json')) as f:
+            state = json.load(f)
+    if len(args) < (3 if state is not None else 4):
         print('incorrect number of arguments')
         print( usage )
         sys.exit()
-    k = len(args)-2
-    fns = args[0:k]  
+    fns = args[0:-2]  
     n = np.float64(eval(args[-1])) 
     outfn = args[-2]
+    if state is not None:
+        n = np.float64(state['enl'])
+        significance = state['significance']
+        medianfilter = state['medianfilter']
+        dims = state['dims']
+        k = len(state['fns']) + len(fns)
+        reference = state['reference']
+        fn1 = state['fns'][0]
+    else:
+        k = len(fns)
+        reference = fns[0]
+        fn1 = fns[0]
     gdal.AllRegister()   
     start = time.time()    
 #  first SAR image   
     try:            
-        inDataset1 = gdal.Open(fns[0],GA_ReadOnly)                             
+        inDataset1 = gdal.Open(fn1,GA_ReadOnly)                             
         cols = inDataset1.RasterXSize
         rows = inDataset1.RasterYSize    
         bands = inDataset1.RasterCount
@@ -380,29 +339,26 @@ enl:
     if dims is not None:
 #  images are not yet co-registered, so subset first image and register the others
         _,_,cols,rows = dims
-        fn0 = subset.subset(fns[0],dims)
-        args1 = [(fns[0],fns[i],dims) for i in range(1,k)]
-        try:
-            print( ' \nattempting parallel execution of co-registration ...' ) 
-            start1 = time.time()  
-            c = Client()
-            print( 'available engines %s'%str(c.ids) )
-            v = c[:]  
-            v.execute('from registersar import register') 
-            fns = v.map_sync(call_register,args1)
-            print( 'elapsed time for co-registration: '+str(time.time()-start1) ) 
-        except Exception as e: 
-            start1 = time.time()
-            print( '%s \nFailed, so running sequential co-registration ...'%e )
-            fns = list(map(call_register,args1))  
-        fns.insert(0,fn0)  
-#      point inDataset1 to the subset image for correct georefrerencing         
-        inDataset1 = gdal.Open(fn0,GA_ReadOnly)           
+        if state is None:
+            fn0 = subset.subset(fns[0],dims)
+            fns = fns[1:]
+        print( ' \nco-registration (%s) ...'%backend ) 
+        start1 = time.time()  
+        result = register_stack(reference,fns,dims,backend=backend,workers=workers)
+        if result is None:
+            print( 'co-registration failed' )
+            sys.exit(1)
+        fns = result[0]    
+        print( 'elapsed time for co-registration: '+str(time.time()-start1) ) 
+        if state is None:
+            fns.insert(0,fn0)  
+#          point inDataset1 to the subset image for correct georefrerencing         
+            inDataset1 = gdal.Open(fn0,GA_ReadOnly)           
     print( '===============================================' )
     print( '     Multi-temporal SAR Change Detection' )
     print( '===============================================' )   
     print( time.asctime() )  
-    print( 'First (reference) filename:  %s'%fns[0] )
+    print( 'First (reference) filename:  %s'%(fns[0] if state is None else state['fns'][0]) )
     print( 'number of images: %i'%k )
     print( 'equivalent number of looks: %f'%n )
     print( 'significance level: %f'%significance )
@@ -417,116 +373,68 @@ enl:
     else:
         print( 'Intensity image' )
 #  output file
-    path = os.path.abspath(fns[0])    
+    path = os.path.abspath(fns[0] if state is None else state['fns'][0])
     dirn = os.path.dirname(path)
     outfn = dirn + '/' + outfn 
-#  create temporary, memory-mapped array of change indices p(Ri<ri)
-    mm = NamedTemporaryFile()
-    pvarray = np.memmap(mm.name,dtype=np.float64,mode='w+',shape=(k,k,rows*cols))  
-    print( 'pre-calculating Rj and p-values ...' ) 
-    start1 = time.time() 
-    try:
-        print( 'attempting parallel calculation ...' ) 
-        c = Client()
-        print( 'available engines %s'%str(c.ids) )
-        v = c[:]   
-        print( 'ell = ', flush=True )     
-        for i in range(k-1):  
-            print( i+1, flush=True )               
-            args1 = [(fns[i:j+2],n,cols,rows,bands) for j in range(i,k-1)]         
-            results = v.map_sync(PV,args1) # list of tuples (p-value, lnRj)
-            pvs = [result[0] for result in results] 
-            if medianfilter:
-                pvs = v.map_sync(call_median_filter,pvs)
-            lnRjs = np.array([result[1] for result in results]) 
-            lnQ = np.sum(lnRjs,axis=0)          
-            pvQ = getpvQ(lnQ,bands,k-i,n)       
-            for j in range(i,k-1):
-                pvarray[i,j,:] = pvs[j-i].ravel() 
-            pvarray[i,k-1,:] = pvQ.ravel()    
-    except Exception as e: 
-        print( '%s \nfailed, so running sequential calculation ...'%e )  
-        print( 'ell= ', flush=True)  
-        for i in range(k-1):        
-            print( i+1, flush=True)   
-            args1 = [(fns[i:j+2],n,cols,rows,bands) for j in range(i,k-1)]                         
-            results = list(map(PV,args1))  # list of tuples (p-value, lnRj)
-            pvs = [result[0] for result in results] 
-            if medianfilter:
-                pvs = map(call_median_filter,pvs) 
-            lnRjs = np.array([result[1] for result in results]) 
-            lnQ = np.sum(lnRjs,axis=0)
-            pvQ = getpvQ(lnQ,bands,k-i,n)                   
-            for j in range(i,k-1):
-                pvarray[i,j,:] = pvs[j-i].ravel() 
-            pvarray[i,k-1,:] = pvQ.ravel()  
-    print( '\nelapsed time for p-value calculation: '+str(time.time()-start1) )    
-    
-    cmap,smap,fmap,bmap = change_maps(pvarray,significance)   
-#  post process bmap for Loewner direction   
-    avimg = getimg(fns[0])
-    r = 1.0 
-    for i in range(k-1):
-        img = getimg(fns[i+1])
-        direct = loewner(img-avimg)
-        bmap[:,i] = np.where(bmap[:,i],direct,bmap[:,i])
-        r += 1.0
-        avimg = avimg + (img-avimg)/r
-        for j in range(bands): 
-#          reset avimg where change occurred
-            avimg[:,j] = np.where(bmap[:,i],img[:,j],avimg[:,j])
-#  write to file system    
-    cmap = np.reshape(cmap,(rows,cols))
-    fmap = np.reshape(fmap,(rows,cols))
-    smap = np.reshape(smap,(rows,cols))
-    bmap = np.reshape(bmap,(rows,cols,k-1))
-    driver = inDataset1.GetDriver() 
+#  output files, written block by block    
     basename = os.path.basename(outfn)
     name, _ = os.path.splitext(basename)
-    outfn1=outfn.replace(name,name+'_cmap')
-    outDataset = driver.Create(outfn1,cols,rows,1,GDT_Byte)
-    geotransform = inDataset1.GetGeoTransform()
-    if geotransform is not None:
-        outDataset.SetGeoTransform(geotransform)
-    projection = inDataset1.GetProjection()        
-    if projection is not None:
-        outDataset.SetProjection(projection)     
-    outBand = outDataset.GetRasterBand(1)
-    outBand.WriteArray(cmap,0,0) 
-    outBand.FlushCache() 
-    print( 'last change map written to: %s'%outfn1 )  
-    outfn2=outfn.replace(name,name+'_fmap')
-    outDataset = driver.Create(outfn2,cols,rows,1,GDT_Byte)
-    if geotransform is not None:
-        outDataset.SetGeoTransform(geotransform)      
-    if projection is not None:
-        outDataset.SetProjection(projection)     
-    outBand = outDataset.GetRasterBand(1)
-    outBand.WriteArray(fmap,0,0) 
-    outBand.FlushCache() 
-    print( 'frequency map written to: %s'%outfn2 )     
-    outfn3=outfn.replace(name,name+'_bmap')
-    outDataset = driver.Create(outfn3,cols,rows,k-1,GDT_Byte)
-    if geotransform is not None:
-        outDataset.SetGeoTransform(geotransform)       
-    if projection is not None:
-        outDataset.SetProjection(projection)  
-    for i in range(k-1):        
-        outBand = outDataset.GetRasterBand(i+1)
-        outBand.WriteArray(bmap[:,:,i],0,0) 
-        outBand.FlushCache() 
-    print( 'bitemporal map image written to: %s'%outfn3 )    
-    outfn4=outfn.replace(name,name+'_smap')
-    outDataset = driver.Create(outfn4,cols,rows,1,GDT_Byte)
-    if geotransform is not None:
-        outDataset.SetGeoTransform(geotransform)      
-    if projection is not None:
-        outDataset.SetProjection(projection)     
-    outBand = outDataset.GetRasterBand(1)
-    outBand.WriteArray(smap,0,0) 
-    outBand.FlushCache() 
-    print( 'first change map written to: %s'%outfn4 )         
+    outfns = []
+    outDatasets = []    
+    outputs = [('_cmap',1,GDT_Byte),('_smap',1,GDT_Byte),('_fmap',1,GDT_Byte),('_bmap',k-1,GDT_Byte)]
+    if atsf:
+        outputs.append(('_atsf',bands,GDT_Float32))
+    for suffix,nbands,dtype in outputs:
+        outfns.append(outfn.replace(name,name+suffix))
+#      no bitemporal maps for a single image        
+        if nbands > 0:
+            outDatasets.append(gdalio.create(outfns[-1],cols,rows,nbands,like=inDataset1,dtype=dtype))
+        else:
+            outDatasets.append(None)
+    start1 = time.time() 
+    if tile is None:
+        tile = 256
+    print( 'row blocks of %i rows, backend: %s'%(tile,backend) )                
+    y0s = list(range(0,rows,tile))
+    if statedir is not None:
+#      only the new images are read, the p-values of earlier ones come from the state    
+        if state is None:
+            state = {'enl':float(n),'significance':significance,'medianfilter':medianfilter,
+                     'dims':dims,'reference':os.path.abspath(reference),
+                     'rows':rows,'cols':cols,'bands':bands,'fns':[]}
+        for fn in fns:
+            print( 'appending %s to state %s ...'%(fn,statedir), flush=True )
+            seq_append(statedir,state,fn,tile,backend,workers)
+        print( 'calculating change maps ...' )     
+        args1 = [(statedir,state,atsf,y0,min(y0+tile,rows)) for y0 in y0s]
+        blocks = zip(y0s,pmap(seq_maps,args1,backend,workers))
+    else:
+        print( 'calculating Rj, p-values and change maps ...' ) 
+#      workers read their own row blocks, only the byte maps are returned    
+        args1 = [(fns,n,bands,cols,rows,y0,min(y0+tile,rows),significance,medianfilter,atsf) for y0 in y0s]
+        blocks = zip(y0s,pmap(seq_tile,args1,backend,workers))
+    for y0,maps in blocks:
+        print( 'rows %i to %i'%(y0,y0+maps[0].shape[0]-1), flush=True )
+#      cmap, smap, fmap, bmap and ATSF 
+        for outDataset,img in zip(outDatasets,maps):
+            if outDataset is None:
+                continue
+            if img.ndim == 3:
+                img = np.moveaxis(img,2,0)
+            gdalio.write(outDataset,img,0,y0)
+    for outDataset in outDatasets:
+        if outDataset is not None:
+            outDataset.FlushCache()         
+    print( 'elapsed time for change maps: '+str(time.time()-start1) )           
+    print( 'last change map written to: %s'%outfns[0] )  
+    print( 'first change map written to: %s'%outfns[1] )    
+    print( 'frequency map written to: %s'%outfns[2] )     
+    if k > 1:
+        print( 'bitemporal map image written to: %s'%outfns[3] )  
+    if atsf:
+        print( 'ATSF image written to: %s'%outfns[4] )
     print( 'total elapsed time: '+str(time.time()-start) )   
+    outDatasets = None    
     outDataset = None    
     inDataset1 = None        
     
@@ -0,0 +1,4 @@
+import os, sys
+
+#  the auxil and scripts packages live in src
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,162 @@
+import sys
+import types
+import numpy as np
+import pytest
+from auxil import eeFake
+
+class Widget(object):
+    '''stand-in for every ipywidgets and ipyleaflet class'''
+    def __init__(self,*args,**kwargs):
+        self.__dict__.update(kwargs)
+        self.children = args[0] if args else []
+        self.layers = [0,1,2]
+        self.log = []
+    def __call__(self,*args,**kwargs):
+        return Widget(*args,**kwargs)
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        return False
+    def on_click(self,f):
+        pass
+    def observe(self,f,names=None):
+        pass
+    def on_draw(self,f):
+        pass
+    def clear_output(self,*args,**kwargs):
+        pass
+    def add_control(self,control):
+        pass
+    def add_layer(self,layer):
+        self.layers.append(layer)
+    def remove_layer(self,layer):
+        self.layers.remove(layer)
+    def append_stdout(self,text):
+        self.log.append(text)
+    def append_display_data(self,obj):
+        self.log.append(repr(obj))
+
+def stub(monkeypatch,name,**attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    monkeypatch.setitem(sys.modules,name,module)
+    return module
+
+@pytest.fixture
+def ee(monkeypatch):
+    monkeypatch.setitem(sys.modules,'ee',eeFake)
+    import auxil.eeWishart
+    monkeypatch.setattr(auxil.eeWishart,'ee',eeFake,raising=False)
+    eeFake.synthetic_s1(k=6,rows=30,cols=40)
+    return eeFake
+
+@pytest.fixture
+def gui(ee,monkeypatch):
+    '''eeSar_seq imported with the widget modules stubbed'''
+    stub(monkeypatch,'ipywidgets',__getattr__=lambda name: Widget)
+    stub(monkeypatch,'IPython')
+    stub(monkeypatch,'IPython.display',display=lambda *args,**kwargs: None)
+    names = ('Map','DrawControl','TileLayer','basemaps','basemap_to_tiles','LayersControl',
+             'MeasureControl','FullScreenControl','SplitMapControl')
+    stub(monkeypatch,'ipyleaflet',**{name:Widget() for name in names})
+    stub(monkeypatch,'geopy')
+    stub(monkeypatch,'geopy.geocoders',photon=types.SimpleNamespace(Photon=Widget))
+    monkeypatch.delitem(sys.modules,'auxil.eeSar_seq',raising=False)
+    import auxil.eeSar_seq as module
+    monkeypatch.delitem(sys.modules,'auxil.eeSar_seq')
+#  the stubs keep the constructor arguments, widget values are strings    
+    for name in dir(module):
+        widget = getattr(module,name)
+        if name.startswith('w_') and isinstance(getattr(widget,'value',None),str):
+            try:
+                widget.value = (int if name in ('w_relativeorbitnumber','w_stride') else float)(widget.value)
+            except ValueError:
+                pass
+    module.poly = ee.Geometry.Polygon([[[6.30,50.90],[6.45,50.90],[6.45,50.98],[6.30,50.98],[6.30,50.90]]])
+    module.m = Widget()
+    return module
+
+def test_profile_omnibus(ee):
+    from auxil import eeWishart
+    collection = ee.ImageCollection('COPERNICUS/S1_GRD').sort('system:time_start')
+    imList = collection.map(lambda image: image.select('VV','VH').multiply(np.log(10.0)/10.0).exp()).toList(100)
+    result = ee.Dictionary(eeWishart.omnibus(imList,0.01,4.4,False))
+    record = ee.profile(lambda: ee.Image(result.get('cmap')).getInfo())
+    assert record['getInfo'] == 1
+    assert record['graph_nodes'] > 0 and record['graph_bytes'] > 0
+    assert record['evaluations'] > 0
+
+def test_profile_handlers(gui,ee):
+    first = ee.profile(gui.on_collect_button_clicked,None)
+    assert first['getInfo'] == 1
+    assert first['graph_nodes'] > 0
+    assert gui.count == 6
+#  the collection metadata is cached    
+    second = ee.profile(gui.on_collect_button_clicked,None)
+    assert second['getInfo'] == 0 and second['graph_nodes'] == 0
+    first = ee.profile(gui.on_preview_button_clicked,None)
+    assert first['getInfo'] == 0
+    assert first['getMapId'] == 1
+#  and so is the tile layer of an unchanged preview
+    second = ee.profile(gui.on_preview_button_clicked,None)
+    assert second['getMapId'] == 0 and second['evaluations'] == 0
+
+def test_mapids_expire(gui,ee,monkeypatch):
+    gui.on_collect_button_clicked(None)
+    assert ee.profile(gui.on_preview_button_clicked,None)['getMapId'] == 1
+    monkeypatch.setattr(gui,'mapid_lifetime',-1)
+    assert ee.profile(gui.on_preview_button_clicked,None)['getMapId'] == 1
+
+def test_superseded_collect_publishes_nothing(gui,ee,monkeypatch,capsys):
+#  as if a widget changed while the handler was running    
+    monkeypatch.setattr(gui._local,'generation',gui.generation-1,raising=False)
+    gui.on_collect_button_clicked(None)
+    assert not hasattr(gui,'result')
+    assert 'Error' not in capsys.readouterr().out
+
+def queue(gui):
+    '''occupy the single handler worker until the returned event is set'''
+    import threading
+    release = threading.Event()
+    def on_reset_button_clicked(b):
+        release.wait(10)
+    gui.background(on_reset_button_clicked)(None)
+    return release
+
+def recording(name,calls,gui):
+    '''a handler named name that records the change map type it sees and prints'''
+    def handler(b):
+        calls.append(gui.w_changemap.value)
+        print('ran %s'%name)
+    handler.__name__ = name
+    return gui.background(handler)
+
+def test_on_click_dedupes_and_replaces(gui,monkeypatch):
+    monkeypatch.setattr(sys,'stdout',sys.stdout)
+    calls = []
+    preview = recording('on_preview_button_clicked',calls,gui)
+    release = queue(gui)
+    preview(None)
+    preview(None)
+    gui.w_changemap.value = 'Last'
+    preview(None)
+    release.set()
+    gui.pending['on_preview_button_clicked'].result(10)
+#  the identical click is ignored, the queued one replaced by the new map type    
+    assert calls == ['Last']
+#  print() in the background goes to w_out
+    assert 'ran on_preview_button_clicked\n' in ''.join(gui.w_out.log)
+
+def test_widget_change_keeps_exports(gui,monkeypatch):
+    monkeypatch.setattr(sys,'stdout',sys.stdout)
+    calls = []
+    preview = recording('on_preview_button_clicked',calls,gui)
+    export = recording('on_export_drv_button_clicked',calls,gui)
+    release = queue(gui)
+    preview(None)
+    export(None)
+    gui.on_widget_change({'new':0})
+    release.set()
+    gui.pending['on_export_drv_button_clicked'].result(10)
+    assert gui.pending['on_preview_button_clicked'].cancelled()
+    assert len(calls) == 1
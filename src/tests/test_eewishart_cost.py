@@ -0,0 +1,44 @@
+import sys
+import numpy as np
+import pytest
+from auxil import eeFake
+
+@pytest.fixture
+def ee(monkeypatch):
+    monkeypatch.setitem(sys.modules,'ee',eeFake)
+    import auxil.eeWishart
+    monkeypatch.setattr(auxil.eeWishart,'ee',eeFake,raising=False)
+    return eeFake
+
+def cost(ee,k,monkeypatch):
+    '''evaluations and (calls, images summed) of ImageCollection.reduce
+       for the change map of k images'''
+    from auxil import eeWishart
+    reduce = ee._impl['ImageCollection.reduce']
+    calls = [0,0]
+    def counting(images,reducer):
+        calls[0] += 1
+        calls[1] += len(images)
+        return reduce(images,reducer)
+    monkeypatch.setitem(ee._impl,'ImageCollection.reduce',counting)
+    rng = np.random.default_rng(k)
+    for i in range(k):
+        ee.assets['test/img%i'%i] = ee._Img(['VV','VH'],rng.gamma(4.4,1/4.4,(2,8,8)),{})
+    ee.reset()
+    imList = ee.List([ee.Image('test/img%i'%i) for i in range(k)])
+    result = ee.Dictionary(eeWishart.omnibus(imList,0.01,4.4,False))
+    ee.evaluate(ee.Image(result.get('cmap')))
+    return ee.counters['evaluations'],calls
+
+def test_no_prefix_sums(ee,monkeypatch):
+    '''the running sums are carried through the iteration, no (ell, j)
+       re-sums the images of its interval'''
+    for k in (4,8):
+        _,calls = cost(ee,k,monkeypatch)
+        assert calls == [0,0]
+
+def test_evaluations_quadratic(ee,monkeypatch):
+    '''a fixed number of evaluations per (ell, j) pair'''
+    evaluations = [cost(ee,k,monkeypatch)[0] for k in (4,6,8,10,12)]
+    second = np.diff(evaluations,2)
+    assert np.all(second == second[0])
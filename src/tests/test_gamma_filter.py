@@ -0,0 +1,21 @@
+import importlib.util
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+pytest.importorskip('ipyparallel')
+
+def load():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'scripts','gamma_filter.py')
+    spec = importlib.util.spec_from_file_location('gamma_filter',path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.mark.parametrize('rows,cols',[(12,5),(5,12)])
+def test_small_image_unchanged(rows,cols):
+    '''images without interior pixels are returned as they are'''
+    inimage = np.random.default_rng(0).gamma(4.4,1/4.4,(1,rows,cols))
+    result = load().gamma_filter((0,inimage,rows,cols,4.4))
+    np.testing.assert_array_equal(result,inimage[0])
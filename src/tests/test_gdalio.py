@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+from auxil import gdalio
+
+def dataset(bands=3,rows=6,cols=5):
+    ds = gdal.GetDriverByName('MEM').Create('',cols,rows,bands,gdal.GDT_Float32)
+    for b in range(bands):
+        ds.GetRasterBand(b+1).WriteArray(np.full((rows,cols),b+1.0))
+    return ds
+
+def test_read_view_of_out():
+    out = np.empty((2,6,5))
+    X = gdalio.read(dataset(),pos=[3,1],out=out)
+    assert np.shares_memory(X,out)
+    np.testing.assert_array_equal(X[0],[3.0,1.0])
+
+def test_read_rejects_noncontiguous_out():
+    out = np.empty((3,8,5))[:,:6,:]
+    with pytest.raises(ValueError):
+        gdalio.read(dataset(),out=out)
@@ -0,0 +1,80 @@
+import importlib.util
+import os
+import sys
+import numpy as np
+import pytest
+from scipy import ndimage
+from auxil import eeFake, wishart
+
+K, ROWS, COLS, ENL = 6, 24, 20, 4.4
+SIGNIFICANCE = 0.01
+
+def stack(seed=0):
+    '''K dual pol diagonal (VV, VH) images [rows,cols,2], changed in the
+       lower half at the middle of the series and in a corner at the end'''
+    rng = np.random.default_rng(seed)
+    imgs = []
+    for t in range(K):
+        mean = np.empty((ROWS,COLS,2))
+        mean[...,0], mean[...,1] = 0.1, 0.02
+        if t >= K//2:
+            mean[ROWS//2:,:,0] *= 4
+        if t == K-1:
+            mean[:6,:6,1] *= 6
+        imgs.append(mean*rng.gamma(ENL,1.0/ENL,mean.shape))
+    return imgs
+
+@pytest.fixture(scope='module')
+def sar_seqQ():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'scripts','sar_seqQ.py')
+    spec = importlib.util.spec_from_file_location('sar_seqQ',path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def ee(monkeypatch):
+    monkeypatch.setitem(sys.modules,'ee',eeFake)
+    eeFake.reset()
+    import auxil.eeWishart
+    monkeypatch.setattr(auxil.eeWishart,'ee',eeFake,raising=False)
+    return eeFake
+
+def run_seq_tile(sar_seqQ,imgs,median,monkeypatch):
+    fns = ['img%i'%i for i in range(K)]
+    def getimg(fn,dims=None):
+        x0,y0,cols,rows = dims
+        return np.reshape(imgs[fns.index(fn)][y0:y0+rows,x0:x0+cols],(-1,2))
+    monkeypatch.setattr(sar_seqQ,'getimg',getimg)
+    return sar_seqQ.seq_tile((fns,ENL,2,COLS,ROWS,0,ROWS,SIGNIFICANCE,median,False))
+
+def run_ee(ee,imgs,median):
+    from auxil import eeWishart
+    for i,img in enumerate(imgs):
+        ee.assets['test/img%i'%i] = eeFake._Img(['VV','VH'],np.transpose(img,(2,0,1)),{})
+    imList = ee.List([ee.Image('test/img%i'%i) for i in range(K)])
+    result = ee.Dictionary(eeWishart.omnibus(imList,SIGNIFICANCE,ENL,median))
+    return {key:ee.evaluate(ee.Image(result.get(key))).data for key in ('cmap','smap','fmap','bmap','pvQ')}
+
+@pytest.mark.parametrize('median',[False,True])
+def test_seq_tile_matches_wishart(sar_seqQ,median,monkeypatch):
+    imgs = stack()
+    cmap,smap,fmap,bmap = run_seq_tile(sar_seqQ,imgs,median,monkeypatch)
+    ref = wishart.omnibus(imgs,SIGNIFICANCE,ENL,median)
+    assert ref['cmap'].any()
+    for key,value in zip(('cmap','smap','fmap','bmap'),(cmap,smap,fmap,bmap)):
+        np.testing.assert_array_equal(value,ref[key],err_msg=key)
+
+@pytest.mark.parametrize('median',[False,True])
+def test_ee_matches_wishart(ee,median):
+    imgs = stack()
+    ref = wishart.omnibus(imgs,SIGNIFICANCE,ENL,median)
+    result = run_ee(ee,imgs,median)
+    if median:
+#      the ee path also median filters the omnibus P-values, see eeWishart.omnibus
+        np.testing.assert_allclose(result['pvQ'][0],ndimage.median_filter(ref['pvQ'],size=3),atol=1e-9)
+        return
+    np.testing.assert_allclose(result['pvQ'][0],ref['pvQ'],atol=1e-9)
+    for key in ('cmap','smap','fmap'):
+        np.testing.assert_array_equal(result[key][0],ref[key],err_msg=key)
+    np.testing.assert_array_equal(np.transpose(result['bmap'],(1,2,0)),ref['bmap'])
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+import scipy.ndimage as ndii
+from auxil import auxil1
+
+def pair(N, angle, dy, dx, scale, seed=2):
+    '''reference band and a rotated, scaled and shifted target'''
+    rng = np.random.default_rng(seed)
+    big = ndii.gaussian_filter(rng.random((3*N, 3*N)), 2) + 0.1
+    ref = big[N:2*N, N:2*N]
+    r = ndii.rotate(ndii.zoom(big, scale), angle, reshape=False)
+    tgt = r[N+dy:N+dy+N+40, N+dx:N+dx+N+40]
+    return np.log(ref), np.log(np.abs(tgt)+0.001)
+
+@pytest.mark.parametrize('N,angle,dy,dx,scale', [(400, 0, 5, -7, 1.0),
+                                                 (400, 4, 3, 2, 1.0),
+                                                 (400, -3, -4, 6, 1.05),
+                                                 (601, -3, -4, 6, 1.05)])
+def test_pyramid_matches_full_resolution(N, angle, dy, dx, scale):
+    bn0, bn1 = pair(N, angle, dy, dx, scale)
+    s0, a0, t0 = auxil1.similarity(bn0, bn1)
+    s, a, t = auxil1.similarity(bn0, bn1, pyramid=1)
+    assert s == pytest.approx(s0, rel=1e-3)
+    assert a == pytest.approx(a0, abs=0.5)
+    assert np.abs(np.array(t) - np.array(t0)).max() <= 1
+
+def test_reference_is_reused():
+    bn0, bn1 = pair(400, -3, -4, 6, 1.05)
+    ref = auxil1.similarity_reference(bn0, 1)
+    s, a, t = auxil1.similarity(None, bn1, ref)
+    s1, a1, t1 = auxil1.similarity(bn0, bn1, pyramid=1)
+    assert (s, a, list(t)) == (s1, a1, list(t1))
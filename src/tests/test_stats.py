@@ -0,0 +1,16 @@
+import numpy as np
+from auxil.stats import Stats
+
+def test_histogram_without_moments():
+    X = np.random.default_rng(0).normal(size=(1000,2))
+    s = Stats(2,20,(-3,3))
+    t = Stats(2,20,(-3,3),moments=False)
+    u = Stats(2,20,(-3,3),moments=False)
+    s.update(X)
+    t.update(X[:600])
+    u.update(X[600:])
+    t.merge(u)
+    assert t.cpm is None
+    np.testing.assert_array_equal(t.hist,s.hist)
+    np.testing.assert_array_equal(t.min,s.min)
+    np.testing.assert_array_equal(t.max,s.max)